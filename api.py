@@ -0,0 +1,112 @@
+"""
+HTTP search API, decoupled from the Streamlit UI.
+
+    uvicorn api:app --workers 4 --port 8000
+    python api.py        # the same with Config.SEARCH_API_HOST / _PORT / _WORKERS
+
+Each worker process loads the CLIP model, FAISS index and catalog once at startup. The index
+is memory-mapped (Config.INDEX_MMAP), so the workers share one page-cache copy of it.
+Concurrent /search requests within a worker are coalesced by the micro-batching service.
+"""
+import json
+import os
+import sys
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from config import settings
+from genAI import query_intent, llm_gateway
+from genAI.stylist import iter_cached_stylist_outfit
+from train_model import search_engine, search_service
+from utils.memory import process_memory
+
+
+class SearchRequest(BaseModel):
+    query: str
+    num_recommendations: int = 5
+    # an already parsed intent ({"filters": ..., "normalized_query": ...}); parsed here when missing
+    intent: Optional[Dict[str, Any]] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+
+class CatalogJSONResponse(JSONResponse):
+    """JSON for catalog rows, which carry numpy scalars. NaN is rejected rather than sent as invalid JSON."""
+
+    def render(self, content: Any) -> bytes:
+        return json.dumps(content, allow_nan=False, default=lambda v: v.item() if hasattr(v, "item") else str(v)).encode("utf-8")
+
+
+def _searcher():
+    return search_service.get_service() if settings.SEARCH_MICROBATCH else search_engine
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    search_engine.data_load()
+    llm_gateway.get_gateway().warmup()
+    _searcher()
+    print(f"[API] worker {os.getpid()} ready with {len(search_engine.catalog_frame())} products")
+    yield
+
+
+app = FastAPI(title=f"{settings.PROJECT_NAME} API", lifespan=lifespan)
+
+
+# plain `def` endpoints run in FastAPI's thread pool, so searches never block the event loop
+@app.post("/search")
+def search(request: SearchRequest):
+    if request.intent is not None:
+        parsed_intent = (request.intent, None)
+    else:
+        parsed_intent = query_intent.parse_intent(request.query, search_engine.catalog_stats())
+    primary, recommendations = _searcher().search_primary_and_recommendations(
+        request.query, request.num_recommendations, parsed_intent=parsed_intent,
+        nprobe=request.nprobe, ef_search=request.ef_search,
+    )
+    return CatalogJSONResponse({"primary": primary, "recommendations": recommendations, "intent_error": parsed_intent[1]})
+
+
+@app.post("/search/batch")
+def search_batch(request: BatchSearchRequest):
+    intents, error = query_intent.parse_intent_batch(request.queries, search_engine.catalog_stats())
+    results = search_engine.search_batch_and_find_primary(intents, nprobe=request.nprobe, ef_search=request.ef_search)
+    return CatalogJSONResponse({"results": results, "intent_error": error})
+
+
+@app.get("/stylist/{product_id}")
+def stylist(product_id: str):
+    anchor = search_engine.product_by_id(product_id)
+    if anchor is None:
+        raise HTTPException(status_code=404, detail=f"product {product_id} is not in the index")
+    items = list(iter_cached_stylist_outfit(anchor, search_engine.catalog_frame(), search_engine.catalog_stats()))
+    return CatalogJSONResponse({"anchor": anchor, "items": items})
+
+
+@app.get("/health")
+def health():
+    searcher = _searcher()
+    return CatalogJSONResponse({
+        "status": "ok",
+        "pid": os.getpid(),
+        "memory_mib": process_memory(),
+        "products": len(search_engine.catalog_frame()),
+        "result_cache": search_engine.result_cache_stats(),
+        "batching": searcher.stats() if searcher is not search_engine else None,
+    })
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host=settings.SEARCH_API_HOST, port=settings.SEARCH_API_PORT, workers=settings.SEARCH_API_WORKERS)
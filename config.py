@@ -18,6 +18,96 @@ class Config:
     SMTP_USER=os.getenv('SMTP_USER')
     SMTP_PASS=os.getenv('SMTP_PASS')
     SMTP_FROM=os.getenv('SMTP_FROM')
+    # pooled SMTP sessions, reused for SMTP_IDLE_TIMEOUT seconds and at most SMTP_MAX_MESSAGES emails each
+    SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 2))
+    SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', 60))
+    SMTP_MAX_MESSAGES = int(os.getenv('SMTP_MAX_MESSAGES', 100))
+    SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() in ('1', 'true', 'yes')
+
+    # index build pipeline
+    BUILD_BATCH_SIZE = int(os.getenv('BUILD_BATCH_SIZE', 64))
+    BUILD_NUM_WORKERS = int(os.getenv('BUILD_NUM_WORKERS', 4))
+    TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', 0))  # 0 keeps torch's default
+
+    # ANN index: Flat | IVFFlat | HNSW | IVFPQ | OPQ | SQfp16 | SQ8 | PQ, or a raw faiss factory string
+    INDEX_TYPE = os.getenv('INDEX_TYPE', 'Flat')
+    INDEX_NLIST = int(os.getenv('INDEX_NLIST', 0))  # 0 -> ~4*sqrt(n)
+    INDEX_HNSW_M = int(os.getenv('INDEX_HNSW_M', 32))
+    INDEX_PQ_M = int(os.getenv('INDEX_PQ_M', 64))
+    SEARCH_NPROBE = int(os.getenv('SEARCH_NPROBE', 16))
+    SEARCH_EF = int(os.getenv('SEARCH_EF', 64))
+    # re-score this many ANN candidates exactly from the memory-mapped float32 vectors; 0 turns it off
+    RERANK_K = int(os.getenv('RERANK_K', 0))
+
+    # micro-batching: concurrent searches arriving within the window share one CLIP + FAISS call
+    SEARCH_MICROBATCH = os.getenv('SEARCH_MICROBATCH', 'true').lower() in ('1', 'true', 'yes')
+    SEARCH_BATCH_WINDOW_MS = float(os.getenv('SEARCH_BATCH_WINDOW_MS', 5))
+    SEARCH_MAX_BATCH = int(os.getenv('SEARCH_MAX_BATCH', 32))
+    SEARCH_PREFETCH_K = int(os.getenv('SEARCH_PREFETCH_K', 100))  # unfiltered candidates fetched per batched query
+
+    # search API (api.py); with SEARCH_API_URL set the Streamlit UI searches through it instead of in-process
+    SEARCH_API_URL = os.getenv('SEARCH_API_URL', '')
+    SEARCH_API_TIMEOUT = float(os.getenv('SEARCH_API_TIMEOUT', 30))
+    SEARCH_API_HOST = os.getenv('SEARCH_API_HOST', '127.0.0.1')
+    SEARCH_API_PORT = int(os.getenv('SEARCH_API_PORT', 8000))
+    SEARCH_API_WORKERS = int(os.getenv('SEARCH_API_WORKERS', 2))
+    # read the FAISS index memory-mapped, so search processes share one copy of it
+    INDEX_MMAP = os.getenv('INDEX_MMAP', 'true').lower() in ('1', 'true', 'yes')
+
+    # keep a TorchScript copy of the CLIP text tower next to the embeddings; it loads without the full checkpoint
+    TEXT_ENCODER_CACHE = os.getenv('TEXT_ENCODER_CACHE', 'true').lower() in ('1', 'true', 'yes')
+
+    # CLIP text embedding cache; set EMBED_CACHE_PATH (e.g. embeddings/text_cache.sqlite) to persist it
+    EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', 4096))
+    EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', '')
+
+    # search result cache, keyed by parsed intent and invalidated when the index or styles.csv change
+    RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 2048))
+    RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 600))
+
+    # Gemini intent parsing cache (SQLite behind an in-process LRU); empty path keeps it in memory only
+    INTENT_CACHE_PATH = os.getenv('INTENT_CACHE_PATH', 'output/intent_cache.sqlite')
+    INTENT_CACHE_SIZE = int(os.getenv('INTENT_CACHE_SIZE', 4096))
+    INTENT_CACHE_TTL = float(os.getenv('INTENT_CACHE_TTL', 7 * 24 * 3600))
+    INTENT_NEGATIVE_TTL = float(os.getenv('INTENT_NEGATIVE_TTL', 60))
+
+    # queries the local parser explains at least this well (share of tokens) skip Gemini; 1.1 always asks Gemini
+    LOCAL_INTENT_MIN_CONFIDENCE = float(os.getenv('LOCAL_INTENT_MIN_CONFIDENCE', 0.8))
+
+    # intent prompts list at most this many allowed values per field, picked lexically and with CLIP
+    PROMPT_MAX_VALUES = int(os.getenv('PROMPT_MAX_VALUES', 25))
+    PROMPT_EMBED_PRUNING = os.getenv('PROMPT_EMBED_PRUNING', 'true').lower() in ('1', 'true', 'yes')
+
+    # Gemini gateway: long-lived clients per API key, requests rotate across GENAI_API_KEY / GENAI_API_KEY_1
+    LLM_MAX_CONCURRENCY_PER_KEY = int(os.getenv('LLM_MAX_CONCURRENCY_PER_KEY', 4))
+    LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 30))  # seconds, for a free slot and for the request itself
+
+    # AI stylist: outfit items found within STYLIST_DEADLINE seconds are shown, the rest are dropped
+    STYLIST_DEADLINE = float(os.getenv('STYLIST_DEADLINE', 10))
+    STYLIST_WORKERS = int(os.getenv('STYLIST_WORKERS', 5))
+    STYLIST_OUTFIT_SIZE = int(os.getenv('STYLIST_OUTFIT_SIZE', 5))
+    # with a complement graph (train_model/build_complements.py) the LLM only adds extra ideas when this is on
+    STYLIST_LLM_ENRICH = os.getenv('STYLIST_LLM_ENRICH', 'false').lower() in ('1', 'true', 'yes')
+    COMPLEMENTS_K = int(os.getenv('COMPLEMENTS_K', 12))
+
+    # orders (SQLite, WAL); output/orders.csv from older builds is imported the first time it is opened
+    ORDER_DB_PATH = os.getenv('ORDER_DB_PATH', 'output/orders.sqlite')
+    ORDER_WRITE_BATCH = int(os.getenv('ORDER_WRITE_BATCH', 64))  # most orders committed in one transaction
+
+    # order emails go through a SQLite outbox; a background worker sends them, retrying with exponential backoff
+    OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'output/outbox.sqlite')
+    OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 2))
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 20))  # order emails sent over one SMTP session
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+    OUTBOX_BACKOFF_S = float(os.getenv('OUTBOX_BACKOFF_S', 5))
+    OUTBOX_MAX_BACKOFF_S = float(os.getenv('OUTBOX_MAX_BACKOFF_S', 600))
+    OUTBOX_POLL_S = float(os.getenv('OUTBOX_POLL_S', 5))
+
+    # stylist outfits per anchor product; stale entries are still served while they regenerate in the background
+    OUTFIT_CACHE_PATH = os.getenv('OUTFIT_CACHE_PATH', 'output/outfit_cache.sqlite')
+    OUTFIT_CACHE_SIZE = int(os.getenv('OUTFIT_CACHE_SIZE', 1024))
+    OUTFIT_CACHE_TTL = float(os.getenv('OUTFIT_CACHE_TTL', 24 * 3600))
+    OUTFIT_STALE_TTL = float(os.getenv('OUTFIT_STALE_TTL', 24 * 3600))
 
 
 settings = Config()
@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+from google import genai
+from google.genai import types
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+
+# FILE: llm_gateway.py
+# One place that talks to Gemini. Clients are created once per API key and reused, so their
+# HTTP connection pools (and TLS sessions) survive between requests. Each key has a
+# concurrency limit shared by sync and async callers, and requests rotate across keys.
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """True for quota / 429 errors (google.genai.errors.APIError carries the HTTP status in .code)."""
+    return getattr(error, "code", None) == 429
+
+
+class _KeySlot:
+    def __init__(self, name: str, api_key: str, max_concurrency: int, timeout: float):
+        self.name = name
+        self.api_key = api_key
+        self.timeout = timeout
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._client = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.busy_s = 0.0
+
+    @property
+    def client(self) -> "genai.Client":
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = genai.Client(
+                        api_key=self.api_key,
+                        http_options=types.HttpOptions(timeout=int(self.timeout * 1000)),
+                    )
+        return self._client
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "avg_latency_ms": round(self.busy_s * 1000 / self.requests, 1) if self.requests else 0.0,
+        }
+
+
+class LLMGateway:
+    """
+    Long-lived Gemini clients for every configured API key.
+
+    generate() / agenerate() pick keys round-robin, wait at most `timeout` seconds for a free
+    slot on that key, and move on to the next key when one is rate limited.
+    """
+
+    def __init__(self, api_keys: Dict[str, Optional[str]], max_concurrency: int = 4, timeout: float = 30.0):
+        self.timeout = timeout
+        self._slots = [_KeySlot(name, key, max_concurrency, timeout) for name, key in api_keys.items() if key]
+        self._cycle = itertools.cycle(range(len(self._slots))) if self._slots else None
+        self._cycle_lock = threading.Lock()
+
+    def _rotation(self) -> List[_KeySlot]:
+        """Every slot once, starting from the next one in the round robin."""
+        if not self._slots:
+            raise RuntimeError("No Gemini API key configured (GEMINI_API_KEY / GEMINI_API_KEY_1).")
+        with self._cycle_lock:
+            start = next(self._cycle)
+        return self._slots[start:] + self._slots[:start]
+
+    def warmup(self) -> None:
+        """Create the clients ahead of the first request."""
+        for slot in self._slots:
+            slot.client
+
+    def generate(self, model: str, contents, config: Optional[types.GenerateContentConfig] = None, timeout: Optional[float] = None):
+        timeout = self.timeout if timeout is None else timeout
+        last_error: Optional[Exception] = None
+        for slot in self._rotation():
+            if not slot.semaphore.acquire(timeout=timeout):
+                last_error = TimeoutError(f"no free Gemini slot on {slot.name} within {timeout}s")
+                continue
+            started = time.perf_counter()
+            try:
+                response = slot.client.models.generate_content(model=model, contents=contents, config=config)
+                slot.requests += 1
+                slot.busy_s += time.perf_counter() - started
+                return response
+            except Exception as e:
+                slot.errors += 1
+                if not is_rate_limited(e):
+                    raise
+                slot.rate_limited += 1
+                last_error = e
+            finally:
+                slot.semaphore.release()
+        raise last_error
+
+    async def agenerate(self, model: str, contents, config: Optional[types.GenerateContentConfig] = None, timeout: Optional[float] = None):
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        last_error: Optional[Exception] = None
+        for slot in self._rotation():
+            # fast path avoids a thread hop when the key has capacity
+            acquired = slot.semaphore.acquire(blocking=False) or await loop.run_in_executor(None, slot.semaphore.acquire, True, timeout)
+            if not acquired:
+                last_error = TimeoutError(f"no free Gemini slot on {slot.name} within {timeout}s")
+                continue
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    slot.client.aio.models.generate_content(model=model, contents=contents, config=config), timeout
+                )
+                slot.requests += 1
+                slot.busy_s += time.perf_counter() - started
+                return response
+            except Exception as e:
+                slot.errors += 1
+                if not is_rate_limited(e):
+                    raise
+                slot.rate_limited += 1
+                last_error = e
+            finally:
+                slot.semaphore.release()
+        raise last_error
+
+    def stream(self, model: str, contents, config: Optional[types.GenerateContentConfig] = None, timeout: Optional[float] = None) -> Iterator[str]:
+        """
+        Yields the response text chunk by chunk. The key is held until the stream is exhausted
+        or closed; rate limits only move to the next key before the first chunk arrived.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        last_error: Optional[Exception] = None
+        for slot in self._rotation():
+            if not slot.semaphore.acquire(timeout=timeout):
+                last_error = TimeoutError(f"no free Gemini slot on {slot.name} within {timeout}s")
+                continue
+            started = time.perf_counter()
+            received = False
+            try:
+                for chunk in slot.client.models.generate_content_stream(model=model, contents=contents, config=config):
+                    received = True
+                    if chunk.text:
+                        yield chunk.text
+                slot.requests += 1
+                slot.busy_s += time.perf_counter() - started
+                return
+            except Exception as e:
+                slot.errors += 1
+                if received or not is_rate_limited(e):
+                    raise
+                slot.rate_limited += 1
+                last_error = e
+            finally:
+                slot.semaphore.release()
+        raise last_error
+
+    def stats(self) -> Dict[str, Any]:
+        return {slot.name: slot.stats() for slot in self._slots}
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+def get_gateway() -> LLMGateway:
+    """Process-wide gateway over GENAI_API_KEY and GENAI_API_KEY_1."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway(
+                    {"GENAI_API_KEY": settings.GENAI_API_KEY, "GENAI_API_KEY_1": settings.GENAI_API_KEY_1},
+                    max_concurrency=settings.LLM_MAX_CONCURRENCY_PER_KEY,
+                    timeout=settings.LLM_TIMEOUT,
+                )
+    return _gateway
+
+def generate(model: str, contents, config: Optional[types.GenerateContentConfig] = None, timeout: Optional[float] = None):
+    return get_gateway().generate(model, contents, config, timeout)
+
+async def agenerate(model: str, contents, config: Optional[types.GenerateContentConfig] = None, timeout: Optional[float] = None):
+    return await get_gateway().agenerate(model, contents, config, timeout)
+
+def stream(model: str, contents, config: Optional[types.GenerateContentConfig] = None, timeout: Optional[float] = None) -> Iterator[str]:
+    return get_gateway().stream(model, contents, config, timeout)
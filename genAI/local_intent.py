@@ -0,0 +1,185 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# FILE: local_intent.py
+# Dictionary-based intent parser that runs before (and usually instead of) Gemini.
+
+FILTER_FIELDS = ["gender", "masterCategory", "subCategory", "articleType", "baseColour"]
+
+# extra surface forms per catalog value; only used when the value exists in the catalog
+SYNONYMS: Dict[str, Dict[str, List[str]]] = {
+    "gender": {
+        "men": ["man", "mens", "male", "males", "gents", "gentlemen", "guy", "guys"],
+        "women": ["woman", "womens", "female", "females", "ladies", "lady"],
+        "boys": ["boy"],
+        "girls": ["girl"],
+    },
+    "masterCategory": {
+        "apparel": ["clothes", "clothing"],
+    },
+    "articleType": {
+        "tshirts": ["tee", "tees", "t shirt", "t shirts"],
+        "jeans": ["denim", "denims"],
+        "trousers": ["pants", "pant", "chinos"],
+        "sports shoes": ["sneakers", "trainers", "running shoes"],
+        "heels": ["pumps", "stilettos"],
+        "sunglasses": ["shades", "goggles"],
+        "handbags": ["purse", "purses"],
+        "sweatshirts": ["hoodie", "hoodies"],
+        "dresses": ["frock", "frocks"],
+        "flip flops": ["flipflops", "slippers"],
+    },
+    "baseColour": {
+        "grey": ["gray"],
+        "navy blue": ["navy"],
+        "off white": ["offwhite", "ivory"],
+        "multi": ["multicolor", "multicolour", "multicoloured", "multicolored"],
+    },
+}
+
+STOPWORDS = {
+    "a", "an", "the", "for", "with", "in", "of", "and", "or", "to", "on", "me", "my", "i", "im",
+    "want", "need", "looking", "show", "find", "buy", "get", "some", "any", "please", "price", "priced",
+}
+
+_AMOUNT = r"(?:(?:\brs\.?|\binr|₹)\s*)?\b(\d+(?:\.\d+)?)(k\b)?"
+PRICE_PATTERNS = [
+    ("between", re.compile(r"\b(?:between|from)\s+" + _AMOUNT + r"\s*(?:and|to|-)\s*" + _AMOUNT)),
+    ("between", re.compile(_AMOUNT + r"\s*(?:-|to)\s*" + _AMOUNT + r"\b")),
+    ("max", re.compile(r"\b(?:under|below|less than|max|upto|up to|within|cheaper than)\s*" + _AMOUNT)),
+    ("min", re.compile(r"\b(?:above|over|more than|min|at least|starting)\s*" + _AMOUNT)),
+]
+
+
+def _amount(number: str, thousands: Optional[str]) -> int:
+    value = float(number) * (1000 if thousands else 1)
+    return int(value)
+
+def _tokens(text: str) -> List[str]:
+    """Lower-case word tokens; "men's" -> "mens", "t-shirt" -> "tshirt"."""
+    text = text.lower().replace("'", "").replace("’", "")
+    text = re.sub(r"(?<=[a-z])-(?=[a-z])", "", text)
+    return re.findall(r"[a-z0-9]+", text)
+
+def _inflections(phrase: List[str]) -> List[List[str]]:
+    """Singular/plural variants of a phrase (inflecting its last word)."""
+    *head, last = phrase
+    forms = set()
+    if last.endswith(("ses", "xes", "ches", "shes")):
+        forms.add(last[:-2])
+    elif last.endswith("s") and not last.endswith("ss"):
+        forms.add(last[:-1])
+    elif last.endswith(("s", "x", "ch", "sh")):
+        forms.add(last + "es")
+    else:
+        forms.add(last + "s")
+    return [head + [form] for form in forms if len(form) > 2]
+
+
+class LocalIntentParser:
+    """
+    Longest-match token trie over every filter value in catalog_stats, plus synonyms
+    and singular/plural forms, with a small price grammar ("under 1000",
+    "between 500 and 2k", "500-1000"). parse() returns the same intent shape as the
+    Gemini parser plus a confidence score: the share of query tokens it could explain.
+    """
+
+    def __init__(self, catalog_stats: Dict[str, List[str]]):
+        self._trie: Dict = {}
+        for field in FILTER_FIELDS:
+            canonical = {str(v).lower(): v for v in catalog_stats.get(field, []) if v}
+            for lowered, value in canonical.items():
+                phrase = _tokens(lowered)
+                if not phrase:
+                    continue
+                self._add(phrase, field, value, exact=True)
+                for form in _inflections(phrase):
+                    self._add(form, field, value, exact=False)
+            for target, aliases in SYNONYMS.get(field, {}).items():
+                if target in canonical:
+                    for alias in aliases:
+                        self._add(_tokens(alias), field, canonical[target], exact=False)
+
+    def _add(self, phrase: List[str], field: str, value: str, exact: bool) -> None:
+        node = self._trie
+        for token in phrase:
+            node = node.setdefault(token, {})
+        matches = node.setdefault("$", {})
+        # an exact catalog value wins over a plural/synonym form of another value
+        if field not in matches or (exact and not matches[field][1]):
+            matches[field] = (value, exact)
+
+    def _longest_match(self, tokens: List[str], start: int) -> Tuple[int, Optional[Dict]]:
+        node, end, found = self._trie, start, None
+        for i in range(start, len(tokens)):
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            if "$" in node:
+                end, found = i + 1, node["$"]
+        return end, found
+
+    def _parse_price(self, text: str) -> Tuple[Dict[str, Optional[int]], str, int]:
+        """Extract priceMin/priceMax; returns them, the text with price phrases removed and the tokens consumed."""
+        price = {"priceMin": None, "priceMax": None}
+        consumed = 0
+        for kind, pattern in PRICE_PATTERNS:
+            match = pattern.search(text)
+            if not match:
+                continue
+            groups = match.groups()
+            if kind == "between":
+                low, high = sorted([_amount(groups[0], groups[1]), _amount(groups[2], groups[3])])
+                price["priceMin"], price["priceMax"] = low, high
+            elif price["priceMax" if kind == "max" else "priceMin"] is None:
+                price["priceMax" if kind == "max" else "priceMin"] = _amount(groups[0], groups[1])
+            consumed += len(_tokens(match.group(0))) or 1
+            text = text[:match.start()] + " " + text[match.end():]
+        return price, text, consumed
+
+    def parse(self, query: str) -> Dict:
+        text = (query or "").lower()
+        price, text, price_tokens = self._parse_price(text)
+        tokens = _tokens(text)
+
+        filters: Dict[str, Optional[object]] = {field: None for field in FILTER_FIELDS}
+        explained, strict, kept = price_tokens, True, []
+        i = 0
+        while i < len(tokens):
+            end, matches = self._longest_match(tokens, i)
+            if matches:
+                for field, (value, exact) in matches.items():
+                    if filters[field] is None:
+                        filters[field] = value
+                        strict &= exact
+                explained += end - i
+                kept.extend(tokens[i:end])
+                i = end
+                continue
+            if tokens[i] in STOPWORDS:
+                explained += 1
+            else:
+                kept.append(tokens[i])
+            i += 1
+
+        total = len(tokens) + price_tokens
+        filters.update(price)
+        return {
+            "filters": filters,
+            "normalized_query": " ".join(kept) or " ".join(tokens) or (query or "").strip().lower(),
+            "strict": strict,
+            "confidence": round(explained / total, 3) if total else 0.0,
+        }
+
+
+_parser: Tuple[Optional[Dict], Optional[LocalIntentParser]] = (None, None)
+
+def get_parser(catalog_stats: Dict[str, List[str]]) -> LocalIntentParser:
+    """Parser for these catalog_stats, rebuilt only when a different stats object is passed."""
+    global _parser
+    if _parser[0] is not catalog_stats:
+        _parser = (catalog_stats, LocalIntentParser(catalog_stats))
+    return _parser[1]
+
+def parse_intent_locally(query: str, catalog_stats: Dict[str, List[str]]) -> Dict:
+    return get_parser(catalog_stats).parse(query)
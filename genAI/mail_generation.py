@@ -1,10 +1,9 @@
-import google.generativeai as genai
 import json
 import os
 import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
-from config import settings
+from genAI import llm_gateway
 
 def format_order_text(order):
     order_summary_parts = [
@@ -97,59 +96,66 @@ def format_order_html(order):
     return html
 
 
-def generate_order_email_content(order, returning):
-    
-    try:
-    
-        genai.configure(
-            api_key = settings.GENAI_API_KEY
-        )
-        full_prompt = (
-            "You are a helpful and friendly AI assistant for a fashion e-commerce store 'StyleScope'. Do not use any other shop name. "
-            "Write a warm, professional, and concise order confirmation email. "
-            "Do not repeat order details. Only write 2-3 sentences of natural language. "
-            "Do not include the subject line or any placeholder for it in email body."
-            "All currency amounts are in Indian Rupees (₹). Use the symbol."
-            "Do not modify customer name, product name."
-            f"Mention the customer by name as {order['customer_name']}. Do not use any other Customer name instead of {order['customer_name']}. "
-        )
+EMAIL_MODEL_NAME = "gemini-2.0-flash"
+
+def _email_prompt(order, returning):
+    full_prompt = (
+        "You are a helpful and friendly AI assistant for a fashion e-commerce store 'StyleScope'. Do not use any other shop name. "
+        "Write a warm, professional, and concise order confirmation email. "
+        "Do not repeat order details. Only write 2-3 sentences of natural language. "
+        "Do not include the subject line or any placeholder for it in email body."
+        "All currency amounts are in Indian Rupees (₹). Use the symbol."
+        "Do not modify customer name, product name."
+        f"Mention the customer by name as {order['customer_name']}. Do not use any other Customer name instead of {order['customer_name']}. "
+    )
 
-        if order.get('discount_breakdown'):
+    if order.get('discount_breakdown'):
+        full_prompt += (
+            f"This customer recived discounts under various categories. A total discount of Rs.{order['discount_amount']:.2f} was applied to the order. "
+            "Thank them for their continued trust in us and mention this special discount. Also mention to refer the discount details in the email. "
+        )
+    else:
+        if returning:
             full_prompt += (
-                f"This customer recived discounts under various categories. A total discount of Rs.{order['discount_amount']:.2f} was applied to the order. "
-                "Thank them for their continued trust in us and mention this special discount. Also mention to refer the discount details in the email. "
+                f"This is a returning customer. A Loyalty discount of Rs.{order['discount_amount']:.2f} was applied to the order. "
+                "Thank them for their continued loyalty and mention this special discount. "
             )
-        else:
-            if returning:
-                full_prompt += (
-                    f"This is a returning customer. A Loyalty discount of Rs.{order['discount_amount']:.2f} was applied to the order. "
-                    "Thank them for their continued loyalty and mention this special discount. "
-                )
-
-        model = genai.GenerativeModel(model_name="gemini-2.0-flash")
-        response = model.generate_content(
-            full_prompt
-        )
-        intro_text = response.text.strip()
-        
-        # Parsing response to json
-        #data = json.loads(response.text.strip().lstrip('````json').rstrip('````'))
-        plain_text = intro_text + "\n\n" + format_order_text(order)
-        html = f"<p style='font-family: Arial, sans-serif; font-size: 14px; color: #1f212b;'>{intro_text}</p>" + format_order_html(order)
-
-
-        email_content = {
-            "subject": f"StyleScope Order Confirmation: Thank you, {order['customer_name']}!",
-            "text": plain_text,
-            "html": html
-        }
-        return email_content, None
+    return full_prompt
+
+def _email_from_response(order, response):
+    intro_text = response.text.strip()
+    
+    plain_text = intro_text + "\n\n" + format_order_text(order)
+    html = f"<p style='font-family: Arial, sans-serif; font-size: 14px; color: #1f212b;'>{intro_text}</p>" + format_order_html(order)
+
+    email_content = {
+        "subject": f"StyleScope Order Confirmation: Thank you, {order['customer_name']}!",
+        "text": plain_text,
+        "html": html
+    }
+    return email_content, None
+
+def _fallback_email(order, e):
+    print(f'Error generating email containt with Gemini: {e}')
+    fallback_content = "Thank you for your order! We have recieved it and are processing it."
+    fallback_email = {
+        "subject": f"Order Confirmation for {order['customer_name']}",
+        "text": fallback_content + "\n\n" + format_order_text(order),
+        "html": f"<p style='font-family: Arial, sans-serif; font-size: 14px; color: #1f212b;'>{fallback_content}</p>" + format_order_html(order)
+    }
+    return fallback_email, e
+
+def generate_order_email_content(order, returning):
+    try:
+        response = llm_gateway.generate(EMAIL_MODEL_NAME, _email_prompt(order, returning))
+        return _email_from_response(order, response)
+    except Exception as e:
+        return _fallback_email(order, e)
+
+async def agenerate_order_email_content(order, returning):
+    """Async variant of generate_order_email_content."""
+    try:
+        response = await llm_gateway.agenerate(EMAIL_MODEL_NAME, _email_prompt(order, returning))
+        return _email_from_response(order, response)
     except Exception as e:
-        print(f'Error generating email containt with Gemini: {e}')
-        fallback_content = "Thank you for your order! We have recieved it and are processing it."
-        fallback_email = {
-            "subject": f"Order Confirmation for {order['customer_name']}",
-            "text": fallback_content + "\n\n" + format_order_text(order),
-            "html": f"<p style='font-family: Arial, sans-serif; font-size: 14px; color: #1f212b;'>{fallback_content}</p>" + format_order_html(order)
-        }
-        return fallback_email, e
+        return _fallback_email(order, e)
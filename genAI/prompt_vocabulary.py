@@ -0,0 +1,110 @@
+from typing import Callable, Dict, Iterable, List, Optional, Set
+import numpy as np
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+from genAI.local_intent import _tokens, _inflections
+
+# FILE: prompt_vocabulary.py
+# Allowed-values block for the intent prompts, precomputed once per catalog vocabulary and
+# pruned per query to the values that are lexically or semantically close to it.
+
+
+def format_allowed_values(values: Dict[str, List[str]]) -> str:
+    """Bullet-style "- field: [values]" block, the format the prompt templates expect."""
+    return "\n".join(f"- {field}: {vals}" for field, vals in values.items())
+
+def _surface_forms(value: str) -> Set[str]:
+    """Tokens of a catalog value plus singular/plural forms of each token."""
+    forms = set()
+    for token in _tokens(str(value)):
+        forms.add(token)
+        forms.update(form[0] for form in _inflections([token]))
+    return forms
+
+
+class PromptVocabulary:
+    """
+    Catalog vocabulary prepared for prompt construction.
+
+    Small fields (at most max_values values, e.g. gender) are always sent in full. For the
+    rest, a query gets the values that share a word with it (ignoring plurals) plus the values
+    whose CLIP text embedding is closest to the query, up to max_values per field. Without an
+    encoder the remaining slots are filled in catalog order.
+    """
+
+    def __init__(self, catalog_stats: Dict[str, List[str]], max_values: int = 25,
+                 encoder: Optional[Callable[[List[str]], np.ndarray]] = None):
+        self.fields = {field: [v for v in values if v] for field, values in catalog_stats.items()}
+        self.max_values = max_values
+        self.full_block = format_allowed_values(self.fields)
+        self._forms = {field: [_surface_forms(v) for v in values] for field, values in self.fields.items()}
+        self._encoder = encoder
+        self._embeddings: Dict[str, np.ndarray] = {}
+        if encoder is not None:
+            for field, values in self.fields.items():
+                if len(values) > max_values:
+                    self._embeddings[field] = encoder([str(v) for v in values])
+
+    def _lexical(self, field: str, query_forms: Set[str]) -> List[int]:
+        return [i for i, forms in enumerate(self._forms[field]) if forms & query_forms]
+
+    def _semantic(self, field: str, query_vec: Optional[np.ndarray]) -> List[int]:
+        """Value indices ordered by cosine similarity to the query."""
+        if query_vec is None or field not in self._embeddings:
+            return list(range(len(self.fields[field])))
+        return np.argsort(-(self._embeddings[field] @ query_vec), kind="stable").tolist()
+
+    def values_for(self, queries: Iterable[str]) -> Dict[str, List[str]]:
+        """Pruned allowed values; a batch prompt gets the union of every query's values."""
+        queries = [q for q in queries if q]
+        query_vecs = self._encoder(queries) if self._embeddings and queries else None
+
+        chosen: Dict[str, Dict[int, None]] = {field: {} for field in self.fields}
+        for n, query in enumerate(queries):
+            query_forms = _surface_forms(query)
+            for field, values in self.fields.items():
+                if len(values) <= self.max_values:
+                    continue
+                picked = dict.fromkeys(self._lexical(field, query_forms))
+                for i in self._semantic(field, None if query_vecs is None else query_vecs[n]):
+                    if len(picked) >= self.max_values:
+                        break
+                    picked.setdefault(i)
+                chosen[field].update(picked)
+
+        pruned = {}
+        for field, values in self.fields.items():
+            if len(values) <= self.max_values or not queries:
+                pruned[field] = values
+            else:
+                # catalog order keeps the prompt for a given query stable
+                pruned[field] = [values[i] for i in sorted(chosen[field])]
+        return pruned
+
+    def block_for(self, queries: Iterable[str]) -> str:
+        return format_allowed_values(self.values_for(queries))
+
+
+def _clip_encoder() -> Optional[Callable[[List[str]], np.ndarray]]:
+    """The search engine's cached CLIP text encoder (no index or catalog needed), or None when it can't be loaded here."""
+    try:
+        from train_model import search_engine
+        search_engine.load_text_encoder()
+    except Exception as e:
+        print(f"[WARN] CLIP text encoder unavailable for prompt pruning ({e}); using lexical pruning only.")
+        return None
+    return search_engine.encoded_text_cpu_batch
+
+_vocabularies: Dict[str, PromptVocabulary] = {}
+
+def get_vocabulary(catalog_stats: Dict[str, List[str]], fingerprint: str) -> PromptVocabulary:
+    """PromptVocabulary for a catalog fingerprint, built (and its values embedded) only once."""
+    vocabulary = _vocabularies.get(fingerprint)
+    if vocabulary is None:
+        encoder = _clip_encoder() if settings.PROMPT_EMBED_PRUNING else None
+        vocabulary = PromptVocabulary(catalog_stats, settings.PROMPT_MAX_VALUES, encoder)
+        _vocabularies.clear()  # only the current catalog's vocabulary is ever asked for again
+        _vocabularies[fingerprint] = vocabulary
+    return vocabulary
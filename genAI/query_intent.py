@@ -1,17 +1,34 @@
 from typing import Dict,Any,Optional,Tuple,List
-from google import genai
 from google.genai import types
-from google.api_core.exceptions import GoogleAPICallError,ResourceExhausted
+from google.genai import errors
+import hashlib
 import json
 import os
-from dotenv import load_dotenv
+import threading
+import time
 import pandas as pd
 import sys
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+sys.path.insert(0, BASE_DIR)
 from config import settings
+from utils.cache import LRUCache, SQLiteStore
+from genAI.local_intent import parse_intent_locally
+from genAI.prompt_vocabulary import get_vocabulary
+from genAI import llm_gateway
+from genAI.llm_gateway import is_rate_limited
 
 
 API_KEY=settings.GENAI_API_KEY
+MODEL_NAME="gemini-1.5-flash"
+
+# (model, catalog_stats fingerprint, normalized query) -> {"intent": ..., "error": ...}
+_intent_cache = LRUCache(settings.INTENT_CACHE_SIZE)
+# SQLite layer behind _intent_cache, opened on first use (see _store)
+_intent_store: Optional[SQLiteStore] = None
+_intent_store_lock = threading.Lock()
+_stats_fingerprint = (None, None)
+# running totals for prompt_stats()
+_prompt_totals = {"calls": 0, "prompt_chars": 0, "full_chars": 0, "prompt_tokens": 0, "latency_s": 0.0}
 
 response_schema ={
    "type":"OBJECT",
@@ -101,13 +118,43 @@ Input Queries:
 {queries_json_list}
 """
 
-def _format_allowed_values(catalog_stats:Dict[str,List[str]]) -> str:
+def _format_allowed_values(catalog_stats:Dict[str,List[str]],queries:Optional[List[str]]=None) -> str:
    """
-   convert catalog_stats dict into readable bullet-sty;e string for prompt
-   """    
-   return "\n".join(
-      f"- {field}: {values}" for field,values in catalog_stats.items()
-   )
+   bullet-style allowed values block for the prompt. The catalog vocabulary is prepared once per
+   catalog fingerprint; with queries given, only the values close to those queries are listed.
+   """
+   vocabulary = get_vocabulary(catalog_stats, _catalog_fingerprint(catalog_stats))
+   return vocabulary.block_for(queries) if queries else vocabulary.full_block
+
+def _record_prompt(prompt:str,catalog_stats:Dict[str,List[str]],started:float,response) ->None:
+   """
+   log the size of a prompt (vs. one listing the whole vocabulary) and the round trip it took.
+   """
+   full_chars = len(get_vocabulary(catalog_stats, _catalog_fingerprint(catalog_stats)).full_block)
+   latency = time.perf_counter() - started
+   usage = getattr(response, "usage_metadata", None)
+   tokens = getattr(usage, "prompt_token_count", None) or len(prompt) // 4
+   _prompt_totals["calls"] += 1
+   _prompt_totals["prompt_chars"] += len(prompt)
+   _prompt_totals["full_chars"] += full_chars
+   _prompt_totals["prompt_tokens"] += tokens
+   _prompt_totals["latency_s"] += latency
+   print(f"[INFO] intent prompt: {len(prompt)} chars, {tokens} tokens (full allowed-values block alone: {full_chars} chars), {latency*1000:.0f} ms")
+
+def prompt_stats() ->Dict[str,Any]:
+   """
+   averages over every Gemini intent call made by this process.
+   """
+   calls = _prompt_totals["calls"]
+   if not calls:
+      return {"calls": 0}
+   return {
+      "calls": calls,
+      "avg_prompt_chars": round(_prompt_totals["prompt_chars"] / calls),
+      "avg_prompt_tokens": round(_prompt_totals["prompt_tokens"] / calls),
+      "avg_full_block_chars": round(_prompt_totals["full_chars"] / calls),
+      "avg_latency_ms": round(_prompt_totals["latency_s"] * 1000 / calls, 1),
+   }
 
 def _validate_field(field:str, value: Any, catalog_stats:Dict[str,list]) ->Any:
    """
@@ -126,107 +173,340 @@ def _validate_field(field:str, value: Any, catalog_stats:Dict[str,list]) ->Any:
    return value if isinstance(value,str) and value in allowed else None
 
 
+def _catalog_fingerprint(catalog_stats:Dict[str,List[str]]) ->str:
+   """
+   short hash of the allowed values, so cached intents are dropped when the catalog vocabulary changes.
+   the last result is memoised because callers pass the same stats object on every search.
+   """
+   global _stats_fingerprint
+   if _stats_fingerprint[0] is not catalog_stats:
+      payload = json.dumps(catalog_stats, sort_keys=True, default=str).encode("utf-8")
+      _stats_fingerprint = (catalog_stats, hashlib.sha1(payload).hexdigest()[:16])
+   return _stats_fingerprint[1]
+
+def _intent_key(query:str,catalog_stats:Dict[str,List[str]]) ->str:
+   return f"{MODEL_NAME}:{_catalog_fingerprint(catalog_stats)}:{' '.join((query or '').lower().split())}"
+
+def _store() ->Optional[SQLiteStore]:
+   """
+   the intent cache's SQLite store (Config.INTENT_CACHE_PATH, relative to the project root), or None when disabled.
+   """
+   global _intent_store
+   if _intent_store is None and settings.INTENT_CACHE_PATH:
+      with _intent_store_lock:
+         if _intent_store is None:
+            _intent_store = SQLiteStore(os.path.join(BASE_DIR, settings.INTENT_CACHE_PATH), table="intents")
+   return _intent_store
+
+def _cached_intent(key:str) ->Optional[Tuple[Dict,Optional[str]]]:
+   """
+   (intent, error) from the in-process LRU, then from SQLite. None on a miss.
+   """
+   entry = _intent_cache.get(key)
+   store = _store()
+   if entry is None and store is not None:
+      blob = store.get(key)
+      if blob is not None:
+         entry = json.loads(blob)
+         # the disk copy's remaining lifetime isn't tracked in memory; failures are only ever short-lived
+         _intent_cache.set(key, entry, ttl=settings.INTENT_NEGATIVE_TTL if entry["error"] else settings.INTENT_CACHE_TTL)
+   if entry is None:
+      return None
+   return entry["intent"], entry["error"]
+
+def _store_intent(key:str,intent:Dict,error:Optional[str]) ->None:
+   """
+   cache a parse result; failures are cached too (negative caching) but with the short INTENT_NEGATIVE_TTL.
+   """
+   entry = {"intent": intent, "error": error}
+   ttl = settings.INTENT_NEGATIVE_TTL if error else settings.INTENT_CACHE_TTL
+   _intent_cache.set(key, entry, ttl=ttl)
+   store = _store()
+   if store is not None:
+      store.set(key, json.dumps(entry).encode("utf-8"), ttl=ttl)
+
+def intent_cache_stats() ->Dict[str,Any]:
+   stats = {"memory": _intent_cache.stats()}
+   if _intent_store is not None:
+      stats["disk"] = _intent_store.stats()
+   return stats
+
 def build_prompt(query:str,catalog_stats:Dict[str,List[str]]) ->str:
    """
    Builds a structured prompt for Gemini with strict disambiguation rules.
    """
 
-   allowed_values_str = _format_allowed_values(catalog_stats)
+   allowed_values_str = _format_allowed_values(catalog_stats, [query])
    return PROMPT_TEMPLATE.format(
       allowed_values = allowed_values_str,
       query = query
    )
 
+def _local_intent(query:str,catalog_stats:Dict[str,list]) ->Tuple[Dict,float]:
+   local = parse_intent_locally(query, catalog_stats)
+   confidence = local.pop("confidence")
+   return local, confidence
+
+def _prefer_local(local:Dict,parsed_intent:Dict,error:Optional[str]):
+   if error:
+      print(f"Warning: Gemini parser failed: '{error}'. Using the local parse.")
+      return local, None
+   return parsed_intent, None
+
+def parse_intent(query:str,catalog_stats:Dict[str,list]):
+   """
+   Parses a query with the local dictionary parser and only calls Gemini when the local
+   parse explains less than Config.LOCAL_INTENT_MIN_CONFIDENCE of the query.
+   If Gemini fails the local parse is used anyway, so search never loses its filters.
+   """
+   local, confidence = _local_intent(query, catalog_stats)
+   if confidence >= settings.LOCAL_INTENT_MIN_CONFIDENCE:
+      return local, None
+   return _prefer_local(local, *parse_intent_with_gemini(query, catalog_stats))
+
+async def aparse_intent(query:str,catalog_stats:Dict[str,list]):
+   """
+   async variant of parse_intent.
+   """
+   local, confidence = _local_intent(query, catalog_stats)
+   if confidence >= settings.LOCAL_INTENT_MIN_CONFIDENCE:
+      return local, None
+   return _prefer_local(local, *(await aparse_intent_with_gemini(query, catalog_stats)))
+
+def parse_intent_if_confident(query:str,catalog_stats:Dict[str,list]) ->Optional[Dict]:
+   """
+   The local parse of query when it is confident enough to skip Gemini (see parse_intent), else None.
+   """
+   local, confidence = _local_intent(query, catalog_stats)
+   return local if confidence >= settings.LOCAL_INTENT_MIN_CONFIDENCE else None
+
+def _split_batch(queries:List[str],catalog_stats:Dict[str,List[str]]) ->Tuple[List[Dict],List[int]]:
+   """
+   local intents for every query, and the positions of the ones that still need Gemini.
+   """
+   intents, pending = [], []
+   for n, query in enumerate(queries):
+      local, confidence = _local_intent(query, catalog_stats)
+      intents.append(local)
+      if confidence < settings.LOCAL_INTENT_MIN_CONFIDENCE:
+         pending.append(n)
+   return intents, pending
+
+def _merge_batch(intents:List[Dict],pending:List[int],parsed_list:List[Dict],errors:List[Optional[str]]) ->Tuple[List[Dict],Optional[str]]:
+   failed = [error for error in errors if error]
+   if failed:
+      print(f"Warning: Gemini batch parser failed: '{failed[0]}'. Using the local parse for {len(failed)} of {len(pending)} queries.")
+   for n, parsed, error in zip(pending, parsed_list, errors):
+      if not error:
+         intents[n] = parsed
+   return intents, None
+
+def parse_intent_batch(queries:List[str],catalog_stats:Dict[str,List[str]]) ->Tuple[List[Dict],Optional[str]]:
+   """
+   Batch version of parse_intent: confident queries are parsed locally and the rest go to Gemini in one call.
+   """
+   intents, pending = _split_batch(queries, catalog_stats)
+   if not pending:
+      return intents, None
+   return _merge_batch(intents, pending, *parse_intent_batch_with_gemini([queries[n] for n in pending], catalog_stats))
+
+async def aparse_intent_batch(queries:List[str],catalog_stats:Dict[str,List[str]]) ->Tuple[List[Dict],Optional[str]]:
+   """
+   async variant of parse_intent_batch.
+   """
+   intents, pending = _split_batch(queries, catalog_stats)
+   if not pending:
+      return intents, None
+   return _merge_batch(intents, pending, *(await aparse_intent_batch_with_gemini([queries[n] for n in pending], catalog_stats)))
+
+def _intent_request(query:str,catalog_stats:Dict[str,list]) ->Tuple[str,types.GenerateContentConfig]:
+   prompt =build_prompt(query,catalog_stats)
+   return prompt, types.GenerateContentConfig(response_mime_type='application/json',response_schema=response_schema)
+
+def _intent_from_response(response,query:str,catalog_stats:Dict[str,list]) ->Tuple[Dict,Optional[str]]:
+   if not response or not hasattr(response,"text") or not response.text:
+      return {
+               "filters":{field:None for field in ALLOWED_FIELDS},
+               "normalized_query":query,
+               "strict":False
+             }, None
+   parsed =json.loads(response.text)
+   
+   raw_filters = parsed.get('filters',{})
+   cleaned_filters ={
+      field:_validate_field(field,raw_filters.get(field),catalog_stats)
+      for field in ALLOWED_FIELDS
+   }
+   
+   parsed_intent ={
+      "filters":cleaned_filters,
+      "normalized_query":str(parsed.get("normalized_query",query)),
+      "strict":bool(parsed.get("strict",True))
+   }
+
+   return parsed_intent,None
+
+def _intent_error(error:Exception) ->Tuple[Dict,str]:
+   if is_rate_limited(error):
+      return {},"Gemini free-tier quota exceeded. Please try later"
+   if isinstance(error, errors.APIError):
+      return {}, f"Gemini API error:{error}"
+   if isinstance(error, json.JSONDecodeError):
+      return {},f"Invalid JSON from model:{error}"
+   return {} ,f"Error parsing intent:{error}"
+
 def parse_intent_with_gemini(query:str,catalog_stats:Dict[str,list]):
    """
-   Parses a raw search query into structured intent using Gemini
+   Parses a raw search query into structured intent using Gemini.
+   Results (and, briefly, failures) are served from the intent cache when possible.
+   """
+   key = _intent_key(query, catalog_stats)
+   cached = _cached_intent(key)
+   if cached is not None:
+      return cached
+
+   parsed_intent, error = _parse_intent_uncached(query, catalog_stats)
+   _store_intent(key, parsed_intent, error)
+   return parsed_intent, error
+
+async def aparse_intent_with_gemini(query:str,catalog_stats:Dict[str,list]):
+   """
+   async variant of parse_intent_with_gemini; shares its cache.
    """
+   key = _intent_key(query, catalog_stats)
+   cached = _cached_intent(key)
+   if cached is not None:
+      return cached
+
    try:
-      if API_KEY:
-         client = genai.Client(api_key=API_KEY)
-
-      prompt =build_prompt(query,catalog_stats)
-      
-      
-      response =client.models.generate_content(
-                     model="gemini-1.5-flash",
-                     contents=prompt,
-                     config=types.GenerateContentConfig(response_mime_type='application/json',response_schema=response_schema)
-                     )
-      
-      #print(response.text)
-      if not response or not hasattr(response,"text") or not response.text:
-         return {
-                  "filters":{field:None for field in ALLOWED_FIELDS},
-                  "normalized_query":query,
-                  "strict":False
-                }
-      parsed =json.loads(response.text)
-      
-      raw_filters = parsed.get('filters',{})
-      cleaned_filters ={
-         field:_validate_field(field,raw_filters.get(field),catalog_stats)
-         for field in ALLOWED_FIELDS
-      }
-      
-      parsed_intent ={
-         "filters":cleaned_filters,
-         "normalized_query":str(parsed.get("normalized_query",query)),
-         "strict":bool(parsed.get("strict",True))
-      }
-
-      return parsed_intent,None
-   except ResourceExhausted:
-      return {},"Gemini free-tier quota exceeded. Please try later"
-   except GoogleAPICallError as api_error:
-      return {}, f"Gemini API error:{api_error}"
-   except json.JSONDecodeError as decode_error:
-      return {},f"Invalid JSON from model:{decode_error}"
-   except Exception as general_error:
-      return {} ,f"Error parsing intent:{general_error}"
-def parse_intent_batch_with_gemini(queries: List[str], catalog_stats: Dict[str, List[str]]) -> Tuple[List[Dict], Optional[str]]:
+      prompt, config = _intent_request(query, catalog_stats)
+      started = time.perf_counter()
+      response = await llm_gateway.agenerate(MODEL_NAME, prompt, config)
+      _record_prompt(prompt, catalog_stats, started, response)
+      parsed_intent, error = _intent_from_response(response, query, catalog_stats)
+   except Exception as e:
+      parsed_intent, error = _intent_error(e)
+   _store_intent(key, parsed_intent, error)
+   return parsed_intent, error
+
+def _parse_intent_uncached(query:str,catalog_stats:Dict[str,list]):
+   try:
+      prompt, config = _intent_request(query, catalog_stats)
+      started = time.perf_counter()
+      response = llm_gateway.generate(MODEL_NAME, prompt, config)
+      _record_prompt(prompt, catalog_stats, started, response)
+      return _intent_from_response(response, query, catalog_stats)
+   except Exception as e:
+      return _intent_error(e)
+
+def _batch_lookup(queries: List[str], catalog_stats: Dict[str, List[str]]):
+    """
+    Cache lookup for a batch: (keys, cached intents by key, cached errors by key, uncached key -> query).
+    """
+    keys = [_intent_key(q, catalog_stats) for q in queries]
+    results: Dict[str, Dict] = {}
+    errors: Dict[str, str] = {}
+    pending: Dict[str, str] = {}
+    for query, key in zip(queries, keys):
+        if key in results or key in errors or key in pending:
+            continue
+        cached = _cached_intent(key)
+        if cached is None:
+            pending[key] = query
+            continue
+        intent, error = cached
+        if error:
+            errors[key] = error
+        else:
+            results[key] = intent
+    return keys, results, errors, pending
+
+def _batch_store(keys: List[str], results: Dict[str, Dict], errors: Dict[str, str], pending: Dict[str, str],
+                 parsed_list: List[Dict], error: Optional[str]) -> Tuple[List[Dict], List[Optional[str]]]:
+    if error:
+        for key in pending:
+            _store_intent(key, {}, error)
+            errors[key] = error
+    elif pending:
+        if len(parsed_list) != len(pending):
+            print(f"[WARN] Gemini returned {len(parsed_list)} intents for {len(pending)} queries; not caching this batch.")
+        for n, (key, query) in enumerate(pending.items()):
+            if len(parsed_list) == len(pending):
+                results[key] = parsed_list[n]
+                _store_intent(key, parsed_list[n], None)
+            else:
+                # can't tell which answer belongs to which query; search on the raw text instead
+                results[key] = {"filters": {}, "normalized_query": query, "strict": False}
+    return [results.get(key, {}) for key in keys], [errors.get(key) for key in keys]
+
+def parse_intent_batch_with_gemini(queries: List[str], catalog_stats: Dict[str, List[str]]) -> Tuple[List[Dict], List[Optional[str]]]:
     """
     Parses a BATCH of search queries into structured intents in a single API call.
+    Queries already in the intent cache are answered from it; only the rest are sent to Gemini.
+    Returns (intents, errors) with one entry per query; a failed query has {} and its error.
     """
     if not queries:
-        return [], None
-        
+        return [], []
+
+    keys, results, errors, pending = _batch_lookup(queries, catalog_stats)
+    if not pending:
+        return _batch_store(keys, results, errors, pending, [], None)
+    return _batch_store(keys, results, errors, pending, *_parse_batch_uncached(list(pending.values()), catalog_stats))
+
+async def aparse_intent_batch_with_gemini(queries: List[str], catalog_stats: Dict[str, List[str]]) -> Tuple[List[Dict], List[Optional[str]]]:
+    """async variant of parse_intent_batch_with_gemini; shares its cache."""
+    if not queries:
+        return [], []
+
+    keys, results, errors, pending = _batch_lookup(queries, catalog_stats)
+    if not pending:
+        return _batch_store(keys, results, errors, pending, [], None)
+    batch = list(pending.values())
     try:
-        client = genai.Client(api_key=API_KEY)
-        # The schema for the response is now an ARRAY of the original object schema
-        batch_response_schema = {"type": "ARRAY", "items": response_schema}
-        
-       
-        
-        prompt = BATCH_PROMPT_TEMPLATE.format(
-            allowed_values=_format_allowed_values(catalog_stats),
-            queries_json_list=json.dumps(queries)
-        )
-        
-        response =client.models.generate_content(
-                     model="gemini-1.5-flash",
-                     contents=prompt,
-                     config=types.GenerateContentConfig(response_mime_type='application/json',response_schema=batch_response_schema)
-                     )
-        
-        if not response.text:
-            return [], "Model returned an empty response for the batch."
+        prompt, config = _batch_request(batch, catalog_stats)
+        started = time.perf_counter()
+        response = await llm_gateway.agenerate(MODEL_NAME, prompt, config)
+        _record_prompt(prompt, catalog_stats, started, response)
+        parsed_list, error = _batch_from_response(response)
+    except Exception as e:
+        parsed_list, error = [], f"Error parsing batch intent with Gemini: {e}"
+    return _batch_store(keys, results, errors, pending, parsed_list, error)
+
+def _batch_request(queries: List[str], catalog_stats: Dict[str, List[str]]) -> Tuple[str, types.GenerateContentConfig]:
+    # The schema for the response is now an ARRAY of the original object schema
+    batch_response_schema = {"type": "ARRAY", "items": response_schema}
+    prompt = BATCH_PROMPT_TEMPLATE.format(
+        allowed_values=_format_allowed_values(catalog_stats, queries),
+        queries_json_list=json.dumps(queries)
+    )
+    return prompt, types.GenerateContentConfig(response_mime_type='application/json', response_schema=batch_response_schema)
 
-        parsed_list = json.loads(response.text)
+def _batch_from_response(response) -> Tuple[List[Dict], Optional[str]]:
+    if not response.text:
+        return [], "Model returned an empty response for the batch."
+
+    parsed_list = json.loads(response.text)
+    
+    # Post-validation of each parsed item
+    validated_intents = []
+    for parsed in parsed_list:
+        raw_filters = parsed.get('filters', {})
+        # You can add the _validate_field logic here if needed for extra safety
+        validated_intents.append({
+            "filters": raw_filters,
+            "normalized_query": str(parsed.get("normalized_query", "")),
+            "strict": bool(parsed.get("strict", False))
+        })
         
-        # Post-validation of each parsed item
-        validated_intents = []
-        for parsed in parsed_list:
-            raw_filters = parsed.get('filters', {})
-            # You can add the _validate_field logic here if needed for extra safety
-            validated_intents.append({
-                "filters": raw_filters,
-                "normalized_query": str(parsed.get("normalized_query", "")),
-                "strict": bool(parsed.get("strict", False))
-            })
-            
-        return validated_intents, None
+    return validated_intents, None
 
+def _parse_batch_uncached(queries: List[str], catalog_stats: Dict[str, List[str]]) -> Tuple[List[Dict], Optional[str]]:
+    try:
+        prompt, config = _batch_request(queries, catalog_stats)
+        started = time.perf_counter()
+        response = llm_gateway.generate(MODEL_NAME, prompt, config)
+        _record_prompt(prompt, catalog_stats, started, response)
+        return _batch_from_response(response)
     except Exception as e:
         return [], f"Error parsing batch intent with Gemini: {e}"
 
@@ -238,6 +518,6 @@ if __name__=="__main__":
       stats[col]= catalog_df[col].dropna().unique().tolist() if col in catalog_df else []
 
    query = "Shirt"
-   parsed_intent= parse_intent_with_gemini(query,stats)
+   parsed_intent= parse_intent(query,stats)
    print(parsed_intent)
 
@@ -3,17 +3,24 @@ import json
 from typing import Dict, List, Any
 import pandas as pd
 import sys,os
-import streamlit as st
-import google.generativeai as genai
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
 # Import from our custom search engine module
-from train_model.search_engine import search_batch_and_find_primary
-from genAI.query_intent import parse_intent_batch_with_gemini
+from train_model.search_engine import data_load, search_batch_and_find_primary, complete_the_look, catalog_version, COMPLEMENTS_FILE
+from train_model.complements import COMPLEMENTARY_MAP
+from genAI.query_intent import parse_intent_batch, parse_intent_if_confident
+from genAI import llm_gateway
 from config import settings
+from utils.cache import LRUCache, SQLiteStore
+import copy
+import hashlib
 import json
-from typing import Dict, List, Any, Optional
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Any, Optional
 import pandas as pd
-import google.generativeai as genai
 # FILE: stylist.py
 
 
@@ -40,11 +47,6 @@ Respond **ONLY** with a JSON array of 5 simple strings.
 
 def get_complementary_catalog_sample(anchor_product: Dict[str, Any], catalog_df: pd.DataFrame, sample_size: int = 60) -> List[Dict[str, Any]]:
     """Selects a relevant, random sample from the catalog to ground the LLM's suggestions."""
-    COMPLEMENTARY_MAP = {
-        "accessories": ["apparel", "footwear", "bottomwear"], "apparel": ["footwear", "accessories", "bottomwear"],
-        "footwear": ["apparel", "accessories", "bottomwear"], "personal care": ["apparel", "accessories"],
-        "dress": ["footwear", "accessories"], "bottomwear": ["apparel", "footwear", "accessories"]
-    }
     anchor_category = anchor_product.get("masterCategory", "").lower()
     anchor_gender = anchor_product.get("gender", "").lower()
     target_categories = COMPLEMENTARY_MAP.get(anchor_category, list(COMPLEMENTARY_MAP.keys()))
@@ -55,79 +57,229 @@ def get_complementary_catalog_sample(anchor_product: Dict[str, Any], catalog_df:
     actual_sample_size = min(sample_size, len(complementary_df))
     return complementary_df.sample(n=actual_sample_size)[['articleType', 'baseColour']].to_dict('records')
 
-def query_stylist_for_creative_ideas(product: Dict[str, Any], styles_data: List[Dict[str, Any]]) -> List[str]:
-    """STAGE 1: Queries the Gemini LLM to get a list of creative search query ideas."""
+STYLIST_MODEL_NAME = "gemini-1.5-flash"
+
+def _creative_prompt(product: Dict[str, Any], styles_data: List[Dict[str, Any]]) -> str:
+    return CREATIVE_STYLE_PROMPT_TEMPLATE.format(
+        product_name=product.get('productDisplayName'), master_category=product.get('masterCategory'),
+        gender=product.get('gender'), styles_data_json=json.dumps(styles_data, indent=2)
+    )
+
+_JSON_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def stream_creative_ideas(product: Dict[str, Any], styles_data: List[Dict[str, Any]]) -> Iterator[str]:
+    """
+    Streaming STAGE 1: yields each idea as soon as its string literal in the JSON array is complete,
+    instead of waiting for the whole response.
+    """
+    text, emitted = "", 0
     try:
-        genai.configure(api_key=API_KEY)
-        gemini_model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-        
-        prompt = CREATIVE_STYLE_PROMPT_TEMPLATE.format(
-            product_name=product.get('productDisplayName'), master_category=product.get('masterCategory'),
-            gender=product.get('gender'), styles_data_json=json.dumps(styles_data, indent=2)
-        )
-        response = gemini_model.generate_content(prompt)
-        
-        raw_text = response.text.strip()
-        json_start = raw_text.find('[')
-        json_end = raw_text.rfind(']') + 1
-        if json_start == -1 or json_end == 0: return []
-        
-        ideas = json.loads(raw_text[json_start:json_end])
-        return ideas if isinstance(ideas, list) else []
+        for chunk in llm_gateway.stream(STYLIST_MODEL_NAME, _creative_prompt(product, styles_data)):
+            text += chunk
+            start = text.find('[')
+            if start == -1:
+                continue
+            # a literal only matches once its closing quote has arrived, so every match is a whole idea
+            ideas = [json.loads(f'"{m.group(1)}"') for m in _JSON_STRING.finditer(text, start)]
+            for idea in ideas[emitted:]:
+                yield idea
+            emitted = len(ideas)
     except Exception as e:
         print(f"[ERROR] AI Stylist creative idea generation failed: {e}")
-        return []
 
-def find_matching_catalog_items_with_parser(
-    creative_queries: List[str], 
-    parsed_intents: List[Dict],
-    anchor_product: Dict[str, Any]
-) -> List[Dict[str, Any]]:
-    """Takes creative queries and their parsed intents, finds matching products using a BATCH search."""
+def _match_idea(idea: str, parsed_intent: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Find the best catalog product for one parsed idea."""
+    if not parsed_intent:
+        parsed_intent = {"filters": {}, "normalized_query": idea, "strict": False}
+    return search_batch_and_find_primary(parsed_intents=[parsed_intent])[0]
+
+_stylist_pool = ThreadPoolExecutor(max_workers=settings.STYLIST_WORKERS, thread_name_prefix="stylist")
+
+def iter_stylist_outfit(
+    anchor_product: Dict[str, Any],
+    catalog_df: pd.DataFrame,
+    catalog_stats: Dict[str, List[str]],
+    deadline: Optional[float] = None,
+    enrich: Optional[bool] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    AI Stylist. Items from the precomputed complement graph come first and need no LLM call;
+    Gemini ideas are only used when the graph has fewer than Config.STYLIST_OUTFIT_SIZE items
+    for the product, or on top of it when `enrich` (Config.STYLIST_LLM_ENRICH) is set.
+    Ideas the local intent parser handles are searched as soon as Gemini emits them; the rest
+    are parsed together in one Gemini call when the stream ends. Items are yielded in the order
+    they are found, until `deadline` seconds (Config.STYLIST_DEADLINE) have passed.
+    """
+    ends_at = time.monotonic() + (settings.STYLIST_DEADLINE if deadline is None else deadline)
     used_ids = {str(anchor_product.get("id"))}
-    
-    # Call the batch search function with all queries and parsed intents at once
-    batch_results = search_batch_and_find_primary(parsed_intents=parsed_intents)
-
-    matched_items = []
-    # Process the results from the batch search
-    for i, primary_match in enumerate(batch_results):
-        if primary_match and str(primary_match.get("id")) not in used_ids:
-            primary_match['rationale'] = {
-                "note": "AI Stylist Recommendation", 
-                "creative_query": creative_queries[i]
-            }
-            matched_items.append(primary_match)
-            used_ids.add(str(primary_match.get("id")))
-        else:
-            print(f"[Stylist] -> No unique product found for idea: '{creative_queries[i]}'")
-
-    return matched_items
+    precomputed = complete_the_look(anchor_product.get("id"), settings.STYLIST_OUTFIT_SIZE) or []
+    for item in precomputed:
+        used_ids.add(str(item.get("id")))
+        item['rationale'] = {"note": "AI Stylist Recommendation", "source": "complement graph"}
+        yield item
+    # products added after build_complements, or with no complementary categories, get less (or nothing) from the graph
+    if len(precomputed) >= settings.STYLIST_OUTFIT_SIZE and not (settings.STYLIST_LLM_ENRICH if enrich is None else enrich):
+        return
+
+    data_load()  # load the model and index before the workers race for them
+    events: "queue.Queue" = queue.Queue()
+    cancelled = threading.Event()
+
+    def submit(idea, parsed_intent):
+        future = _stylist_pool.submit(_match_idea, idea, parsed_intent)
+        future.add_done_callback(lambda f, idea=idea: events.put(("match", idea, f)))
+
+    def produce():
+        complementary_sample = get_complementary_catalog_sample(anchor_product, catalog_df)
+        submitted, unsure = 0, []
+        for idea in stream_creative_ideas(anchor_product, complementary_sample):
+            if cancelled.is_set():
+                break
+            parsed_intent = parse_intent_if_confident(idea, catalog_stats)
+            if parsed_intent is None:
+                # ideas the local parser can't handle share one Gemini call once the stream ends
+                unsure.append(idea)
+                continue
+            submit(idea, parsed_intent)
+            submitted += 1
+        if unsure and not cancelled.is_set():
+            parsed_intents, _ = parse_intent_batch(unsure, catalog_stats)
+            for idea, parsed_intent in zip(unsure, parsed_intents):
+                submit(idea, parsed_intent)
+                submitted += 1
+        events.put(("ideas_done", submitted, None))
+
+    threading.Thread(target=produce, name="stylist-ideas", daemon=True).start()
+
+    total, finished = None, 0
+    try:
+        while total is None or finished < total:
+            remaining = ends_at - time.monotonic()
+            if remaining <= 0:
+                print(f"[Stylist] -> deadline reached with {finished} idea(s) matched")
+                return
+            try:
+                kind, value, future = events.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if kind == "ideas_done":
+                total = value
+                continue
+            finished += 1
+            try:
+                match = future.result()
+            except Exception as e:
+                print(f"[Stylist] -> search failed for idea '{value}': {e}")
+                continue
+            if match and str(match.get("id")) not in used_ids:
+                used_ids.add(str(match.get("id")))
+                match['rationale'] = {"note": "AI Stylist Recommendation", "creative_query": value}
+                yield match
+            else:
+                print(f"[Stylist] -> No unique product found for idea: '{value}'")
+    finally:
+        cancelled.set()
 
 def generate_stylist_outfit(
     anchor_product: Dict[str, Any], 
     catalog_df: pd.DataFrame, 
     catalog_stats: Dict[str, List[str]], 
+    deadline: Optional[float] = None,
+    enrich: Optional[bool] = None,
 ) -> List[Dict[str, Any]]:
-    """Main orchestrator for the FASTER, BATCHED, two-stage AI Stylist."""
-    # STAGE 1: Get 5 creative ideas in one LLM call
-    complementary_sample = get_complementary_catalog_sample(anchor_product, catalog_df)
-    creative_ideas = query_stylist_for_creative_ideas(anchor_product, complementary_sample)
-    if not creative_ideas: 
-        print("[INFO] AI Stylist returned no creative ideas.")
-        return []
-    print(f"\n[INFO] AI Stylist creative ideas: {json.dumps(creative_ideas, indent=2)}")
-    
-    # STAGE 2: Parse all 5 ideas in a single BATCH LLM call
-    print("\n[INFO] Parsing all creative ideas in a single batch call...")
-    parsed_intents, error = parse_intent_batch_with_gemini(creative_ideas, catalog_stats)
-    if error:
-        print(f"[ERROR] Batch intent parsing failed: {error}")
-        return []
-    print("[INFO] Batch parsing successful.")
-
-    # Use the parsed intents to find real products via batch search
-    return find_matching_catalog_items_with_parser(creative_ideas, parsed_intents, anchor_product)
+    """Main orchestrator for the AI Stylist; collects everything iter_stylist_outfit finds before the deadline."""
+    return list(iter_stylist_outfit(anchor_product, catalog_df, catalog_stats, deadline, enrich))
+
+# --- Outfit cache ---
+# (anchor id, catalog + complement graph version) -> {"created": epoch seconds, "items": [...]}, shared by every
+# session of this process. Entries are fresh for OUTFIT_CACHE_TTL; for OUTFIT_STALE_TTL after that they are
+# still served, and the first request for one starts a background regeneration.
+_outfit_cache = LRUCache(settings.OUTFIT_CACHE_SIZE, ttl=settings.OUTFIT_CACHE_TTL + settings.OUTFIT_STALE_TTL)
+_outfit_store = SQLiteStore(settings.OUTFIT_CACHE_PATH, table="outfits") if settings.OUTFIT_CACHE_PATH else None
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="outfit-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def _outfit_key(anchor_id) -> str:
+    try:
+        st_graph = os.stat(COMPLEMENTS_FILE)
+        graph = (st_graph.st_mtime_ns, st_graph.st_size)
+    except OSError:
+        graph = None
+    version = hashlib.sha1(repr((catalog_version(), graph)).encode("utf-8")).hexdigest()[:16]
+    return f"{anchor_id}:{version}"
+
+def _json_default(value):
+    # numpy scalars from the catalog columns
+    return value.item() if hasattr(value, "item") else str(value)
+
+def _cached_outfit(key: str) -> Optional[Dict[str, Any]]:
+    entry = _outfit_cache.get(key)
+    if entry is None and _outfit_store is not None:
+        blob = _outfit_store.get(key)
+        if blob is not None:
+            entry = json.loads(blob)
+            _outfit_cache.set(key, entry)
+    if entry is not None and time.time() - entry["created"] >= settings.OUTFIT_CACHE_TTL + settings.OUTFIT_STALE_TTL:
+        return None
+    return entry
+
+def _store_outfit(key: str, items: List[Dict[str, Any]], complete: bool) -> None:
+    # a partial outfit (deadline hit) is stored as already stale, so the next view refreshes it
+    created = time.time() - (0 if complete else settings.OUTFIT_CACHE_TTL)
+    entry = {"created": created, "items": items}
+    _outfit_cache.set(key, entry)
+    if _outfit_store is not None:
+        _outfit_store.set(key, json.dumps(entry, default=_json_default).encode("utf-8"),
+                          ttl=settings.OUTFIT_CACHE_TTL + settings.OUTFIT_STALE_TTL)
+
+def _refresh_outfit(key: str, anchor_product: Dict[str, Any], catalog_df: pd.DataFrame, catalog_stats: Dict[str, List[str]]) -> None:
+    try:
+        items = generate_stylist_outfit(anchor_product, catalog_df, catalog_stats)
+        _store_outfit(key, items, len(items) >= settings.STYLIST_OUTFIT_SIZE)
+    except Exception as e:
+        print(f"[Stylist] -> background outfit refresh failed for {key}: {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+def _schedule_refresh(key: str, anchor_product: Dict[str, Any], catalog_df: pd.DataFrame, catalog_stats: Dict[str, List[str]]) -> None:
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    _refresh_pool.submit(_refresh_outfit, key, anchor_product, catalog_df, catalog_stats)
+
+def iter_cached_stylist_outfit(
+    anchor_product: Dict[str, Any],
+    catalog_df: pd.DataFrame,
+    catalog_stats: Dict[str, List[str]],
+) -> Iterator[Dict[str, Any]]:
+    """
+    iter_stylist_outfit behind the outfit cache. Cached outfits are yielded at once (stale ones
+    are regenerated in the background); on a miss the items stream as usual and the finished
+    outfit is cached. Reruns of the product page therefore never call the LLM again.
+    """
+    key = _outfit_key(anchor_product.get("id"))
+    entry = _cached_outfit(key)
+    if entry is not None:
+        if time.time() - entry["created"] >= settings.OUTFIT_CACHE_TTL:
+            _schedule_refresh(key, dict(anchor_product), catalog_df, catalog_stats)
+        yield from copy.deepcopy(entry["items"])
+        return
+
+    items = []
+    for item in iter_stylist_outfit(anchor_product, catalog_df, catalog_stats):
+        items.append(copy.deepcopy(item))
+        yield item
+    # only reached when the caller consumed the whole stream
+    _store_outfit(key, items, len(items) >= settings.STYLIST_OUTFIT_SIZE)
+
+def outfit_cache_stats() -> Dict[str, Any]:
+    stats = {"memory": _outfit_cache.stats(), "refreshing": len(_refreshing)}
+    if _outfit_store is not None:
+        stats["disk"] = _outfit_store.stats()
+    return stats
 
 # # --- Main Test Function (using mocks) ---
 
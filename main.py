@@ -1,15 +1,10 @@
 import streamlit as st
 import pandas as pd
 from config import settings
-from utils import cart,orders,mailer 
-from genAI import query_intent
-from train_model.build_index import build_index
-from train_model import search_engine
-from genAI import mail_generation
-from genAI.stylist import generate_stylist_outfit
-import uuid
-from datetime import datetime, timezone 
-import os,re
+from utils import cart,orders,outbox,search_client 
+# torch, open_clip, faiss and the Gemini SDK are imported by the warmup thread or where they are used
+from train_model import warmup
+import os
 
 
 
@@ -51,6 +46,13 @@ def get_catalog_stats(catalog_df):
 @st.cache_resource
 def ensure_index_and_load_search_engine():
     """ This function loads the index into cache and initializes search function"""
+    if settings.SEARCH_API_URL:
+        # search runs in the API service (api.py); this process only talks HTTP to it
+        with st.spinner("connecting to the search API..."):
+            client = search_client.get_client()
+            client.health()
+        return client
+    from train_model import search_engine, search_service
     with st.spinner("building or loading product index... This may take a moment"):
         if not os.path.exists(os.path.join(settings.INDEX_DIR,'faiss_clip.index')):
             st.info('Product index not found. Building it now..')
@@ -58,8 +60,8 @@ def ensure_index_and_load_search_engine():
             st.success('product index built successfully!')
         else:
             st.success('product index loaded')
-    #it should return search engine    
-    return search_engine
+    #it should return search engine; the micro-batching service has the same search_primary_and_recommendations
+    return search_service.get_service() if settings.SEARCH_MICROBATCH else search_engine
 
 def load_row(r):
     df = pd.read_csv(settings.DATA_DIR)
@@ -95,15 +97,21 @@ def handle_search(search_query):
         return
     with st.spinner('searching for products....'):
         try:
-            if not st.session_state.catalog_stats:
-                st.session_state.catalog_stats=get_catalog_stats(load_catalog())
-            
-            parsed_intent = query_intent.parse_intent_with_gemini(search_query, st.session_state.catalog_stats)
-            
-            primary, recommendations =st.session_state.search_engine.search_primary_and_recommendations(
-                              search_query,parsed_intent=parsed_intent
-                         )            
+            if settings.SEARCH_API_URL:
+                # the API parses the intent itself
+                primary, recommendations = st.session_state.search_engine.search(search_query)
+            else:
+                from genAI import query_intent
+                if not st.session_state.catalog_stats:
+                    st.session_state.catalog_stats=get_catalog_stats(load_catalog())
+
+                parsed_intent = query_intent.parse_intent(search_query, st.session_state.catalog_stats)
+
+                primary, recommendations =st.session_state.search_engine.search_primary_and_recommendations(
+                                  search_query,parsed_intent=parsed_intent
+                             )
             st.session_state.search_results=(primary,recommendations)
+            warmup.mark_search()
 
             if  primary is None and not recommendations:
                 st.warning('No products found matching query')
@@ -132,10 +140,27 @@ def render_sidebar():
         if st.button(f"🛒 Cart ({cart.cart_count(st.session_state.cart)})", use_container_width=True):
             navigate_to('cart')
      
+    warm = warmup.status()
+    if warm['state'] == 'warming':
+        st.sidebar.caption(f"⏳ Loading search ({warm['stage']})... searches will wait for it.")
+    elif warm['state'] == 'failed':
+        st.sidebar.warning(f"Search warmup failed: {warm['errors']}")
+
     st.sidebar.markdown("<hr style='margin: 15px 0;'>", unsafe_allow_html=True)
+    full_rebuild = st.sidebar.checkbox('Full rebuild (re-encode every image)', key='full_rebuild')
     if st.sidebar.button('♻️ Rebuild Index(Optional)',key='rebuild_index_button', use_container_width=True):
-            with st.spinner('Rebuildling product index... This will take a while'):
-                build_index()
+            from train_model.build_index import build_index, update_index
+            from train_model.build_complements import build_complements
+            from train_model import search_engine
+            if full_rebuild:
+                with st.spinner('Rebuildling product index... This will take a while'):
+                    build_index()
+            else:
+                with st.spinner('Updating product index with changed products...'):
+                    update_index()
+            with st.spinner('Rebuilding the complete-the-look graph...'):
+                build_complements()
+            search_engine.reset_data()
             st.cache_resource.clear()
             st.session_state.search_engine = ensure_index_and_load_search_engine()
             st.sidebar.success('Index rebuilt successfully')
@@ -311,24 +336,29 @@ def render_product_detail_page():
     st.markdown("---")
     st.subheader("🕺💃 Shop the Look - AI Stylist Recommendations")
 
+    # cards are drawn as the stylist finds each item (cached outfits appear at once); it gives up after Config.STYLIST_DEADLINE seconds
+    outfit = []
+    cols = st.columns(5)
     try:
-        outfit = generate_stylist_outfit(product,load_catalog(), st.session_state.catalog_stats)
+        with st.spinner("Styling the look..."):
+            if settings.SEARCH_API_URL:
+                outfit_items = st.session_state.search_engine.stylist(product['id'])
+            else:
+                from genAI.stylist import iter_cached_stylist_outfit
+                outfit_items = iter_cached_stylist_outfit(product, load_catalog(), st.session_state.catalog_stats)
+            for item in outfit_items:
+                with cols[len(outfit) % len(cols)]:
+                    rec_img = get_product_image(item['id'])
+                    if rec_img:
+                        st.image(rec_img, use_column_width=True)
+                    st.markdown(f"**{item['productDisplayName']}**")
+                    st.markdown(f"{item['articleType']}")
+                    st.markdown(f"Price: ₹{item['price_inr']}")
+                outfit.append(item)
     except Exception as e:
-        outfit = None
         st.error(f"Error generating outfit: {e}")
 
     if outfit:
-        cols = st.columns(len(outfit))
-        for idx, item in enumerate(outfit):
-            with cols[idx]:
-                
-                img_path = get_product_image(item['id'])
-                if img_path:
-                    st.image(img_path, use_column_width=True)
-                st.markdown(f"**{item['productDisplayName']}**")
-                st.markdown(f"{item['articleType']}")
-                st.markdown(f"Price: ₹{item['price_inr']}")
-
         # Add All to Cart Button
         if st.button("🛒 Add All to Cart (Complete Outfit)"):
             # Add anchor product + stylist recommendations to cart
@@ -352,7 +382,7 @@ def render_product_detail_page():
                     "image": rec_img_path
                 })
 
-            for it in items_to_add:z
+            for it in items_to_add:
                 cart.add_to_cart(st.session_state.cart, it)
             st.success(f"🎉 Added complete outfit ({len(items_to_add)} items) to your cart!")
     else:
@@ -425,14 +455,11 @@ def  render_checkout_page():
                 st.error(f"Failed to save order: {e}")
                 return
 
-            content, err = mail_generation.generate_order_email_content(order, returning)
-
-            if content:
-                ok, mode = mailer.send_order_email(order, email, content)
-                if not ok:
-                    st.warning(f"Email could not be sent (mode: {mode})")
-            else:
-                st.warning(f"Email content generation failed: {err}")
+            # the confirmation email (Gemini text + SMTP) is sent by the outbox worker, not in this request
+            try:
+                outbox.get_outbox().enqueue("order_email", order["order_id"], {"order": order, "to": email, "returning": returning})
+            except Exception as e:
+                st.warning(f"Confirmation email could not be queued: {e}")
             
 
             st.session_state.order_details = order
@@ -539,6 +566,11 @@ def main():
   
     
     initialize_session_state()
+    if not settings.SEARCH_API_URL:
+        # model, index and catalog load in the background while the first page renders
+        warmup.start()
+    # also sends emails still queued from before a restart
+    outbox.start_worker()
 
     
     
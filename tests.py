@@ -46,6 +46,89 @@ def test_embedding_and_indexes():
         pytest.skip("Embeddings/index artifacts not present in this environment.")
 
 
+def _stub_clip(torch, np, loads):
+    """(model, preprocess) standing in for CLIP: an image's vector is its pixels plus one."""
+    class StubModel:
+        def encode_image(self, batch):
+            loads.append(len(batch))
+            return batch + 1.0
+    return StubModel(), lambda im: torch.tensor(np.asarray(im, dtype="float32").ravel())
+
+def _write_image(path, colour):
+    from PIL import Image
+    Image.new("RGB", (2, 2), colour).save(path, "JPEG")
+
+def test_batched_encoding_matches_single_images(tmp_path):
+    torch = pytest.importorskip("torch")
+    np = must_import("numpy")
+    build_index = must_import("train_model.build_index")
+    items = []
+    for pid in range(7):
+        path = tmp_path / f"{pid}.jpg"
+        if pid == 4:
+            path.write_bytes(b"not a jpeg")   # skipped in the middle of the second batch
+        else:
+            _write_image(path, (pid * 30, 255 - pid * 30, 7))
+        items.append((str(pid), path))
+
+    single_batches, batches = [], []
+    single_ids, single = build_index.encode_images(items, *_stub_clip(torch, np, single_batches), batch_size=1, num_workers=1)
+    ids, feats = build_index.encode_images(items, *_stub_clip(torch, np, batches), batch_size=3, num_workers=2)
+    # 7 images in batches of 3, one of them unreadable: 3 + 2 + 1
+    assert batches == [3, 2, 1] and single_batches == [1] * 6
+    assert ids == single_ids == ["0", "1", "2", "3", "5", "6"]
+    assert np.allclose(np.concatenate(feats), np.concatenate(single), atol=1e-6)
+    assert np.allclose(np.linalg.norm(np.concatenate(feats), axis=1), 1.0)
+
+def test_incremental_update_matches_full_build(tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    np = must_import("numpy")
+    build_index = must_import("train_model.build_index")
+    img_dir = tmp_path / "images"; img_dir.mkdir()
+    for name, value in {"IMG_DIR": img_dir, "CSV_Path": tmp_path / "styles.csv", "EMB_FILE": tmp_path / "vecs.npy",
+                        "IDX_FILE": tmp_path / "ids.npy", "FAISS_FILE": tmp_path / "x.index", "MANIFEST_FILE": tmp_path / "manifest.json"}.items():
+        monkeypatch.setattr(build_index, name, value)
+    models = []
+    monkeypatch.setattr(build_index, "_load_model", lambda num_threads=None: models.append(1) or _stub_clip(torch, np, []))
+    monkeypatch.setattr(build_index.settings, "INDEX_TYPE", "Flat")
+
+    def catalog(pids):
+        (tmp_path / "styles.csv").write_text("id\n" + "".join(f"{pid}\n" for pid in pids))
+    for pid in range(1, 6):
+        _write_image(img_dir / f"{pid}.jpg", (pid * 40, 0, 0))
+    (img_dir / "6.jpg").write_bytes(b"not a jpeg")
+    catalog(range(1, 7))
+    build_index.build_index(batch_size=2, num_workers=2)
+    import json
+    # the broken image is remembered, so updates only retry it once the file changes
+    assert json.loads((tmp_path / "manifest.json").read_text())["6"]["failed"] is True
+
+    def artifacts():
+        ids = build_index.load_idmap(tmp_path / "ids.npy").tolist()
+        vecs = np.load(tmp_path / "vecs.npy")
+        index = build_index.faiss.read_index(str(tmp_path / "x.index"))
+        assert index.ntotal == len(ids)
+        return {pid: vec for pid, vec in zip(ids, vecs)}
+
+    # product 2 removed, 3 re-shot, 7 added
+    _write_image(img_dir / "3.jpg", (0, 0, 200))
+    _write_image(img_dir / "7.jpg", (0, 200, 0))
+    catalog([1, 3, 4, 5, 6, 7])
+    build_index.update_index(batch_size=2, num_workers=2)
+    updated = artifacts()
+    assert sorted(updated) == ["1", "3", "4", "5", "7"] and len(models) == 2
+
+    # nothing changed (6.jpg is still broken): no model load, index files untouched
+    stamps = [os.stat(tmp_path / name).st_mtime_ns for name in ("x.index", "ids.npy", "vecs.npy")]
+    build_index.update_index(batch_size=2, num_workers=2)
+    assert len(models) == 2
+    assert stamps == [os.stat(tmp_path / name).st_mtime_ns for name in ("x.index", "ids.npy", "vecs.npy")]
+
+    build_index.build_index(batch_size=2, num_workers=2)
+    rebuilt = artifacts()
+    assert sorted(rebuilt) == sorted(updated)
+    assert all(np.allclose(rebuilt[pid], updated[pid]) for pid in rebuilt)
+
 def test_genai():
     """Call real functions (no mocking). Only validate return types/shapes."""
     query_intent = must_import("genAI.query_intent")
@@ -79,3 +162,706 @@ def test_genai():
         assert k in content and isinstance(content[k], str) and content[k].strip(), f"{k} required"
     assert (err2 is None or isinstance(err2, str)), "err must be str or None"
 
+
+def test_index_factory_types():
+    index_factory = must_import("train_model.index_factory")
+    np = must_import("numpy")
+    vecs = np.random.default_rng(0).random((500, 32)).astype("float32")
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+
+    for index_type in ("Flat", "IVFFlat", "HNSW"):
+        index = index_factory.create_index(vecs, index_type)
+        assert index.ntotal == len(vecs)
+        _, idx = index.search(vecs[:5], 1, params=index_factory.search_params(index))
+        assert idx.shape == (5, 1)
+
+def test_catalog_store_filters():
+    catalog_store = must_import("train_model.catalog_store")
+    pd = must_import("pandas")
+    np = must_import("numpy")
+    catalog = pd.DataFrame({
+        "id": ["1", "2", "3", "4"],
+        "gender": ["women", "women", "men", "women"],
+        "articleType": ["heels", "heels", "shirts", "flats"],
+        "price": [400.0, 900.0, 300.0, 450.0],
+    })
+    # FAISS positions are ordered differently from the CSV, and "9" has no catalog row
+    store = catalog_store.CatalogStore(catalog, np.array(["4", "3", "9", "2", "1"]), ["gender", "articleType"])
+
+    assert store.select({}) is not None and list(store.select({})) == [0, 1, 3, 4]
+    assert list(store.select({"gender": "women", "articleType": "heels", "priceMax": 500})) == [4]
+    assert list(store.select({"gender": "unisex", "priceMin": 420})) == [0, 3]
+    assert len(store.select({"articleType": "boots"})) == 0
+
+    rows = np.array([[4, 2, 3], [1, 0, 4]])
+    assert store.mask({"gender": "women"}, rows).tolist() == [[True, False, True], [False, True, True]]
+    assert store.record(4) == {"id": "1", "gender": "women", "articleType": "heels", "price": 400.0}
+    # empty cells and products missing from the CSV come back as None, never NaN
+    with_usage = catalog.assign(usage=["Casual", np.nan, "Formal", "Casual"])
+    store = catalog_store.CatalogStore(with_usage, np.array(["4", "3", "9", "2", "1"]), ["gender", "articleType"])
+    assert store.record(3)["usage"] is None and store.record(2)["price"] is None and store.record(4)["usage"] == "Casual"
+
+    # batch masks: one filter dict per row, -1 padding never matches
+    rows = np.array([[4, 2, 3, -1], [1, 0, 4, 3], [0, 3, 1, -1]])
+    batch = store.mask_batch([{"gender": "women"}, {"priceMax": 420}, {"articleType": "boots"}], rows)
+    assert batch.tolist() == [[True, False, True, False], [True, False, True, False], [False, False, False, False]]
+
+def test_lru_cache_and_sqlite_store(tmp_path):
+    cache = must_import("utils.cache")
+    lru = cache.LRUCache(maxsize=2)
+    lru.set("a", 1); lru.set("b", 2)
+    assert lru.get("a") == 1          # "a" is now most recently used
+    lru.set("c", 3)                   # evicts "b"
+    assert lru.get("b") is None and lru.get("c") == 3
+    assert lru.stats()["hits"] == 2 and lru.stats()["misses"] == 1
+
+    ttl_cache = cache.LRUCache(maxsize=4, ttl=60)
+    ttl_cache.set("fresh", 1)
+    ttl_cache.set("stale", 2, ttl=-1)   # already expired
+    assert ttl_cache.get("fresh") == 1 and ttl_cache.get("stale") is None
+
+    store = cache.SQLiteStore(str(tmp_path / "cache.sqlite"))
+    store.set_many([("x", b"1"), ("y", b"2")])
+    assert store.get_many(["x", "y", "z"]) == {"x": b"1", "y": b"2"}
+    assert cache.SQLiteStore(str(tmp_path / "cache.sqlite")).get("y") == b"2"
+
+def test_intent_cache_and_batch_errors(monkeypatch, tmp_path):
+    pytest.importorskip("google.genai")
+    query_intent = must_import("genAI.query_intent")
+    monkeypatch.setattr(query_intent, "_intent_cache", query_intent.LRUCache(16))
+    monkeypatch.setattr(query_intent, "_intent_store", None)
+    monkeypatch.setattr(query_intent.settings, "INTENT_CACHE_PATH", str(tmp_path / "intents.sqlite"))
+    monkeypatch.setattr(query_intent.settings, "INTENT_NEGATIVE_TTL", 0.2)
+    calls, batches, failing = [], [], set()
+
+    def parse_one(query, stats):
+        calls.append(query)
+        return ({}, "quota") if query in failing else ({"filters": {}, "normalized_query": query, "strict": True}, None)
+    def parse_batch(queries, stats):
+        batches.append(queries)
+        return [{"filters": {}, "normalized_query": q, "strict": True} for q in queries], None
+    monkeypatch.setattr(query_intent, "_parse_intent_uncached", parse_one)
+    monkeypatch.setattr(query_intent, "_parse_batch_uncached", parse_batch)
+
+    # the SQLite file is only created on first use
+    assert not (tmp_path / "intents.sqlite").exists()
+    assert query_intent.parse_intent_with_gemini("Red  Shirt", {})[1] is None
+    assert query_intent.parse_intent_with_gemini("red shirt", {})[1] is None   # same normalised key: a hit
+    assert calls == ["Red  Shirt"] and (tmp_path / "intents.sqlite").exists()
+    # a fresh process still finds it on disk
+    monkeypatch.setattr(query_intent, "_intent_cache", query_intent.LRUCache(16))
+    assert query_intent.parse_intent_with_gemini("red shirt", {})[0]["normalized_query"] == "Red  Shirt"
+    assert calls == ["Red  Shirt"]
+
+    # failures are cached only for INTENT_NEGATIVE_TTL
+    failing.add("blue jeans")
+    assert query_intent.parse_intent_with_gemini("blue jeans", {}) == ({}, "quota")
+    assert query_intent.parse_intent_with_gemini("blue jeans", {}) == ({}, "quota")
+    assert calls.count("blue jeans") == 1
+    import time; time.sleep(0.3)
+    failing.clear()
+    assert query_intent.parse_intent_with_gemini("blue jeans", {})[1] is None
+    assert calls.count("blue jeans") == 2
+
+    # a batch sends only its uncached queries; a cached failure only fails its own item
+    failing.add("green hat")
+    query_intent.parse_intent_with_gemini("green hat", {})
+    intents, errors = query_intent.parse_intent_batch_with_gemini(["red shirt", "green hat", "white shoes", "black belt"], {})
+    assert batches == [["white shoes", "black belt"]]
+    assert errors == [None, "quota", None, None] and intents[1] == {}
+    assert [i.get("normalized_query") for i in intents] == ["Red  Shirt", None, "white shoes", "black belt"]
+
+def test_local_intent_parser():
+    local_intent = must_import("genAI.local_intent")
+    stats = {
+        "gender": ["Men", "Women"],
+        "articleType": ["Heels", "Tshirts", "Jeans", "Sports Shoes"],
+        "baseColour": ["Green", "Navy Blue", "Black"],
+    }
+    parsed = local_intent.parse_intent_locally("women green heels under 500", stats)
+    assert parsed["filters"]["gender"] == "Women"
+    assert parsed["filters"]["articleType"] == "Heels"
+    assert parsed["filters"]["baseColour"] == "Green"
+    assert parsed["filters"]["priceMax"] == 500 and parsed["filters"]["priceMin"] is None
+    assert parsed["strict"] and parsed["confidence"] == 1.0
+
+    parsed = local_intent.parse_intent_locally("Men's navy t-shirts between 500 and 2k", stats)
+    assert parsed["filters"]["gender"] == "Men" and parsed["filters"]["baseColour"] == "Navy Blue"
+    assert parsed["filters"]["articleType"] == "Tshirts"
+    assert (parsed["filters"]["priceMin"], parsed["filters"]["priceMax"]) == (500, 2000)
+    assert not parsed["strict"]
+
+    assert local_intent.parse_intent_locally("sneakers 1000-3000", stats)["filters"]["articleType"] == "Sports Shoes"
+    assert local_intent.parse_intent_locally("something nice for a beach wedding", stats)["confidence"] < 0.8
+
+def test_prompt_vocabulary_pruning():
+    np = must_import("numpy")
+    prompt_vocabulary = must_import("genAI.prompt_vocabulary")
+    stats = {
+        "gender": ["Men", "Women"],
+        "articleType": ["Shirts", "Heels", "Jeans", "Watches", "Dresses", "Belts"],
+    }
+    # toy "embedding": one axis per article type, queries land on the type they mention
+    axes = {"shirts": 0, "heels": 1, "jeans": 2, "watches": 3, "dresses": 4, "belts": 5, "wedding": 4}
+    def encoder(texts):
+        vecs = np.zeros((len(texts), 6), dtype="float32")
+        for n, text in enumerate(texts):
+            for word in text.lower().split():
+                if word in axes: vecs[n, axes[word]] = 1.0
+        return vecs
+
+    vocabulary = prompt_vocabulary.PromptVocabulary(stats, max_values=2, encoder=encoder)
+    assert vocabulary.values_for(["women heel"]) == {"gender": ["Men", "Women"], "articleType": ["Shirts", "Heels"]}
+    assert vocabulary.values_for(["outfit for a wedding"])["articleType"][-1] == "Dresses"
+    assert len(vocabulary.block_for(["women heel"])) < len(vocabulary.full_block)
+
+def test_llm_gateway_rotates_keys():
+    pytest.importorskip("google.genai")
+    llm_gateway = must_import("genAI.llm_gateway")
+    calls = []
+
+    class RateLimited(Exception):
+        code = 429
+
+    class FakeModels:
+        def __init__(self, name): self.name = name
+        def generate_content(self, model, contents, config=None):
+            calls.append(self.name)
+            if self.name == "a": raise RateLimited("quota")
+            return f"{self.name}:{contents}"
+
+    gateway = llm_gateway.LLMGateway({"a": "key-a", "b": "key-b", "unset": None}, max_concurrency=1, timeout=1)
+    for slot in gateway._slots:
+        slot._client = type("FakeClient", (), {"models": FakeModels(slot.name)})()
+    # "a" is rate limited, so every request ends up on "b"
+    assert gateway.generate("m", "x") == "b:x"
+    assert gateway.generate("m", "y") == "b:y"
+    assert calls == ["a", "b", "b"]
+    assert gateway.stats()["a"]["rate_limited"] == 1 and gateway.stats()["b"]["requests"] == 2
+
+def test_stylist_streams_ideas_before_deadline(monkeypatch):
+    pytest.importorskip("streamlit")
+    pytest.importorskip("google.genai")
+    stylist = must_import("genAI.stylist")
+    chunks = ['["black jea', 'ns", "white sneakers"', ', "belt", "slow"]']
+    monkeypatch.setattr(stylist.llm_gateway, "stream", lambda *a, **k: iter(chunks))
+    monkeypatch.setattr(stylist, "data_load", lambda: None)
+    monkeypatch.setattr(stylist, "complete_the_look", lambda pid, k: None)
+    monkeypatch.setattr(stylist, "get_complementary_catalog_sample", lambda anchor, df: [])
+
+    # the local parser handles "black jeans" and "slow"; the other ideas share one Gemini call
+    batches = []
+    monkeypatch.setattr(stylist, "parse_intent_if_confident", lambda idea, stats: {"local": idea} if idea in ("black jeans", "slow") else None)
+    monkeypatch.setattr(stylist, "parse_intent_batch", lambda ideas, stats: (batches.append(ideas) or [{"gemini": i} for i in ideas], None))
+
+    def match(idea, parsed_intent):
+        assert parsed_intent in ({"local": idea}, {"gemini": idea})
+        if idea == "slow":
+            import time; time.sleep(2)
+        return {"id": "anchor" if idea == "belt" else idea}
+    monkeypatch.setattr(stylist, "_match_idea", match)
+
+    assert list(stylist.stream_creative_ideas({}, [])) == ["black jeans", "white sneakers", "belt", "slow"]
+    outfit = stylist.generate_stylist_outfit({"id": "anchor"}, None, {}, deadline=0.5)
+    assert sorted(item["id"] for item in outfit) == ["black jeans", "white sneakers"]
+    assert batches == [["white sneakers", "belt"]]
+
+    # a product missing from the complement graph (or short of a full outfit) still gets Gemini ideas
+    monkeypatch.setattr(stylist.settings, "STYLIST_OUTFIT_SIZE", 2)
+    monkeypatch.setattr(stylist, "complete_the_look", lambda pid, k: [])
+    outfit = stylist.generate_stylist_outfit({"id": "anchor"}, None, {}, deadline=0.5, enrich=False)
+    assert sorted(item["id"] for item in outfit) == ["black jeans", "white sneakers"]
+    monkeypatch.setattr(stylist, "complete_the_look", lambda pid, k: [{"id": "graph-1"}])
+    outfit = stylist.generate_stylist_outfit({"id": "anchor"}, None, {}, deadline=0.5, enrich=False)
+    assert [item["id"] for item in outfit][0] == "graph-1" and len(outfit) == 3
+
+    # with a full outfit in the complement graph the stylist answers from it without asking Gemini
+    monkeypatch.setattr(stylist, "complete_the_look", lambda pid, k: [{"id": "graph-1"}, {"id": "graph-2"}])
+    monkeypatch.setattr(stylist.llm_gateway, "stream", lambda *a, **k: pytest.fail("LLM called"))
+    assert [item["id"] for item in stylist.generate_stylist_outfit({"id": "anchor"}, None, {}, enrich=False)] == ["graph-1", "graph-2"]
+
+def test_complement_graph(tmp_path):
+    np = must_import("numpy")
+    complements = must_import("train_model.complements")
+    ids = ["10", "11", "12"]
+    matrix = np.array([[2, 1, -1], [-1, -1, -1], [0, -1, -1]], dtype="int32")
+    np.save(tmp_path / "complements.npy", matrix)
+    (tmp_path / "complements.json").write_text('{"ids_sha1": "%s"}' % complements.ids_fingerprint(ids))
+
+    graph = complements.ComplementGraph.load(tmp_path / "complements.npy", tmp_path / "complements.json", np.array(ids))
+    assert graph.positions(0).tolist() == [2, 1] and graph.positions(0, 1).tolist() == [2]
+    assert graph.positions(1).tolist() == []
+    # built for another id map -> unusable
+    assert complements.ComplementGraph.load(tmp_path / "complements.npy", tmp_path / "complements.json", np.array(ids[:2])) is None
+    assert complements.anchor_category("Apparel", "Bottomwear") == "bottomwear"
+    assert complements.anchor_category("Apparel", "Topwear") == "apparel"
+
+def test_outfit_cache_stale_while_revalidate(monkeypatch):
+    pytest.importorskip("streamlit")
+    pytest.importorskip("google.genai")
+    stylist = must_import("genAI.stylist")
+    generated = []
+
+    def fake_outfit(anchor, df, stats, deadline=None, enrich=None):
+        generated.append(anchor["id"])
+        yield {"id": f"look-{len(generated)}"}
+    monkeypatch.setattr(stylist, "iter_stylist_outfit", fake_outfit)
+    monkeypatch.setattr(stylist, "_outfit_store", None)
+    monkeypatch.setattr(stylist, "_outfit_cache", stylist.LRUCache(8))
+    monkeypatch.setattr(stylist.settings, "STYLIST_OUTFIT_SIZE", 1)
+
+    anchor = {"id": "anchor"}
+    assert [i["id"] for i in stylist.iter_cached_stylist_outfit(anchor, None, {})] == ["look-1"]
+    # a rerun is served from the cache
+    assert [i["id"] for i in stylist.iter_cached_stylist_outfit(anchor, None, {})] == ["look-1"]
+    assert generated == ["anchor"]
+
+    # once stale, the old outfit is still served and a refresh runs in the background
+    key = stylist._outfit_key("anchor")
+    stylist._outfit_cache.get(key)["created"] -= stylist.settings.OUTFIT_CACHE_TTL
+    assert [i["id"] for i in stylist.iter_cached_stylist_outfit(anchor, None, {})] == ["look-1"]
+    stylist._refresh_pool.submit(lambda: None).result()
+    import time
+    for _ in range(50):
+        if not stylist._refreshing: break
+        time.sleep(0.02)
+    assert [i["id"] for i in stylist.iter_cached_stylist_outfit(anchor, None, {})] == ["look-2"]
+
+def test_search_service_coalesces_concurrent_queries(monkeypatch):
+    search_service = must_import("train_model.search_service")
+    calls = []
+
+    def fake_search_many(requests):
+        calls.append(len(requests))
+        if any(r["query_text"] == "bad" for r in requests):
+            raise ValueError("bad query")
+        return [(None, [{"id": r["query_text"]}]) for r in requests]
+    monkeypatch.setattr(search_service.search_engine, "search_many", fake_search_many)
+
+    service = search_service.SearchService(window_ms=50, max_batch=8)
+    futures = [service.submit(f"q{i}", parsed_intent=({}, None)) for i in range(10)]
+    assert [f.result(timeout=5)[1][0]["id"] for f in futures] == [f"q{i}" for i in range(10)]
+    # 10 queries submitted together: one full batch of 8 and one of the remaining 2
+    assert calls == [8, 2] and service.stats()["queries"] == 10
+
+    # one failing query in a batch only fails its own caller
+    calls.clear()
+    futures = [service.submit(q, parsed_intent=({}, None)) for q in ("a", "bad", "c")]
+    assert futures[0].result(timeout=5)[1][0]["id"] == "a" and futures[2].result(timeout=5)[1][0]["id"] == "c"
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+    assert calls == [3, 1, 1, 1]
+
+def test_search_api_endpoints(monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("httpx")
+    testclient = pytest.importorskip("fastapi.testclient")
+    api = must_import("api")
+    np = must_import("numpy")
+    engine = api.search_engine
+    monkeypatch.setattr(engine, "data_load", lambda: None)
+    monkeypatch.setattr(engine, "catalog_frame", lambda: [{"id": "1"}, {"id": "2"}])
+    monkeypatch.setattr(engine, "catalog_stats", lambda: {})
+    monkeypatch.setattr(engine, "product_by_id", lambda pid: {"id": pid} if pid == "1" else None)
+    monkeypatch.setattr(engine, "search_batch_and_find_primary",
+                        lambda intents, nprobe=None, ef_search=None: [{"id": i["normalized_query"], "year": np.int64(2012)} for i in intents])
+    monkeypatch.setattr(api.query_intent, "parse_intent", lambda q, stats: ({"filters": {}, "normalized_query": q}, None))
+    monkeypatch.setattr(api.query_intent, "parse_intent_batch", lambda qs, stats: ([{"normalized_query": q} for q in qs], None))
+    monkeypatch.setattr(api.llm_gateway, "get_gateway", lambda: type("Gateway", (), {"warmup": lambda self: None})())
+    monkeypatch.setattr(api.settings, "SEARCH_MICROBATCH", False)
+    monkeypatch.setattr(engine, "search_primary_and_recommendations",
+                        lambda q, n=5, parsed_intent=None, nprobe=None, ef_search=None: ({"id": q}, [{"id": "r"}] * n))
+    monkeypatch.setattr(api, "iter_cached_stylist_outfit", lambda anchor, df, stats: iter([{"id": "look"}]))
+
+    with testclient.TestClient(api.app) as client:
+        assert client.get("/health").json()["products"] == 2
+        body = client.post("/search", json={"query": "red shirt", "num_recommendations": 2}).json()
+        assert body["primary"] == {"id": "red shirt"} and len(body["recommendations"]) == 2
+        # numpy scalars from catalog rows serialise as plain JSON numbers
+        assert client.post("/search/batch", json={"queries": ["a", "b"]}).json()["results"] == [
+            {"id": "a", "year": 2012}, {"id": "b", "year": 2012}]
+        assert client.get("/stylist/1").json()["items"] == [{"id": "look"}]
+        # a NaN left in a row fails loudly instead of producing invalid JSON
+        assert api.CatalogJSONResponse({"usage": None}).body == b'{"usage": null}'
+        with pytest.raises(ValueError):
+            api.CatalogJSONResponse({"usage": float("nan")})
+        assert client.get("/stylist/404").status_code == 404
+
+def test_id_map_is_plain_and_mmappable(tmp_path):
+    np = must_import("numpy")
+    id_map = must_import("train_model.id_map")
+    assert id_map.id_array(["15970", "39386"]).dtype == np.int64
+    # ids that don't survive int() unchanged keep their text
+    assert id_map.id_array(["007", "8"]).dtype.kind == "U"
+
+    id_map.save_idmap(tmp_path / "ids.npy", ["15970", "39386"])
+    assert not id_map.is_legacy(tmp_path / "ids.npy")
+    assert np.load(tmp_path / "ids.npy", mmap_mode="r").tolist() == [15970, 39386]
+    assert id_map.load_idmap(tmp_path / "ids.npy").tolist() == ["15970", "39386"]
+    # maps from older builds are pickled object arrays and still load
+    np.save(tmp_path / "legacy.npy", np.array(["15970", "39386"], dtype=object))
+    assert id_map.is_legacy(tmp_path / "legacy.npy")
+    assert id_map.load_idmap(tmp_path / "legacy.npy").tolist() == ["15970", "39386"]
+
+def test_index_read_shared(tmp_path):
+    np = must_import("numpy")
+    faiss = must_import("faiss")
+    index_factory = must_import("train_model.index_factory")
+    vecs = np.random.default_rng(0).random((500, 16)).astype("float32")
+    for index_type in ("Flat", "IVF4,Flat"):
+        index = index_factory.create_index(vecs, index_type)
+        faiss.write_index(index, str(tmp_path / "x.index"))
+        shared = index_factory.read_index_shared(tmp_path / "x.index", index_type)
+        assert shared.ntotal == 500
+        if index_type != "Flat":
+            # inverted lists come straight from the file mapping, never from a heap copy
+            assert type(faiss.downcast_InvertedLists(faiss.extract_index_ivf(shared).invlists)).__name__ == "OnDiskInvertedLists"
+            assert index_factory.read_index_shared(tmp_path / "x.index", "Flat").ntotal == 500
+        assert (shared.search(vecs[:5], 3, params=index_factory.search_params(shared))[1]
+                == index.search(vecs[:5], 3, params=index_factory.search_params(index))[1]).all()
+
+def test_quantized_index_with_exact_rerank():
+    np = must_import("numpy")
+    index_factory = must_import("train_model.index_factory")
+    vecs = np.random.default_rng(0).random((2000, 32)).astype("float32")
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    queries = vecs[:20]
+    exact_scores, exact_idx = index_factory.create_index(vecs, "Flat").search(queries, 5)
+
+    flat_mib = index_factory.index_memory_bytes(index_factory.create_index(vecs, "Flat"))
+    for index_type in ("SQfp16", "SQ8", "PQ"):
+        index = index_factory.create_index(vecs, index_type, pq_m=8)
+        assert index_factory.index_memory_bytes(index) < flat_mib
+        _, candidates = index.search(queries, 100)
+        scores, idx = index_factory.rerank(vecs, queries, candidates, 5)
+        # re-scored from the float32 vectors: exact scores, and never a worse top-5 than the codes give
+        assert np.allclose(scores, np.einsum("qkd,qd->qk", vecs[idx], queries), atol=1e-5)
+        recall = lambda found: np.mean([len(np.intersect1d(f, e)) for f, e in zip(found, exact_idx)]) / 5
+        assert recall(idx) >= recall(candidates[:, :5])
+        if index_type != "PQ":
+            assert recall(idx) == 1.0
+
+    # padding (-1) never wins
+    scores, idx = index_factory.rerank(vecs, queries[:1], np.array([[-1, 3, -1]]), 3)
+    assert idx.tolist() == [[3, -1, -1]] and np.isneginf(scores[0, 1:]).all()
+
+def test_filtered_search_on_every_index_type(monkeypatch):
+    np = must_import("numpy")
+    pd = must_import("pandas")
+    index_factory = must_import("train_model.index_factory")
+    search_engine = must_import("train_model.search_engine")
+    catalog_store = must_import("train_model.catalog_store")
+    vecs = np.random.default_rng(0).random((2000, 32)).astype("float32")
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    ids = [str(i) for i in range(len(vecs))]
+    catalog = pd.DataFrame({"id": ids, "gender": ["women" if i % 7 == 0 else "men" for i in range(len(vecs))],
+                            "price": [float(100 + i % 50) for i in range(len(vecs))]})
+    store = catalog_store.CatalogStore(catalog, np.array(ids), ["gender"])
+    monkeypatch.setattr(search_engine, "_store", store)
+    monkeypatch.setattr(search_engine, "_vectors", False)
+    filters = {"gender": "women", "priceMax": 140}
+    allowed = store.select(filters)
+
+    for index_type in index_factory.INDEX_TYPES:
+        monkeypatch.setattr(search_engine, "_index", index_factory.create_index(vecs, index_type, pq_m=8))
+        hits = search_engine.filtered_search(vecs[:1], filters, 5)
+        assert len(hits) == 5, index_type
+        assert all(hit["gender"] == "women" and hit["price"] <= 140 for hit in hits), index_type
+        if index_type == "Flat":
+            exact = allowed[np.argsort(-(vecs[allowed] @ vecs[0]), kind="stable")[:5]]
+            assert [hit["id"] for hit in hits] == [ids[i] for i in exact]
+
+def test_warmup_reports_readiness(monkeypatch):
+    warmup = must_import("train_model.warmup")
+    import threading, time
+    gate = threading.Event()
+
+    def broken():
+        raise RuntimeError("no index")
+    monkeypatch.setattr(warmup, "STAGES", [("fast", lambda: None), ("slow", gate.wait), ("broken", broken)])
+    warmup.start()
+    warmup.start()  # a rerun does not start a second thread
+    for _ in range(100):
+        if warmup.status()["stage"] == "slow": break
+        time.sleep(0.01)
+    assert warmup.status()["state"] == "warming" and warmup.status()["stage"] == "slow"
+
+    gate.set()
+    assert warmup.wait(5)
+    status = warmup.status()
+    assert status["state"] == "failed" and status["errors"] == {"broken": "no index"}
+    assert set(status["timings"]) == {"fast", "slow", "broken"}
+    warmup.mark_search()
+    first = warmup.status()["first_search_s"]
+    warmup.mark_search()
+    assert first is not None and warmup.status()["first_search_s"] == first
+
+def test_text_encoder_torchscript_cache(monkeypatch, tmp_path):
+    torch = pytest.importorskip("torch")
+    search_engine = must_import("train_model.search_engine")
+
+    class TinyClip(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.token_embedding = torch.nn.Embedding(64, 8)
+            self.visual = torch.nn.Linear(512, 512)
+
+        def encode_text(self, tokens):
+            return self.token_embedding(tokens).mean(dim=1)
+
+    monkeypatch.setattr(search_engine, "_tokenizer", lambda texts: torch.tensor([[len(t) % 64, 1, 2, 3] for t in texts]))
+    tower = search_engine._text_tower(TinyClip())
+    search_engine.save_text_encoder(tower, tmp_path / "text.pt")
+    loaded = torch.jit.load(str(tmp_path / "text.pt"))
+    tokens = search_engine._tokenizer(["a", "bb", "red shirt"])
+    assert torch.allclose(loaded(tokens), tower(tokens))
+    assert torch.allclose(loaded(tokens).norm(dim=-1), torch.ones(3))
+    # the image tower is not part of the query encoder
+    assert not any("visual" in name for name, _ in loaded.named_parameters())
+
+LEGACY_ORDERS_CSV = (
+    "order_id,created_at,customer_name,email,address,subtotal,discount_amount,total,items\n"
+    "1,2025-09-07T16:40:13Z,a, Old@Example.com,x,10,0,10,\"[{'id': '1', 'price': 10.0, 'qty': 1}]\"\n"
+    # appended by a newer build: discount_breakdown present although the header lacks it
+    "2,2025-09-08T16:40:13Z,a,old@example.com,\"x\n\",20.0,1.0,\"[{\"\"name\"\": \"\"Loyalty discount\"\", \"\"amount\"\": 1.0}]\",19.0,"
+    "\"[{\"\"id\"\": \"\"2\"\", \"\"price\"\": 10.0, \"\"qty\"\": 2}]\"\n"
+    "3,2025-09-09T16:40:13Z,a,b@example.com,x,0,0,0,[]\n"
+)
+
+def test_order_store_migrates_legacy_csv(tmp_path):
+    order_store = must_import("utils.order_store")
+    legacy = tmp_path / "orders.csv"
+    legacy.write_text(LEGACY_ORDERS_CSV, encoding="utf-8")
+    store = order_store.open_store(str(tmp_path / "orders.sqlite"), legacy_csv=str(legacy))
+    assert len(store) == 2     # the empty order is skipped
+    first, second = store.all_orders()
+    assert first["email"] == "Old@Example.com" and first["items"] == [{"id": "1", "price": 10.0, "qty": 1}]
+    assert second["total"] == 19.0 and second["discount_breakdown"] == [{"name": "Loyalty discount", "amount": 1.0}]
+    assert second["items"][0]["qty"] == 2
+    assert store.migrate_csv(str(legacy)) == (0, 1)   # idempotent
+    store.close()
+
+    # a second process-open neither re-imports nor loses anything; WAL is on
+    store = order_store.open_store(str(tmp_path / "orders.sqlite"), legacy_csv=str(legacy))
+    assert len(store) == 2 and store.has_customer(" OLD@example.com")
+    assert store._reader.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    store.close()
+
+def test_checkout_orders_are_batched_and_indexed(monkeypatch, tmp_path):
+    orders = must_import("utils.orders")
+    from concurrent.futures import ThreadPoolExecutor
+    from config import settings
+    legacy = tmp_path / "orders.csv"
+    legacy.write_text(LEGACY_ORDERS_CSV, encoding="utf-8")
+    monkeypatch.setattr(orders, "ORDERS_FILE", str(legacy))
+    monkeypatch.setattr(orders, "_store", None)
+    monkeypatch.setattr(settings, "ORDER_DB_PATH", str(tmp_path / "orders.sqlite"))
+
+    assert orders.is_returning_customer("OLD@example.com ")
+    assert not orders.is_returning_customer("new@example.com") and not orders.is_returning_customer("")
+    with pytest.raises(ValueError):
+        orders.save_order({"email": "new@example.com", "items": []})
+
+    def checkout(i):
+        return orders.save_order({"email": f"New{i}@Example.com", "items": [{"id": str(i), "price": 5.0, "qty": 1}]})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        saved = list(pool.map(checkout, range(40)))
+    store = orders._order_store()
+    assert len({o["order_id"] for o in saved}) == 40 and len(store) == 42
+    assert store.stats()["orders"] == 40 and store.stats()["batches"] <= 40
+    assert orders.is_returning_customer("new7@example.com")
+    assert store.get(saved[3]["order_id"])["items"] == [{"id": "3", "price": 5.0, "qty": 1}]
+    assert len(orders._load_orders()) == 42
+    with pytest.raises(RuntimeError):
+        orders.save_order(dict(saved[0]))   # duplicate order_id
+    assert len(store) == 42
+    store.close()
+
+def test_iter_orders_and_reports(tmp_path):
+    order_store = must_import("utils.order_store")
+    analytics = must_import("utils.order_analytics")
+    from datetime import date, datetime, timezone
+    store = order_store.OrderStore(str(tmp_path / "orders.sqlite"))
+    loyalty = {"name": "Loyalty discount", "type": "percentage", "value": 0.05, "amount": 1.0}
+    for i in range(7):
+        store.save({"order_id": f"o{i}", "created_at": f"2025-09-0{1 + i % 3}T10:00:0{i}Z", "email": f"c{i % 2}@x.com",
+                    "subtotal": 20.0, "discount_amount": 1.0 if i % 2 else 0.0, "total": 19.0 if i % 2 else 20.0,
+                    "discount_breakdown": [loyalty] if i % 2 else [],
+                    "items": [{"id": "A", "title": "Shirt", "price": 10.0, "qty": 2}] + ([{"id": "B", "price": 5.0, "qty": 1}] if i < 2 else [])})
+
+    streamed = store.iter_orders(chunk_size=2)
+    assert not isinstance(streamed, list)
+    ids = [o["order_id"] for o in streamed]
+    assert sorted(ids) == [f"o{i}" for i in range(7)] and len(ids) == 7
+    assert [o["created_at"][:10] for o in store.iter_orders(chunk_size=2)] == sorted(o["created_at"][:10] for o in store.all_orders())
+    assert [o["order_id"] for o in store.iter_orders(since=date(2025, 9, 2), until="2025-09-03", chunk_size=1)] == ["o1", "o4"]
+    assert {o["order_id"] for o in store.iter_orders(email=" C1@x.com", chunk_size=2)} == {"o1", "o3", "o5"}
+    assert len(list(store.iter_orders(since=datetime(2025, 9, 3, tzinfo=timezone.utc)))) == 2
+
+    revenue = analytics.revenue_by_day(store)
+    assert [r["day"] for r in revenue] == ["2025-09-01", "2025-09-02", "2025-09-03"]
+    assert sum(r["orders"] for r in revenue) == 7 and sum(r["revenue"] for r in revenue) == 4 * 20.0 + 3 * 19.0
+    assert analytics.discount_totals_by_rule(store) == [{"rule": "Loyalty discount", "orders": 3, "amount": 3.0}]
+    skus = analytics.top_skus(store, since="2025-09-01", limit=1)
+    assert skus == [{"product_id": "A", "title": "Shirt", "units": 14, "orders": 7, "revenue": 140.0}]
+    assert analytics.top_skus(store, until="2025-09-02")[1]["product_id"] == "B"
+    store.close()
+
+def test_outbox_retries_with_backoff(tmp_path, monkeypatch):
+    outbox_mod = must_import("utils.outbox")
+    mailer = must_import("utils.mailer")
+    box = outbox_mod.Outbox(str(tmp_path / "outbox.sqlite"))
+    calls = []
+
+    def flaky(payload, state):
+        calls.append(payload["n"])
+        state["tries"] = state.get("tries", 0) + 1
+        if state["tries"] < 3:
+            raise ConnectionError("smtp down")
+
+    def hopeless(payload, state):
+        raise outbox_mod.PermanentError("no credentials")
+
+    assert box.enqueue("flaky", "o1", {"n": 1}) is not None
+    assert box.enqueue("flaky", "o1", {"n": 1}) is None      # same order is queued once
+    box.enqueue("hopeless", "o2", {"n": 2})
+    worker = outbox_mod.OutboxWorker(box, {"flaky": flaky, "hopeless": hopeless}, workers=2,
+                                     max_attempts=5, backoff=0, max_backoff=0, poll=0.01)
+    for _ in range(3):
+        worker.run_once()
+    assert calls == [1, 1, 1] and box.stats() == {"sent": 1, "failed": 1}
+    assert box.jobs("failed")[0]["last_error"] == "no credentials"
+    assert worker.retry_delay(1) <= 1.2 * worker.backoff
+    capped = outbox_mod.OutboxWorker(box, {}, backoff=5, max_backoff=60)
+    assert 4 <= capped.retry_delay(1) <= 6 and 48 <= capped.retry_delay(10) <= 72
+
+    # a job whose worker died is claimed again once its lease is over
+    box.enqueue("flaky", "o3", {"n": 3})
+    assert len(box.claim(10, lease=-1)) == 1 and len(box.claim(10, lease=60)) == 1
+    assert box.claim(10, lease=60) == []
+    assert box.retry_failed() == 1 and box.stats()["pending"] == 2
+
+    # order emails: generated content is kept in state, so an SMTP retry does not regenerate it
+    sent = []
+    def deliver(to, content):
+        sent.append(to)
+        if len(sent) == 1:
+            raise OSError("connection reset")
+    monkeypatch.setattr(mailer, "deliver_order_email", deliver)
+    state = {"content": {"subject": "s", "text": "t", "html": "h"}}
+    with pytest.raises(OSError):
+        mailer.order_email_job({"order": {}, "to": "a@x.com", "returning": False}, state)
+    mailer.order_email_job({"order": {}, "to": "a@x.com", "returning": False}, state)
+    assert sent == ["a@x.com", "a@x.com"]
+    monkeypatch.undo()
+    monkeypatch.setattr(mailer.settings, "SMTP_PASS", None)
+    with pytest.raises(mailer.MailNotConfigured):
+        mailer.deliver_order_email("a@x.com", state["content"])
+    worker.stop(); capped.stop()
+
+    # a batch handler that returns too few results fails the whole batch instead of dropping jobs
+    short = outbox_mod.Outbox(str(tmp_path / "short.sqlite"))
+    for n in range(3):
+        short.enqueue("batch", f"b{n}", {"n": n})
+    batcher = outbox_mod.OutboxWorker(short, {}, {"batch": lambda jobs: [None]}, max_attempts=5, backoff=60, poll=0.01)
+    assert batcher.run_once() == 3
+    assert short.stats() == {"pending": 3}
+    assert all("returned 1 results for 3 jobs" in job["last_error"] for job in short.jobs("pending"))
+    batcher.stop()
+
+def test_smtp_pool_against_local_server(tmp_path, monkeypatch):
+    controller_mod = pytest.importorskip("aiosmtpd.controller")
+    mailer = must_import("utils.mailer")
+    outbox_mod = must_import("utils.outbox")
+
+    class Recorder:
+        def __init__(self):
+            self.received = []
+        async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+            if address.startswith("nobody@"):
+                return "550 no such user"
+            envelope.rcpt_tos.append(address)
+            return "250 OK"
+        async def handle_DATA(self, server, session, envelope):
+            self.received.extend(envelope.rcpt_tos)
+            return "250 Message accepted"
+
+    import socket
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    recorder = Recorder()
+    controller = controller_mod.Controller(recorder, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        pool = mailer.SMTPPool("127.0.0.1", port, size=1, starttls=False, idle_timeout=60, max_messages=4)
+        messages = [("shop@x.com", f"c{i}@x.com", "Subject: hi\r\n\r\nthanks") for i in range(3)]
+        assert pool.send_many(messages) == [None] * 3
+        assert pool.send_many(messages) == [None] * 3   # same session until max_messages
+        assert pool.connections == 2 and len(recorder.received) == 6
+
+        pool._idle[0][0].close()                         # the server dropped the idle session
+        pool.send("shop@x.com", "c9@x.com", "Subject: hi\r\n\r\nthanks")
+        assert pool.connections == 3
+        pool.idle_timeout = 0                            # idle too long: replaced, not reused
+        pool.send("shop@x.com", "c10@x.com", "Subject: hi\r\n\r\nthanks")
+        assert pool.connections == 4
+
+        errors = pool.send_many([("shop@x.com", "nobody@x.com", "Subject: hi\r\n\r\n"), messages[0]])
+        assert isinstance(errors[0], outbox_mod.PermanentError) and errors[1] is None
+        pool.close()
+
+        # order emails from the outbox go out in batches over the pooled sessions
+        monkeypatch.setattr(mailer.settings, "SMTP_HOST", "127.0.0.1")
+        monkeypatch.setattr(mailer.settings, "SMTP_PORT", str(port))
+        monkeypatch.setattr(mailer.settings, "SMTP_USER", "shop@x.com")
+        monkeypatch.setattr(mailer.settings, "SMTP_PASS", "secret")
+        monkeypatch.setattr(mailer, "_pool", mailer.SMTPPool("127.0.0.1", port, size=2, starttls=False))
+        box = outbox_mod.Outbox(str(tmp_path / "outbox.sqlite"))
+        content = {"subject": "Order confirmation", "text": "thanks", "html": "<p>thanks</p>"}
+        for i in range(10):
+            box.enqueue("order_email", f"o{i}", {"order": {}, "to": "nobody@x.com" if i == 3 else f"buyer{i}@x.com", "returning": False})
+        worker = outbox_mod.OutboxWorker(box, {}, {"order_email": mailer.order_email_batch}, workers=2, batch_size=5, poll=0.01)
+        monkeypatch.setattr(mailer, "_ensure_content", lambda payload, state: state.setdefault("content", content))
+        assert worker.run_once() == 10
+        assert box.stats() == {"sent": 9, "failed": 1}
+        assert mailer._pool.connections == 2 and mailer._pool.messages == 9
+        worker.stop()
+        mailer._pool.close()
+    finally:
+        controller.stop()
+
+def test_smtp_pool_reports_every_message_after_tls_error():
+    import ssl
+    mailer = must_import("utils.mailer")
+    delivered, sessions = [], []
+
+    class FlakySession:
+        def sendmail(self, sender, to, message):
+            if to == "c2@x.com" and len(sessions) == 1:
+                raise ssl.SSLEOFError("EOF occurred in violation of protocol")
+            delivered.append(to)
+        def quit(self): raise ssl.SSLError("session is broken")
+        def close(self): pass
+
+    def connect():
+        if len(sessions) >= limit[0]:
+            raise ConnectionRefusedError("server down")
+        sessions.append(FlakySession())
+        return sessions[-1]
+
+    limit = [2]
+    pool = mailer.SMTPPool("127.0.0.1", 25, size=1, starttls=False)
+    pool._connect = connect
+    messages = [("shop@x.com", f"c{i}@x.com", "Subject: hi\r\n\r\nthanks") for i in range(5)]
+    errors = pool.send_many(messages)
+    # what was delivered before the TLS error is still reported; the rest go over a fresh session
+    assert errors[:2] == [None, None] and isinstance(errors[2], ssl.SSLEOFError) and errors[3:] == [None, None]
+    assert delivered == ["c0@x.com", "c1@x.com", "c3@x.com", "c4@x.com"] and len(sessions) == 2
+
+    # no fresh session to be had: the remaining messages fail, the delivered ones stay reported
+    pool.close()
+    delivered.clear(); sessions.clear(); limit[0] = 1
+    errors = pool.send_many(messages)
+    assert errors[:2] == [None, None] and isinstance(errors[2], ssl.SSLEOFError)
+    assert len(errors) == 5 and all(isinstance(e, ConnectionRefusedError) for e in errors[3:])
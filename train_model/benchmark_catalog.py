@@ -0,0 +1,113 @@
+"""
+Per-query cost of filtering FAISS candidates: the previous pandas path
+(DataFrame merge + apply_filters + row dicts) against CatalogStore masks.
+Also times the stylist's best-match batch step for growing batch sizes: one
+mask per query against a single 2-D CatalogStore.mask_batch.
+Uses random top-100 candidate lists, so neither the model nor the index is loaded.
+
+    python train_model/benchmark_catalog.py --queries 500
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from train_model.search_engine import FILTER_COLUMNS, IDX_FILE, load_catalog_frame, apply_filters, build_product_dict
+from train_model.catalog_store import CatalogStore
+from train_model.id_map import load_idmap
+
+
+def sample_filters(catalog: pd.DataFrame, n: int, rng) -> list:
+    """Realistic filter dicts: attributes of random catalog rows, some with a price cap."""
+    rows = catalog.sample(n=n, replace=True, random_state=int(rng.integers(1 << 31)))
+    filters = []
+    for _, row in rows.iterrows():
+        f = {"gender": row["gender"], "articleType": row["articleType"]}
+        if rng.random() < 0.5: f["baseColour"] = row["baseColour"]
+        if rng.random() < 0.5: f["priceMax"] = int(row["price"] * 1.5)
+        filters.append(f)
+    return filters
+
+def pandas_path(catalog, idmap, positions, scores, filters, k):
+    hits = pd.DataFrame({"id": idmap[positions], "_score": scores})
+    hits = hits.merge(catalog, on="id", how="inner")
+    hits = hits.sort_values("_score", ascending=False).drop_duplicates("id")
+    hits = hits.assign(similarity=(hits["_score"] * 100.0).round(2))
+    strict = apply_filters(hits, filters)
+    return [build_product_dict(r, "", filters, "") for _, r in strict.head(k).iterrows()]
+
+def store_path(store, positions, scores, filters, k):
+    keep = store.mask(filters, positions)
+    out = []
+    for pos, score in zip(positions[keep][:k], scores[keep][:k]):
+        row = store.record(pos)
+        row["similarity"] = round(float(score) * 100.0, 2)
+        out.append(build_product_dict(row, "", filters, ""))
+    return out
+
+def best_per_query(store, idx, filters_list):
+    best = []
+    for row, f in zip(idx, filters_list):
+        keep = store.mask(f, row)
+        best.append(int(np.argmax(keep)) if keep.any() else 0)
+    return best
+
+def best_batched(store, idx, filters_list):
+    keep = store.mask_batch(filters_list, idx)
+    return np.where(keep.any(axis=1), keep.argmax(axis=1), 0).tolist()
+
+def run_batch_benchmark(store, catalog, rng, sizes=(1, 8, 32, 128), candidates=100, repeats=20):
+    print(f"best match per query, {candidates} candidates each:")
+    for n in sizes:
+        idx = np.stack([rng.choice(store.size, size=min(candidates, store.size), replace=False) for _ in range(n)])
+        filters_list = sample_filters(catalog, n, rng)
+        assert best_per_query(store, idx, filters_list) == best_batched(store, idx, filters_list)
+        row = []
+        for fn in (best_per_query, best_batched):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fn(store, idx, filters_list)
+            row.append((time.perf_counter() - start) * 1e3 / repeats)
+        print(f"  batch {n:>4}: per-query {row[0]:8.2f} ms   2-D mask {row[1]:8.2f} ms")
+
+def run_benchmark(n_queries: int = 500, candidates: int = 100, k: int = 6, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    catalog = load_catalog_frame()
+    idmap = load_idmap(IDX_FILE)
+
+    start = time.perf_counter()
+    store = CatalogStore(catalog, idmap, FILTER_COLUMNS)
+    build_ms = (time.perf_counter() - start) * 1000.0
+
+    queries = []
+    for f in sample_filters(catalog, n_queries, rng):
+        positions = rng.choice(len(idmap), size=min(candidates, len(idmap)), replace=False)
+        scores = np.sort(rng.random(len(positions)).astype("float32"))[::-1]
+        queries.append((positions, scores, f))
+
+    timings = {}
+    for name, fn in (("pandas", lambda p, s, f: pandas_path(catalog, idmap, p, s, f, k)),
+                     ("catalog_store", lambda p, s, f: store_path(store, p, s, f, k))):
+        start = time.perf_counter()
+        for positions, scores, f in queries:
+            fn(positions, scores, f)
+        timings[name] = (time.perf_counter() - start) * 1e6 / len(queries)
+
+    print(f"CatalogStore built in {build_ms:.1f} ms for {len(idmap)} products")
+    print(f"{n_queries} queries, {candidates} candidates, top-{k} materialised")
+    for name, us in timings.items():
+        print(f"  {name:<14}{us:>10.1f} us/query")
+    print(f"  speedup       {timings['pandas'] / timings['catalog_store']:>10.1f}x")
+    run_batch_benchmark(store, catalog, rng, candidates=candidates)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--candidates", type=int, default=100)
+    parser.add_argument("--k", type=int, default=6)
+    args = parser.parse_args()
+    run_benchmark(args.queries, args.candidates, args.k)
@@ -0,0 +1,111 @@
+"""
+Recall@k vs latency (and index memory) report for the ANN index types in index_factory,
+measured against the exact IndexFlatIP over the stored CLIP image vectors. With --rerank N,
+quantized types are also measured with their top N candidates re-scored exactly from the
+float32 vectors, as search_engine does with Config.RERANK_K.
+
+    python train_model/benchmark_index.py --k 10 --queries 200 --rerank 100
+"""
+from pathlib import Path
+import argparse
+import time
+import numpy as np
+import faiss
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from train_model.index_factory import INDEX_TYPES, create_index, search_params, index_memory_bytes, rerank
+
+EMB_FILE = Path("embeddings")/"clip_image_vectors.npy"
+
+NPROBE_SWEEP = [1, 4, 16, 64]
+EF_SEARCH_SWEEP = [16, 32, 64, 128]
+
+
+def recall_at_k(approx: np.ndarray, exact: np.ndarray) -> float:
+    """Mean fraction of the exact top-k that the approximate search also returned."""
+    k = exact.shape[1]
+    hits = [len(np.intersect1d(a[a >= 0], e)) for a, e in zip(approx, exact)]
+    return float(np.mean(hits)) / k
+
+def timed_search(index, queries: np.ndarray, k: int, params=None, vectors=None, rerank_k: int = 0):
+    """
+    One query per call, as in the app. Returns (labels, mean ms/query, p95 ms/query).
+    With vectors and rerank_k, the top rerank_k candidates are re-scored exactly from vectors.
+    """
+    labels, times = [], []
+    for q in queries:
+        start = time.perf_counter()
+        if rerank_k:
+            _, idx = index.search(q[None, :], max(k, rerank_k), params=params)
+            _, idx = rerank(vectors, q[None, :], idx, k)
+        else:
+            _, idx = index.search(q[None, :], k, params=params)
+        times.append((time.perf_counter() - start) * 1000.0)
+        labels.append(idx[0])
+    return np.stack(labels), float(np.mean(times)), float(np.percentile(times, 95))
+
+def _sweep(index):
+    """Runtime knob values worth reporting for this index type."""
+    params = search_params(index)
+    if isinstance(params, faiss.SearchParametersIVF):
+        return [(f"nprobe={v}", search_params(index, nprobe=v)) for v in NPROBE_SWEEP]
+    if isinstance(params, faiss.SearchParametersHNSW):
+        return [(f"efSearch={v}", search_params(index, ef_search=v)) for v in EF_SEARCH_SWEEP]
+    return [("-", None)]
+
+def _is_quantized(index) -> bool:
+    """True when the index keeps lossy codes instead of the float32 vectors."""
+    return index_memory_bytes(index) < index.ntotal * index.d * 4
+
+def run_benchmark(vectors: np.ndarray, index_types, k: int = 10, n_queries: int = 200, seed: int = 0, rerank_k: int = 0):
+    """
+    Hold out n_queries vectors as queries, index the rest with every index type
+    and compare against exact search. Returns a list of result rows.
+    """
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    queries = np.ascontiguousarray(vectors[order[:n_queries]])
+    base = np.ascontiguousarray(vectors[order[n_queries:]])
+
+    exact = create_index(base, "Flat")
+    truth, flat_ms, flat_p95 = timed_search(exact, queries, k)
+    rows = [{"index": "Flat", "params": "-", "recall": 1.0, "ms": flat_ms, "p95": flat_p95, "build_s": 0.0,
+             "mib": index_memory_bytes(exact) / 2**20}]
+
+    for index_type in index_types:
+        if index_type == "Flat":
+            continue
+        start = time.perf_counter()
+        index = create_index(base, index_type)
+        build_s = time.perf_counter() - start
+        mib = index_memory_bytes(index) / 2**20
+        for label, params in _sweep(index):
+            approx, ms, p95 = timed_search(index, queries, k, params)
+            rows.append({"index": index_type, "params": label, "recall": recall_at_k(approx, truth), "ms": ms, "p95": p95, "build_s": build_s, "mib": mib})
+            if rerank_k and _is_quantized(index):
+                # the float32 vectors are read from a memory map, not held next to the index
+                approx, ms, p95 = timed_search(index, queries, k, params, base, rerank_k)
+                rows.append({"index": index_type, "params": f"{label} +rr{rerank_k}", "recall": recall_at_k(approx, truth), "ms": ms, "p95": p95, "build_s": build_s, "mib": mib})
+    return rows
+
+def print_report(rows, k: int, n_base: int):
+    print(f"\nrecall@{k} vs latency over {n_base} vectors (1 query per search call)")
+    print(f"{'index':<22}{'params':<22}{'recall':>8}{'mean ms':>10}{'p95 ms':>10}{'build s':>10}{'MiB':>9}{'vs Flat':>9}")
+    flat_mib = rows[0]["mib"]
+    for r in rows:
+        print(f"{r['index']:<22}{r['params']:<22}{r['recall']:>8.3f}{r['ms']:>10.3f}{r['p95']:>10.3f}{r['build_s']:>10.1f}"
+              f"{r['mib']:>9.1f}{r['mib'] / flat_mib:>8.0%} ")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--types", nargs="+", default=INDEX_TYPES, help="index types or faiss factory strings")
+    parser.add_argument("--rerank", type=int, default=0, help="also report quantized types with this many candidates re-ranked exactly")
+    args = parser.parse_args()
+
+    vectors = np.load(EMB_FILE).astype("float32")
+    rows = run_benchmark(vectors, args.types, k=args.k, n_queries=args.queries, rerank_k=args.rerank)
+    print_report(rows, args.k, len(vectors) - args.queries)
@@ -0,0 +1,77 @@
+"""
+Per-worker memory of the search artifacts with N serving processes: the FAISS index, id map
+and CLIP image vectors read onto each worker's heap (the old data_load) vs. memory-mapped.
+
+    python train_model/benchmark_memory.py --workers 4
+
+Every worker loads the artifacts, searches so the pages are really touched, and reports its
+memory while all workers are alive. With mmap the vectors live in the page cache once, so
+"anon" stays flat and the summed PSS stays near one copy however many workers run.
+"""
+from pathlib import Path
+import argparse
+import multiprocessing as mp
+import numpy as np
+import faiss
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from train_model.index_factory import read_index_shared
+from train_model.id_map import load_idmap
+from utils.memory import process_memory
+
+EMB_FILE = Path("embeddings")/"clip_image_vectors.npy"
+IDX_FILE = Path("embeddings")/"ids.npy"
+FAISS_FILE = Path("indexes")/"faiss_clip.index"
+
+
+def _worker(mmap: bool, n_queries: int, barrier, results) -> None:
+    before = process_memory()
+    if mmap:
+        index = read_index_shared(FAISS_FILE)
+        vectors = np.load(str(EMB_FILE), mmap_mode="r")
+    else:
+        index = faiss.read_index(str(FAISS_FILE))
+        vectors = np.load(str(EMB_FILE))
+    idmap = load_idmap(IDX_FILE)
+
+    rng = np.random.default_rng(os.getpid())
+    queries = np.ascontiguousarray(vectors[rng.choice(len(vectors), n_queries)], dtype="float32")
+    index.search(queries, 10)
+    # an exact re-rank reads the stored vectors; touch all of them
+    (np.asarray(vectors, dtype="float32") @ queries[0]).argmax()
+
+    barrier.wait()  # measure while every worker holds its mappings
+    results.put((before, process_memory(), len(idmap)))
+    barrier.wait()
+
+def measure(mmap: bool, workers: int, n_queries: int = 32):
+    ctx = mp.get_context("spawn")  # fork would share the parent's pages and hide the heap copies
+    barrier, results = ctx.Barrier(workers), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(mmap, n_queries, barrier, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return rows
+
+def run_benchmark(workers: int = 4):
+    for path in (FAISS_FILE, EMB_FILE, IDX_FILE):
+        if not path.exists():
+            raise RuntimeError(f"{path} not found; run train_model/build_index.py first.")
+    print(f"{workers} workers, index {FAISS_FILE.stat().st_size / 2**20:.1f} MiB, vectors {EMB_FILE.stat().st_size / 2**20:.1f} MiB")
+    print(f"  {'mode':<6}{'rss before':>12}{'rss after':>12}{'anon':>10}{'file':>10}{'pss':>10}{'pss total':>12}   (MiB, mean per worker)")
+    for name, mmap in (("heap", False), ("mmap", True)):
+        rows = measure(mmap, workers)
+        mean = lambda key, which=1: np.mean([row[which].get(key, np.nan) for row in rows])
+        total_pss = sum(row[1].get("pss", np.nan) for row in rows)
+        print(f"  {name:<6}{mean('rss', 0):>12.1f}{mean('rss'):>12.1f}{mean('anon'):>10.1f}{mean('file'):>10.1f}"
+              f"{mean('pss'):>10.1f}{total_pss:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    run_benchmark(args.workers)
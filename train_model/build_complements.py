@@ -0,0 +1,127 @@
+"""
+Offline "complete the look" graph for the AI stylist.
+
+For every product in the FAISS id map, ranks the catalog items that complement it:
+categories from COMPLEMENTARY_MAP, a compatible gender, CLIP image similarity as the
+style signal plus bonuses for the same usage and season, one item per articleType.
+The result is an (n, k) int32 matrix of FAISS positions in embeddings/complements.npy.
+
+    python train_model/build_complements.py --k 12
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+import numpy as np
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+from train_model.build_index import _atomic_write, _npy_writer, _json_writer
+from train_model.catalog_store import CatalogStore
+from train_model.id_map import load_idmap
+from train_model.complements import COMPLEMENTARY_MAP, anchor_category, ids_fingerprint
+from train_model.search_engine import FILTER_COLUMNS, IDX_FILE, EMB_DIR, COMPLEMENTS_FILE, COMPLEMENTS_META_FILE, load_catalog_frame
+
+EMB_FILE = EMB_DIR / "clip_image_vectors.npy"
+USAGE_BONUS = 0.10
+SEASON_BONUS = 0.05
+# seasons that dress alike get half the bonus
+SEASON_GROUPS = {"summer": "warm", "spring": "warm", "fall": "cold", "winter": "cold"}
+
+
+def _codes(store: CatalogStore, col: str) -> np.ndarray:
+    return store.codes[col] if col in store.codes else np.full(store.size, -1, dtype="int32")
+
+def _candidate_mask(store: CatalogStore, gender: str, key: str) -> np.ndarray:
+    """Products that may complete the look of an anchor with this gender and COMPLEMENTARY_MAP key."""
+    targets = COMPLEMENTARY_MAP.get(key, list(COMPLEMENTARY_MAP))
+    master = np.array([str(v) for v in store.vocab["masterCategory"]], dtype=object)
+    sub = np.array([str(v) for v in store.vocab["subCategory"]], dtype=object)
+    in_target = (np.isin(master, targets)[store.codes["masterCategory"]]
+                 | np.isin(sub, targets)[store.codes["subCategory"]])
+    genders = np.array([str(v) for v in store.vocab["gender"]], dtype=object)
+    allowed = genders if gender in ("unisex", "") else np.array([gender, "unisex"], dtype=object)
+    gender_ok = np.isin(genders, allowed)[store.codes["gender"]]
+    return store.valid & in_target & gender_ok
+
+def _diverse(ranked: np.ndarray, article: np.ndarray, sub: np.ndarray, k: int) -> np.ndarray:
+    """
+    Up to k positions from a best-first list, one per articleType; items from a subCategory
+    not used yet come first, so the top of the list covers as many parts of an outfit as possible.
+    """
+    first, rest, types, subs = [], [], set(), set()
+    for pos in ranked:
+        if article[pos] in types:
+            continue
+        types.add(article[pos])
+        (rest if sub[pos] in subs else first).append(pos)
+        subs.add(sub[pos])
+    picked = (first + rest)[:k]
+    return np.pad(np.asarray(picked, dtype="int32"), (0, k - len(picked)), constant_values=-1)
+
+def build_complements(k: int = None, chunk_size: int = 256, pool_factor: int = 8) -> np.ndarray:
+    k = k or settings.COMPLEMENTS_K
+    start = time.perf_counter()
+    idmap = load_idmap(IDX_FILE)
+    vectors = np.load(str(EMB_FILE), mmap_mode="r")
+    if len(vectors) != len(idmap):
+        raise RuntimeError(f"{EMB_FILE} has {len(vectors)} rows for {len(idmap)} ids; rebuild the index first.")
+
+    store = CatalogStore(load_catalog_frame(), idmap, FILTER_COLUMNS + ["season", "usage"])
+    article = store.codes["articleType"]
+    sub = store.codes["subCategory"]
+    usage = _codes(store, "usage")
+    season = _codes(store, "season")
+    group_ids: Dict[str, int] = {}
+    season_vocab = store.vocab.get("season", np.empty(0, dtype=object))
+    # code -1 (unknown season) indexes the trailing -1, i.e. no group
+    season_group = np.array([group_ids.setdefault(SEASON_GROUPS.get(str(v).lower(), str(v).lower()), len(group_ids))
+                             for v in season_vocab] + [-1], dtype="int32")[season]
+
+    # anchors sharing gender and map key share one candidate pool
+    groups: Dict[tuple, List[int]] = {}
+    for pos in store.valid_positions:
+        gender = str(store.value("gender", pos) or "")
+        key = anchor_category(store.value("masterCategory", pos), store.value("subCategory", pos))
+        groups.setdefault((gender, key), []).append(int(pos))
+
+    complements = np.full((store.size, k), -1, dtype="int32")
+    for (gender, key), anchors in groups.items():
+        pool = np.flatnonzero(_candidate_mask(store, gender, key))
+        if not len(pool):
+            continue
+        pool_vecs = np.ascontiguousarray(vectors[pool], dtype="float32")
+        top = min(len(pool), k * pool_factor)
+        for i in range(0, len(anchors), chunk_size):
+            batch = np.asarray(anchors[i:i + chunk_size])
+            scores = np.asarray(vectors[batch], dtype="float32") @ pool_vecs.T
+            scores += USAGE_BONUS * ((usage[batch][:, None] == usage[pool][None, :]) & (usage[pool] >= 0))
+            scores += SEASON_BONUS * 0.5 * ((season_group[batch][:, None] == season_group[pool][None, :]) & (season_group[pool] >= 0))
+            scores += SEASON_BONUS * 0.5 * ((season[batch][:, None] == season[pool][None, :]) & (season[pool] >= 0))
+            # never the anchor's own kind of product
+            scores[sub[batch][:, None] == sub[pool][None, :]] = -np.inf
+            best = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+            for row, anchor in enumerate(batch):
+                order = [j for j in best[row][np.argsort(-scores[row, best[row]], kind="stable")] if np.isfinite(scores[row, j])]
+                complements[anchor, :k] = _diverse(pool[order], article, sub, k)
+
+    meta = {
+        "k": k,
+        "size": int(store.size),
+        "ids_sha1": ids_fingerprint(idmap),
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    _atomic_write(COMPLEMENTS_FILE, _npy_writer(complements))
+    _atomic_write(COMPLEMENTS_META_FILE, _json_writer(meta))
+    filled = int((complements[:, 0] >= 0).sum())
+    print(f"Complement graph: {filled}/{store.size} products, k={k}, "
+          f"{complements.nbytes / 1024:.0f} KiB, built in {time.perf_counter() - start:.1f}s -> {COMPLEMENTS_FILE}")
+    return complements
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=None, help="complements stored per product (default Config.COMPLEMENTS_K)")
+    args = parser.parse_args()
+    build_complements(args.k)
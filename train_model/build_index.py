@@ -1,8 +1,18 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import time
 import numpy as np
-import pandas as pd 
+import pandas as pd
 import faiss, torch, open_clip
 from PIL import Image
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+from train_model.index_factory import create_index
+from train_model.id_map import id_array, load_idmap
 
 DATA_DIR = Path("data")
 IMG_DIR = DATA_DIR/ "images"
@@ -14,12 +24,63 @@ IDX_DIR = Path("indexes"); IDX_DIR.mkdir(parents=True,exist_ok=True)
 EMB_FILE = EMB_DIR/"clip_image_vectors.npy"
 IDX_FILE = EMB_DIR/"ids.npy"
 FAISS_FILE = IDX_DIR/ "faiss_clip.index"
+MANIFEST_FILE = EMB_DIR/"manifest.json"
 
 MODEL_NAME = "ViT-B-32"
 PRETRAINED = "openai"
 DEVICE = "cpu"
 
-def build_index():
+def _load_image(item, preprocess):
+    """Decode and preprocess one catalog image. Runs inside the worker pool."""
+    pid, img_path = item
+    try:
+        with Image.open(img_path) as im:
+            return pid, preprocess(im.convert("RGB"))
+    except Exception as e:
+        print(f"[WARN] Skipping {img_path.name}: {e}")
+        return pid, None
+
+def _iter_batches(items, preprocess, batch_size, num_workers):
+    """
+    Yield (ids, image_tensor) batches in catalog order.
+    The next batch is decoded by the pool while the current one is being encoded.
+    """
+    chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    if not chunks:
+        return
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = [pool.submit(_load_image, item, preprocess) for item in chunks[0]]
+        for n in range(len(chunks)):
+            loaded = [f.result() for f in pending]
+            pending = [pool.submit(_load_image, item, preprocess) for item in chunks[n + 1]] if n + 1 < len(chunks) else []
+            loaded = [(pid, im_t) for pid, im_t in loaded if im_t is not None]
+            if loaded:
+                yield [pid for pid, _ in loaded], torch.stack([im_t for _, im_t in loaded])
+
+def encode_images(items, model, preprocess, batch_size=None, num_workers=None):
+    """
+    Encode (pid, path) pairs with the CLIP image tower in batches.
+    Returns (ids, feats) where feats is an L2-normalised float32 matrix.
+    """
+    batch_size = batch_size or settings.BUILD_BATCH_SIZE
+    num_workers = num_workers or settings.BUILD_NUM_WORKERS
+
+    ids, feats = [], []
+    start = time.perf_counter()
+    for batch_ids, batch in _iter_batches(items, preprocess, batch_size, num_workers):
+        with torch.no_grad():
+            feat = model.encode_image(batch.to(DEVICE))
+            feat = feat/ feat.norm(dim=-1, keepdim=True)
+        feats.append(feat.cpu().numpy().astype("float32"))
+        ids.extend(batch_ids)
+    elapsed = time.perf_counter() - start
+
+    rate = len(ids) / elapsed if elapsed > 0 else 0.0
+    print(f"[INFO] Encoded {len(ids)} images in {elapsed:.1f}s ({rate:.1f} images/sec, batch_size={batch_size}, workers={num_workers}, torch_threads={torch.get_num_threads()})")
+    return ids, feats
+
+def _catalog_items():
+    """(pid, image path) pairs for every catalog row that has a .jpg on disk."""
     df = pd.read_csv(CSV_Path)
 
     items=[]
@@ -28,33 +89,166 @@ def build_index():
         path = IMG_DIR/ f"{pid}.jpg"
         if path.exists():
             items.append((pid,path))
+    return items
 
+def _load_model(num_threads=None):
+    num_threads = num_threads if num_threads is not None else settings.TORCH_NUM_THREADS
+    if num_threads:
+        torch.set_num_threads(num_threads)
     model, _, preprocess = open_clip.create_model_and_transforms(MODEL_NAME, pretrained = PRETRAINED, device= DEVICE)
     model.eval()
+    return model, preprocess
 
-    ids, feats = [], []
-    for pid, img_path in items:
-        try:
-            with Image.open(img_path).convert("RGB") as im:
-                im_t = preprocess(im).unsqueeze(0).to(DEVICE)
-                with torch.no_grad():
-                    feat = model.encode_image(im_t)
-                    feat = feat/ feat.norm(dim=-1, keepdim=True)
-            feats.append(feat.cpu().numpy().astype("float32"))
-            ids.append(pid)
-        except Exception as e:
-            print(f"[WARN] Skipping {img_path.name}: {e}")
+def _file_signature(path, digest=True):
+    """mtime/size of an image, plus a content hash unless digest is False."""
+    st = os.stat(path)
+    sig = {"mtime": st.st_mtime, "size": st.st_size}
+    if digest:
+        with open(path, "rb") as fh:
+            sig["sha1"] = hashlib.sha1(fh.read()).hexdigest()
+    return sig
+
+def _signatures(items, num_workers=None):
+    with ThreadPoolExecutor(max_workers=num_workers or settings.BUILD_NUM_WORKERS) as pool:
+        return dict(zip([pid for pid, _ in items], pool.map(_file_signature, [path for _, path in items])))
+
+def _atomic_write(path, write):
+    """Write through a temp file in the same directory and swap it in with os.replace."""
+    tmp = Path(path).with_name(Path(path).name + ".tmp")
+    write(str(tmp))
+    os.replace(tmp, path)
+
+def _npy_writer(arr):
+    def _write(tmp):
+        with open(tmp, "wb") as fh:
+            np.save(fh, arr)
+    return _write
+
+def _json_writer(obj):
+    def _write(tmp):
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(obj, fh)
+    return _write
+
+def _build_manifest(ids, items, signatures):
+    """
+    Signature per catalog image. Images that could not be encoded are kept with "failed": True,
+    so an update only retries them once the file changes.
+    """
+    encoded = set(ids)
+    return {pid: signatures[pid] if pid in encoded else {**signatures[pid], "failed": True} for pid, _ in items}
+
+def _save_artifacts(ids, feats, index, manifest):
+    _atomic_write(EMB_FILE, _npy_writer(feats))
+    _atomic_write(IDX_FILE, _npy_writer(id_array(ids)))
+    _atomic_write(FAISS_FILE, lambda tmp: faiss.write_index(index, tmp))
+    # manifest goes last: if anything above fails, the next update re-checks every image
+    _atomic_write(MANIFEST_FILE, _json_writer(manifest))
+
+def build_index(batch_size=None, num_workers=None, num_threads=None, index_type=None):
+    items = _catalog_items()
+    model, preprocess = _load_model(num_threads)
+
+    ids, feats = encode_images(items, model, preprocess, batch_size=batch_size, num_workers=num_workers)
 
     feats = np.concatenate(feats,axis=0).astype("float32")
-    np.save(EMB_FILE,feats)
-    np.save(IDX_FILE, np.array(ids,dtype=object))
+    index = create_index(feats, index_type)
 
-    index = faiss.IndexFlatIP(feats.shape[1])
-    index.add(feats)
-    faiss.write_index(index,str(FAISS_FILE))
+    _save_artifacts(ids, feats, index, _build_manifest(ids, items, _signatures(items, num_workers)))
 
     print(f"[OK] Build index with {len(ids)} .jpg images -> {FAISS_FILE}")
 
+def update_index(batch_size=None, num_workers=None, num_threads=None):
+    """
+    Incrementally bring the index in line with styles.csv.
+    Only new or changed images are encoded; rows of deleted products are dropped.
+    Falls back to a full build when there is no manifest from a previous run.
+    """
+    if not all(Path(p).exists() for p in (EMB_FILE, IDX_FILE, FAISS_FILE, MANIFEST_FILE)):
+        print("[INFO] No previous build manifest found, running a full build.")
+        return build_index(batch_size=batch_size, num_workers=num_workers, num_threads=num_threads)
+
+    start = time.perf_counter()
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as fh:
+        manifest = json.load(fh)
+    ids = load_idmap(IDX_FILE)
+    feats = np.load(EMB_FILE, mmap_mode="r")
+
+    items = _catalog_items()
+    current = dict(items)
+
+    # cheap mtime/size check first; hash only the files that look different
+    changed, touched = [], False
+    for pid, path in items:
+        old = manifest.get(pid)
+        sig = _file_signature(path, digest=False)
+        if old and old.get("mtime") == sig["mtime"] and old.get("size") == sig["size"]:
+            continue
+        sig = _file_signature(path)
+        if old and old.get("sha1") == sig["sha1"]:
+            # same content: keeps its vector, or stays failed until the file changes
+            manifest[pid] = {**sig, "failed": True} if old.get("failed") else sig
+            touched = True
+            continue
+        changed.append(pid)
+
+    changed_set = set(changed)
+    stale = np.array([n for n, pid in enumerate(ids) if pid not in current or pid in changed_set], dtype="int64")
+    removed = [pid for pid in ids if pid not in current]
+    for pid in [pid for pid in manifest if pid not in current]:
+        manifest.pop(pid)
+        touched = True
+
+    new_ids, new_feats = [], np.zeros((0, feats.shape[1]), dtype="float32")
+    if changed:
+        model, preprocess = _load_model(num_threads)
+        new_ids, chunks = encode_images([(pid, current[pid]) for pid in changed], model, preprocess, batch_size=batch_size, num_workers=num_workers)
+        if chunks:
+            new_feats = np.concatenate(chunks, axis=0).astype("float32")
+        for pid in changed_set.difference(new_ids):
+            manifest[pid] = {**_file_signature(current[pid]), "failed": True}
+            touched = True
+
+    if not new_ids and not len(stale):
+        # the index files are left alone, so catalog_version (and the caches keyed on it) stays the same
+        if touched:
+            _atomic_write(MANIFEST_FILE, _json_writer(manifest))
+        print(f"[OK] Index is up to date ({len(ids)} images), checked in {time.perf_counter() - start:.2f}s")
+        return
+
+    index = faiss.read_index(str(FAISS_FILE))
+    keep = np.ones(len(ids), dtype=bool)
+    keep[stale] = False
+    ids = [str(pid) for pid in ids[keep]] + list(new_ids)
+    feats = np.concatenate([feats[keep], new_feats], axis=0)
+
+    if isinstance(index, faiss.IndexFlat):
+        # flat indexes compact on removal, so labels stay equal to row positions
+        if len(stale):
+            index.remove_ids(faiss.IDSelectorBatch(stale))
+        index.add(new_feats)
+    else:
+        # other index types keep their trained state across reset()
+        index.reset()
+        index.add(feats)
+
+    for pid in new_ids:
+        manifest[pid] = _file_signature(current[pid])
+
+    _save_artifacts(ids, feats, index, manifest)
+    print(f"[OK] Updated index: {len(new_ids)} encoded, {len(removed)} removed, {len(ids)} total in {time.perf_counter() - start:.1f}s -> {FAISS_FILE}")
+
 
 if __name__ == "__main__":
-    build_index()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Encode catalog images with CLIP and build the FAISS index.")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads value")
+    parser.add_argument("--incremental", action="store_true", help="only encode new or changed images")
+    parser.add_argument("--index-type", default=None, help="Flat, IVFFlat, HNSW, IVFPQ, OPQ or a faiss factory string (full builds only)")
+    args = parser.parse_args()
+    if args.incremental:
+        update_index(batch_size=args.batch_size, num_workers=args.workers, num_threads=args.threads)
+    else:
+        build_index(batch_size=args.batch_size, num_workers=args.workers, num_threads=args.threads, index_type=args.index_type)
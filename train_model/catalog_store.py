@@ -0,0 +1,164 @@
+from typing import Any, Dict, List, Optional
+import numpy as np
+import pandas as pd
+import faiss
+
+
+def _as_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+class CatalogStore:
+    """
+    Columnar, read-only view of the catalog aligned with FAISS row positions.
+
+    Row i describes the product stored at position i of the FAISS index (_idmap[i]).
+    Filter columns are dictionary-encoded into int32 code arrays, prices live in a
+    float32 array, and every (column, value) pair has a sorted array of positions.
+    Filtering is therefore a few vectorised comparisons / intersections on row
+    positions; dicts are only built for the rows that are actually returned.
+    """
+
+    def __init__(self, catalog: pd.DataFrame, idmap: np.ndarray, columns: List[str]):
+        self.size = len(idmap)
+        self.filter_columns = [col for col in columns if col in catalog]
+        # catalog rows re-ordered to FAISS positions; products missing from the CSV become NaN rows
+        frame = catalog.drop_duplicates("id").set_index("id").reindex(pd.Index(idmap, name="id")).reset_index()
+        self.column_order = list(frame.columns)
+
+        self.ids = frame["id"].to_numpy(dtype=object)
+        self.position = {pid: pos for pos, pid in enumerate(self.ids)}
+        self.price = frame["price"].to_numpy(dtype="float32")
+        self.valid = ~np.isnan(self.price)
+        self.valid_positions = np.flatnonzero(self.valid)
+
+        self.codes: Dict[str, np.ndarray] = {}
+        self.vocab: Dict[str, np.ndarray] = {}
+        self.lookup: Dict[str, Dict[str, int]] = {}
+        self.postings: Dict[str, List[np.ndarray]] = {}
+        for col in self.filter_columns:
+            codes, uniques = pd.factorize(frame[col])
+            self.codes[col] = codes.astype("int32")
+            self.vocab[col] = np.asarray(uniques, dtype=object)
+            self.lookup[col] = {value: code for code, value in enumerate(uniques)}
+            # one stable argsort gives every value's positions, already sorted
+            order = np.argsort(codes, kind="stable")
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            start = int(np.count_nonzero(codes < 0))
+            self.postings[col] = np.split(order[start:].astype("int64"), np.cumsum(counts)[:-1])
+
+        self.price_order = np.argsort(self.price, kind="stable")
+        self.sorted_price = self.price[self.price_order]
+
+        # remaining columns are only needed to materialise result rows
+        self.columns = {col: frame[col].to_numpy(dtype=object) for col in frame.columns if col not in self.codes and col not in ("id", "price")}
+
+    def _code(self, col: str, value: str) -> int:
+        """Dictionary code of a value, -1 when the catalog has no such value."""
+        return self.lookup[col].get(value, -1)
+
+    def _active(self, filters: Dict):
+        """(column -> value, priceMin, priceMax) using the same rules as apply_filters."""
+        price_min = _as_float(filters.get("priceMin")) if filters.get("priceMin") is not None else None
+        price_max = _as_float(filters.get("priceMax")) if filters.get("priceMax") is not None else None
+        active = {col: val for col, val in filters.items() if col in self.codes and val and val != "unisex"}
+        return active, price_min, price_max
+
+    def _price_range(self, price_min: Optional[float], price_max: Optional[float]) -> np.ndarray:
+        lo = 0 if price_min is None else np.searchsorted(self.sorted_price, price_min, side="left")
+        # NaN prices sort last, so an open upper bound still has to stop before them
+        hi = np.searchsorted(self.sorted_price, np.inf if price_max is None else price_max, side="right")
+        return np.sort(self.price_order[lo:hi])
+
+    def select(self, filters: Dict) -> Optional[np.ndarray]:
+        """
+        Sorted positions of every catalog product matching the filters.
+        Returns None when nothing narrows the search (every catalog product qualifies).
+        """
+        active, price_min, price_max = self._active(filters)
+        empty = np.empty(0, dtype="int64")
+        sets = []
+        for col, val in active.items():
+            code = self._code(col, val)
+            sets.append(self.postings[col][code] if code >= 0 else empty)
+        if price_min is not None or price_max is not None:
+            sets.append(self._price_range(price_min, price_max))
+
+        if not sets:
+            return None if len(self.valid_positions) == self.size else self.valid_positions
+        sets.sort(key=len)
+        positions = sets[0]
+        for other in sets[1:]:
+            if not len(positions):
+                break
+            positions = np.intersect1d(positions, other, assume_unique=True)
+        return np.intersect1d(positions, self.valid_positions, assume_unique=True)
+
+    def mask(self, filters: Dict, rows: np.ndarray) -> np.ndarray:
+        """Boolean mask (same shape as rows) of the candidate positions that satisfy the filters."""
+        active, price_min, price_max = self._active(filters)
+        keep = self.valid[rows]
+        for col, val in active.items():
+            keep &= self.codes[col][rows] == self._code(col, val)
+        if price_min is not None:
+            keep &= self.price[rows] >= price_min
+        if price_max is not None:
+            keep &= self.price[rows] <= price_max
+        return keep
+
+    def mask_batch(self, filters_list: List[Dict], rows: np.ndarray) -> np.ndarray:
+        """
+        2-D version of mask for a batch search: row i of `rows` (n_queries, k) holds query i's
+        candidate positions, -1 for padding, and is checked against filters_list[i].
+        """
+        rows = np.asarray(rows)
+        present = rows >= 0
+        safe = np.where(present, rows, 0)
+        keep = present & self.valid[safe]
+        n = len(filters_list)
+        # per-query filter values as vectors: code -2 = no filter on this column, -1 = value not in the catalog
+        wanted = {col: np.full(n, -2, dtype="int32") for col in self.filter_columns}
+        price_min = np.full(n, -np.inf, dtype="float32")
+        price_max = np.full(n, np.inf, dtype="float32")
+        for i, filters in enumerate(filters_list):
+            active, lo, hi = self._active(filters or {})
+            for col, val in active.items():
+                wanted[col][i] = self._code(col, val)
+            if lo is not None: price_min[i] = lo
+            if hi is not None: price_max[i] = hi
+        for col, codes in wanted.items():
+            filtered = codes != -2
+            if filtered.any():
+                keep &= ~filtered[:, None] | (self.codes[col][safe] == codes[:, None])
+        price = self.price[safe]
+        keep &= (price >= price_min[:, None]) & (price <= price_max[:, None])
+        return keep
+
+    def selector(self, positions: np.ndarray):
+        """FAISS IDSelector for a position set: a hashed batch for small sets, a bitmap otherwise."""
+        if len(positions) * 64 < self.size:
+            return faiss.IDSelectorBatch(positions)
+        bits = np.zeros(self.size, dtype=bool)
+        bits[positions] = True
+        bitmap = np.packbits(bits, bitorder="little")
+        sel = faiss.IDSelectorBitmap(self.size, faiss.swig_ptr(bitmap))
+        sel._bitmap = bitmap  # keep the buffer alive as long as the selector
+        return sel
+
+    def value(self, col: str, pos: int) -> Any:
+        if col in self.codes:
+            code = self.codes[col][pos]
+            return self.vocab[col][code] if code >= 0 else None
+        if col == "id":
+            return self.ids[pos]
+        if col == "price":
+            return float(self.price[pos]) if self.valid[pos] else None
+        value = self.columns[col][pos]
+        # empty CSV cells (e.g. a missing usage) are NaN in pandas; records must stay valid JSON
+        return None if isinstance(value, float) and value != value else value
+
+    def record(self, pos: int) -> Dict[str, Any]:
+        """Full catalog row for one position, as a plain dict."""
+        return {col: self.value(col, pos) for col in self.column_order}
@@ -0,0 +1,52 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+# anchor category (subCategory when listed here, else masterCategory) -> categories that complete the look
+COMPLEMENTARY_MAP: Dict[str, List[str]] = {
+    "accessories": ["apparel", "footwear", "bottomwear"], "apparel": ["footwear", "accessories", "bottomwear"],
+    "footwear": ["apparel", "accessories", "bottomwear"], "personal care": ["apparel", "accessories"],
+    "dress": ["footwear", "accessories"], "bottomwear": ["apparel", "footwear", "accessories"]
+}
+
+
+def anchor_category(master_category: str, sub_category: str) -> str:
+    """COMPLEMENTARY_MAP key for a product: its subCategory if the map has one for it, else its masterCategory."""
+    sub_category, master_category = (sub_category or "").lower(), (master_category or "").lower()
+    return sub_category if sub_category in COMPLEMENTARY_MAP else master_category
+
+def ids_fingerprint(ids) -> str:
+    """Hash of the FAISS id map a complement graph was built against."""
+    return hashlib.sha1("\n".join(str(i) for i in ids).encode("utf-8")).hexdigest()
+
+
+class ComplementGraph:
+    """
+    Precomputed "complete the look" lists, built by train_model/build_complements.py.
+
+    Row i of the (n, k) int32 matrix holds the FAISS positions of product i's complements,
+    best first, padded with -1. The file is memory-mapped, so a lookup is one row read.
+    """
+
+    def __init__(self, matrix: np.ndarray, meta: Dict):
+        self.matrix = matrix
+        self.meta = meta
+
+    @classmethod
+    def load(cls, path: Path, meta_path: Path, idmap: np.ndarray) -> Optional["ComplementGraph"]:
+        """The graph at path, or None when it is missing or was built for a different id map."""
+        if not Path(path).exists() or not Path(meta_path).exists():
+            return None
+        with open(meta_path, encoding="utf-8") as fh:
+            meta = json.load(fh)
+        if meta.get("ids_sha1") != ids_fingerprint(idmap):
+            print(f"[WARN] {path} was built for another index; rebuild it with train_model/build_complements.py")
+            return None
+        return cls(np.load(str(path), mmap_mode="r"), meta)
+
+    def positions(self, pos: int, k: Optional[int] = None) -> np.ndarray:
+        row = np.asarray(self.matrix[pos])
+        row = row[row >= 0]
+        return row if k is None else row[:k]
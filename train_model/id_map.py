@@ -0,0 +1,63 @@
+"""
+FAISS position -> product id map (embeddings/ids.npy).
+
+The map is stored as a plain int64 array (fixed-width strings when an id is not a canonical
+integer), so it loads without pickle and can be memory-mapped. Maps written by older builds
+are pickled object arrays; they are still readable and can be converted in place with
+
+    python train_model/id_map.py
+"""
+import os
+from pathlib import Path
+from typing import Sequence
+import numpy as np
+
+
+def id_array(ids: Sequence) -> np.ndarray:
+    """ids as int64 when every one round-trips through int(), else as fixed-width unicode."""
+    ids = [str(i) for i in ids]
+    try:
+        packed = np.array([int(i) for i in ids], dtype="int64")
+    except (ValueError, OverflowError):
+        return np.array(ids, dtype=str)
+    # "007" or " 7" would not come back unchanged
+    if any(str(v) != i for v, i in zip(packed.tolist(), ids)):
+        return np.array(ids, dtype=str)
+    return packed
+
+def is_legacy(path: Path) -> bool:
+    """True for a pickled object-array map from an older build."""
+    try:
+        np.load(str(path), mmap_mode="r")
+    except ValueError:
+        return True
+    return False
+
+def load_idmap(path: Path) -> np.ndarray:
+    """The id map as an array of str ids, the form the catalog store and complement graph use."""
+    try:
+        ids = np.load(str(path), mmap_mode="r")
+    except ValueError:
+        print(f"[WARN] {path} is a pickled object array; convert it with train_model/id_map.py")
+        ids = np.load(str(path), allow_pickle=True)
+    return np.asarray(ids).astype(str)
+
+def save_idmap(path: Path, ids: Sequence) -> None:
+    """Write the map through a temp file, so readers never see a half-written one."""
+    tmp = Path(path).with_name(Path(path).name + ".tmp")
+    with open(tmp, "wb") as fh:
+        np.save(fh, id_array(ids), allow_pickle=False)
+    os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=str(Path(__file__).resolve().parent.parent / "embeddings" / "ids.npy"))
+    args = parser.parse_args()
+    if not is_legacy(Path(args.path)):
+        print(f"[OK] {args.path} is already a plain array")
+    else:
+        ids = load_idmap(Path(args.path))
+        save_idmap(Path(args.path), ids)
+        print(f"[OK] Converted {len(ids)} ids in {args.path} to {id_array(ids).dtype}")
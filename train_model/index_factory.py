@@ -0,0 +1,124 @@
+import math
+from typing import Optional
+import numpy as np
+import faiss
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+
+INDEX_TYPES = ["Flat", "IVFFlat", "HNSW", "IVFPQ", "OPQ", "SQfp16", "SQ8", "PQ"]
+
+# faiss wants roughly this many training points per k-means centroid
+_MIN_POINTS_PER_CENTROID = 39
+
+
+def _nlist_for(n: int, nlist: Optional[int] = None) -> int:
+    """Number of IVF lists: configured value or ~4*sqrt(n), clamped to what n vectors can train."""
+    nlist = nlist or settings.INDEX_NLIST or int(4 * math.sqrt(n))
+    return max(1, min(nlist, n // _MIN_POINTS_PER_CENTROID))
+
+def _pq_spec(d: int, n: int, pq_m: Optional[int] = None) -> str:
+    pq_m = pq_m or settings.INDEX_PQ_M
+    if d % pq_m:
+        raise ValueError(f"PQ sub-quantizers ({pq_m}) must divide the vector dimension ({d}).")
+    # 8-bit codebooks need 256 centroids per sub-quantizer; small catalogs can't train that
+    nbits = 8 if n >= 256 * _MIN_POINTS_PER_CENTROID else 4
+    return f"PQ{pq_m}x{nbits}"
+
+def factory_string(index_type: str, n: int, d: int, nlist: Optional[int] = None, hnsw_m: Optional[int] = None, pq_m: Optional[int] = None) -> str:
+    """
+    Translate an INDEX_TYPE name into a faiss.index_factory string for n vectors of dimension d.
+    A string that already looks like a factory description (contains ',') is passed through.
+    """
+    if "," in index_type:
+        return index_type
+    if index_type == "Flat":
+        return "Flat"
+    # quantized flat storage: float16 / int8 per dimension, or product-quantized codes
+    if index_type in ("SQfp16", "SQ8"):
+        return index_type
+    if index_type == "PQ":
+        return _pq_spec(d, n, pq_m)
+    if index_type == "IVFFlat":
+        return f"IVF{_nlist_for(n, nlist)},Flat"
+    if index_type == "HNSW":
+        return f"HNSW{hnsw_m or settings.INDEX_HNSW_M}"
+    if index_type == "IVFPQ":
+        return f"IVF{_nlist_for(n, nlist)},{_pq_spec(d, n, pq_m)}"
+    if index_type == "OPQ":
+        pq_m = pq_m or settings.INDEX_PQ_M
+        return f"OPQ{pq_m},IVF{_nlist_for(n, nlist)},{_pq_spec(d, n, pq_m)}"
+    raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES} or a faiss factory string.")
+
+def create_index(vectors: np.ndarray, index_type: Optional[str] = None, **kwargs) -> faiss.Index:
+    """Build, train (when the type needs it) and fill an inner-product index over L2-normalised vectors."""
+    index_type = index_type or settings.INDEX_TYPE
+    n, d = vectors.shape
+    spec = factory_string(index_type, n, d, **kwargs)
+    index = faiss.index_factory(d, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    print(f"[INFO] Created '{spec}' index over {n} vectors")
+    return index
+
+def search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None, sel=None):
+    """
+    Per-call faiss SearchParameters for the given index: nprobe for IVF variants,
+    efSearch for HNSW. Returns None when there is nothing to set.
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe or settings.SEARCH_NPROBE, sel=sel)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or settings.SEARCH_EF, sel=sel)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+def accepts_selector(index: faiss.Index) -> bool:
+    """False for index types whose search rejects an IDSelector (IndexPQ); those are filtered after the search."""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else faiss.downcast_index(index)
+    return not isinstance(inner, faiss.IndexPQ)
+
+def _is_ivf(index_type: str) -> bool:
+    """True for INDEX_TYPE names / factory strings whose index stores its codes in IVF inverted lists."""
+    return "IVF" in index_type or index_type == "OPQ"
+
+def read_index_shared(path, index_type: Optional[str] = None) -> faiss.Index:
+    """
+    Read an index with its codes memory-mapped from the file instead of copied onto the heap,
+    so every process serving the same file shares one page-cache copy. IVF inverted lists are
+    mapped with IO_FLAG_MMAP, Flat / SQ / PQ codes with IO_FLAG_MMAP_IFC; the flag is picked
+    from index_type (Config.INDEX_TYPE) up front, as the wrong one means a full heap load.
+    Falls back to a plain read_index when this faiss build has no IO_FLAG_MMAP_IFC. The index is read-only.
+    """
+    index_type = index_type or settings.INDEX_TYPE
+    if _is_ivf(index_type):
+        return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    mmap_ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if mmap_ifc is None:
+        return faiss.read_index(str(path))
+    index = faiss.read_index(str(path), mmap_ifc | faiss.IO_FLAG_READ_ONLY)
+    if faiss.try_extract_index_ivf(index) is not None:
+        # built with another INDEX_TYPE than configured now; the inverted lists were read onto the heap
+        print(f"[WARN] {path} is an IVF index but INDEX_TYPE is '{index_type}'; re-reading it memory-mapped.")
+        index = faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return index
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Size of the serialized index, i.e. what it occupies in RAM or in the page cache."""
+    return int(faiss.serialize_index(index).nbytes)
+
+def rerank(vectors: np.ndarray, queries: np.ndarray, idx: np.ndarray, k: int):
+    """
+    Exact inner-product re-scoring of ANN candidates. vectors is the float32 matrix the index
+    was built from (usually memory-mapped, so only the candidates' rows are read); idx holds
+    the candidate positions per query, -1 for padding. Returns the best k as (scores, idx).
+    """
+    safe = np.where(idx >= 0, idx, 0)
+    exact = np.einsum("qkd,qd->qk", np.asarray(vectors[safe.ravel()], dtype="float32").reshape(*idx.shape, -1), queries)
+    exact[idx < 0] = -np.inf
+    order = np.argsort(-exact, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(exact, order, axis=1), np.take_along_axis(idx, order, axis=1)
@@ -2,12 +2,20 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 import faiss
-import torch
-import open_clip
 from typing import Dict, Tuple, List, Optional
+import copy
 import sys
 import os
-import re
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+from train_model.index_factory import search_params, read_index_shared, rerank, accepts_selector
+from train_model.id_map import load_idmap
+from train_model.catalog_store import CatalogStore
+from train_model.complements import ComplementGraph
+from utils.cache import LRUCache, SQLiteStore
+from genAI.local_intent import parse_intent_locally
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -17,91 +25,264 @@ EMB_DIR = BASE_DIR / "embeddings"
 IDX_DIR = BASE_DIR / "indexes"
 FAISS_FILE = IDX_DIR / "faiss_clip.index"
 IDX_FILE = EMB_DIR / "ids.npy"
+EMB_FILE = EMB_DIR / "clip_image_vectors.npy"
+COMPLEMENTS_FILE = EMB_DIR / "complements.npy"
+COMPLEMENTS_META_FILE = EMB_DIR / "complements.json"
 MODEL_NAME = "ViT-B-32"
 PRETRAINED = "openai"
+# TorchScript text tower, written on the first load from the pretrained checkpoint
+TEXT_ENCODER_FILE = EMB_DIR / f"clip_text_{MODEL_NAME}_{PRETRAINED}.pt"
 DEVICE = "cpu"
 FILTER_COLUMNS = ["baseColour", "masterCategory", "subCategory", "articleType", "gender"]
 
 
-_model, _tokenizer, _index, _idmap, _catalog, _catalog_stats, _filter_patterns = (None,) * 7
+# _model is the CLIP text tower: token ids -> L2-normalised embeddings
+_model, _tokenizer, _index, _idmap, _catalog, _catalog_stats, _store = (None,) * 7
+# loaders run from the warmup thread and from the first requests at the same time
+_load_lock = threading.RLock()
+# ComplementGraph, or False once we know there is no usable one
+_complements = None
+# memory-mapped float32 image vectors for re-ranking, or False when re-ranking is off / impossible
+_vectors = None
+
+# normalized query -> embedding row, shared by encoded_text_cpu and encoded_text_cpu_batch
+_text_cache = LRUCache(settings.EMBED_CACHE_SIZE)
+_text_store = SQLiteStore(settings.EMBED_CACHE_PATH, table="text_embeddings") if settings.EMBED_CACHE_PATH else None
+
+# (catalog version, normalized query, filters, k, ...) -> (primary, recommendations)
+_result_cache = LRUCache(settings.RESULT_CACHE_SIZE, ttl=settings.RESULT_CACHE_TTL)
+_result_cache_version = None
 
 def data_load():
-    """Load all necessary data, models, and pre-compile fallback patterns."""
-    global _model, _tokenizer, _index, _idmap, _catalog, _catalog_stats, _filter_patterns
-    
-    if _model is None:
-        _model, _, _ = open_clip.create_model_and_transforms(MODEL_NAME, pretrained=PRETRAINED, device=DEVICE)
-        _tokenizer = open_clip.get_tokenizer(MODEL_NAME)
-        _model = _model.to(DEVICE).eval()
-    if _index is None:
-        if Path(FAISS_FILE).exists(): _index = faiss.read_index(str(FAISS_FILE))
-        else: raise RuntimeError(f"Faiss index not found at {FAISS_FILE}. Run build_index().")
-    if _idmap is None:
-        if Path(IDX_FILE).exists(): _idmap = np.load(str(IDX_FILE), allow_pickle=True).astype(str)
-        else: raise RuntimeError(f"ID map not found at {IDX_FILE}. Run build_index().")
-    if _catalog is None:
-        if Path(CSV_PATH).exists():
-            df = pd.read_csv(CSV_PATH, on_bad_lines='skip')
-            if "id" not in df: raise ValueError("Catalog CSV must have an 'id' column.")
-            df["id"] = df["id"].astype(str)
-            for col in FILTER_COLUMNS:
-                df[col] = df[col].astype(str).str.lower().str.strip() if col in df else ""
-            df["price"] = pd.to_numeric(df.get("price_inr"), errors='coerce')
-            df.dropna(subset=['price', 'id'], inplace=True)
-            df['price'] = df['price'].astype(float)
-            _catalog = df
+    """Load all necessary data, models and the columnar catalog."""
+    load_text_encoder()
+    load_index()
+    load_catalog()
+
+def _text_tower(model):
+    """The text half of an open_clip model, as a module from token ids to L2-normalised embeddings."""
+    import torch
+
+    class TextTower(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, tokens):
+            feats = self.clip.encode_text(tokens)
+            return feats / feats.norm(dim=-1, keepdim=True)
+
+    model.visual = torch.nn.Identity()  # queries never use the image tower
+    return TextTower(model).to(DEVICE).eval()
+
+def save_text_encoder(tower, path: Path = TEXT_ENCODER_FILE) -> None:
+    """Trace the text tower to TorchScript, check it against the eager module, and write it atomically."""
+    import torch
+    with torch.no_grad():
+        traced = torch.jit.trace(tower, _tokenizer(["a photo of a product"]).to(DEVICE))
+        # a different batch size and text lengths than the trace example
+        probe = _tokenizer(["red cotton t-shirt for men", "shoes", "black leather handbag with a gold chain"]).to(DEVICE)
+        if not torch.allclose(traced(probe), tower(probe), atol=1e-4):
+            raise RuntimeError("traced text encoder does not match the eager model")
+    tmp = Path(path).with_name(Path(path).name + ".tmp")
+    torch.jit.save(traced, str(tmp))
+    os.replace(tmp, path)
+
+def load_text_encoder():
+    """
+    CLIP tokenizer and text tower. The TorchScript copy in TEXT_ENCODER_FILE loads without
+    building the whole model and parsing the pretrained checkpoint; it is written the first
+    time the checkpoint is loaded (Config.TEXT_ENCODER_CACHE).
+    """
+    global _model, _tokenizer
+    if _model is not None:
+        return
+    with _load_lock:
+        if _model is not None:
+            return
+        import torch
+        import open_clip
+        tokenizer = open_clip.get_tokenizer(MODEL_NAME)
+        if settings.TEXT_ENCODER_CACHE and Path(TEXT_ENCODER_FILE).exists():
+            try:
+                _tokenizer, _model = tokenizer, torch.jit.load(str(TEXT_ENCODER_FILE), map_location=DEVICE).eval()
+                return
+            except Exception as e:
+                print(f"[WARN] Could not load {TEXT_ENCODER_FILE} ({e}); loading the pretrained checkpoint.")
+        model, _, _ = open_clip.create_model_and_transforms(MODEL_NAME, pretrained=PRETRAINED, device=DEVICE)
+        tower = _text_tower(model)
+        _tokenizer = tokenizer
+        if settings.TEXT_ENCODER_CACHE:
+            try:
+                save_text_encoder(tower, TEXT_ENCODER_FILE)
+            except Exception as e:
+                print(f"[WARN] Text encoder not cached ({e}).")
+        _model = tower
+
+def load_index():
+    """FAISS index (memory-mapped with Config.INDEX_MMAP) and its position -> id map."""
+    global _index, _idmap
+    if _index is not None and _idmap is not None:
+        return
+    with _load_lock:
+        if _index is None:
+            if Path(FAISS_FILE).exists(): _index = read_index_shared(FAISS_FILE) if settings.INDEX_MMAP else faiss.read_index(str(FAISS_FILE))
+            else: raise RuntimeError(f"Faiss index not found at {FAISS_FILE}. Run build_index().")
+        if _idmap is None:
+            if Path(IDX_FILE).exists(): _idmap = load_idmap(IDX_FILE)
+            else: raise RuntimeError(f"ID map not found at {IDX_FILE}. Run build_index().")
+        _load_vectors()
+
+def load_catalog():
+    """Catalog frame, its filter vocabulary and the columnar store aligned to the index."""
+    global _catalog, _catalog_stats, _store
+    if _store is not None:
+        return
+    load_index()
+    with _load_lock:
+        if _catalog is None:
+            _catalog = load_catalog_frame()
             _catalog_stats = {col: [item for item in _catalog[col].unique() if item] for col in FILTER_COLUMNS if col in _catalog}
-            _filter_patterns = compile_patterns(_catalog_stats)
-        else: raise RuntimeError(f"Catalog CSV not found at {CSV_PATH}.")
-
-def compile_patterns(stats: Dict[str, List[str]]) -> Dict[str, re.Pattern]:
-    """Compile regex patterns from catalog stats for efficient fallback parsing."""
-    patterns = {}
-    for col, values in stats.items():
-        if values:
-            sorted_values = sorted(values, key=len, reverse=True)
-            escaped_values = [re.escape(v) for v in sorted_values if v]
-            if escaped_values:
-                patterns[col] = re.compile(r'\b(' + '|'.join(escaped_values) + r')\b', re.IGNORECASE)
-    return patterns
-
-def extract_filters_fallback(query_text: str, patterns: Dict[str, re.Pattern]) -> Dict:
-    """A regex-based parser to be used when the Gemini API fails."""
-    query = (query_text or "").lower()
-    filters = {k: None for k in FILTER_COLUMNS + ["priceMin", "priceMax"]}
-    if patterns:
-        for k, pattern in patterns.items():
-            if pattern:
-                match = pattern.search(query)
-                if match: filters[k] = match.group(0).lower()
-    price_max_match = re.search(r'\b(?:under|below|less than|max)\s*(\d+)\b', query)
-    if price_max_match: filters['priceMax'] = int(price_max_match.group(1))
-    price_min_match = re.search(r'\b(?:above|over|more than|min)\s*(\d+)\b', query)
-    if price_min_match: filters["priceMin"] = int(price_min_match.group(1))
-    between_match = re.search(r'\bbetween\s*(\d+)\s*(?:and|to)\s*(\d+)\b', query)
-    if between_match:
-        prices = sorted([int(between_match.group(1)), int(between_match.group(2))])
-        filters['priceMin'], filters["priceMax"] = prices[0], prices[1]
-    return {"filters": filters, "normalized_query": query.strip(), "strict": False}
+        if _store is None:
+            _store = CatalogStore(_catalog, _idmap, FILTER_COLUMNS)
 
-def encoded_text_cpu(text: str) -> np.ndarray:
-    if _model is None or _tokenizer is None: data_load()
-    tokens = _tokenizer([text])
+def _load_vectors():
+    global _vectors
+    if _vectors is not None:
+        return
+    _vectors = False
+    if settings.RERANK_K > 0:
+        if not Path(EMB_FILE).exists():
+            print(f"[WARN] RERANK_K is set but {EMB_FILE} is missing; searching without re-ranking.")
+            return
+        vectors = np.load(str(EMB_FILE), mmap_mode="r")
+        if len(vectors) != _index.ntotal:
+            print(f"[WARN] {EMB_FILE} has {len(vectors)} rows for {_index.ntotal} indexed products; searching without re-ranking.")
+            return
+        _vectors = vectors
+
+def catalog_frame() -> pd.DataFrame:
+    """The loaded catalog (see load_catalog_frame)."""
+    data_load()
+    return _catalog
+
+def catalog_stats() -> Dict[str, List[str]]:
+    """Distinct values of the filter columns, the vocabulary intent parsing works with."""
+    data_load()
+    return _catalog_stats
+
+def product_by_id(product_id: str) -> Optional[Dict]:
+    """Product dict (as returned by search) for an indexed catalog id, or None."""
+    data_load()
+    pos = _store.position.get(str(product_id))
+    return None if pos is None else build_product_dict(_store.record(pos), "", {}, "catalog lookup")
+
+def load_catalog_frame() -> pd.DataFrame:
+    """Read styles.csv with string ids, lower-cased filter columns and a float 'price' column."""
+    if not Path(CSV_PATH).exists(): raise RuntimeError(f"Catalog CSV not found at {CSV_PATH}.")
+    df = pd.read_csv(CSV_PATH, on_bad_lines='skip')
+    if "id" not in df: raise ValueError("Catalog CSV must have an 'id' column.")
+    df["id"] = df["id"].astype(str)
+    for col in FILTER_COLUMNS:
+        df[col] = df[col].astype(str).str.lower().str.strip() if col in df else ""
+    df["price"] = pd.to_numeric(df.get("price_inr"), errors='coerce')
+    df.dropna(subset=['price', 'id'], inplace=True)
+    df['price'] = df['price'].astype(float)
+    return df
+
+def reset_data():
+    """Drop the loaded index, id map and catalog so the next data_load() re-reads them (the CLIP model is kept)."""
+    global _index, _idmap, _catalog, _catalog_stats, _store, _complements, _vectors
+    _index, _idmap, _catalog, _catalog_stats, _store, _complements, _vectors = (None,) * 7
+
+def catalog_version() -> Tuple:
+    """Stamp of the on-disk index, id map and catalog CSV; changes whenever any of them is rewritten."""
+    stamp = []
+    for path in (FAISS_FILE, IDX_FILE, CSV_PATH):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def _result_key(filters: Dict, normalized_query: str, num_recommendations: int, nprobe, ef_search) -> Tuple:
+    """Canonical cache key: filter order, empty values and query case/whitespace don't matter."""
+    global _result_cache_version
+    version = catalog_version()
+    if version != _result_cache_version:
+        # entries for the old files can never be hit again
+        _result_cache.clear()
+        _result_cache_version = version
+    canonical = tuple(sorted((k, str(v)) for k, v in filters.items() if v is not None and v != ""))
+    return (version, normalize_query(normalized_query), canonical, num_recommendations, nprobe, ef_search)
+
+def result_cache_stats() -> Dict:
+    return _result_cache.stats()
+
+def _for_query(result: Tuple[Optional[Dict], List[Dict]], query_text: str, filters: Dict) -> Tuple[Optional[Dict], List[Dict]]:
+    """Private copy of a cached result whose rationale points at the caller's raw query and filters."""
+    primary, recos = copy.deepcopy(result)
+    for product in ([primary] if primary else []) + recos:
+        product["rationale"].update(query=query_text, filters=filters)
+    return primary, recos
+
+def normalize_query(text: str) -> str:
+    """Cache key for a query. CLIP's tokenizer lower-cases and collapses whitespace itself, so this doesn't change the embedding."""
+    return " ".join((text or "").lower().split())
+
+def _disk_key(key: str) -> str:
+    # embeddings are only valid for the model that produced them
+    return f"{MODEL_NAME}/{PRETRAINED}:{key}"
+
+def _encode_uncached(texts: List[str]) -> np.ndarray:
+    import torch
+    tokens = _tokenizer(texts).to(DEVICE)
     with torch.no_grad():
-        feats = _model.encode_text(tokens.to(DEVICE))
-        feats = feats / feats.norm(dim=-1, keepdim=True)
+        feats = _model(tokens)
     return feats.cpu().numpy().astype("float32")
 
+def embedding_cache_stats() -> Dict:
+    """Hit/miss counters of the in-memory and (if enabled) on-disk text embedding caches."""
+    stats = {"memory": _text_cache.stats()}
+    if _text_store is not None:
+        stats["disk"] = _text_store.stats()
+    return stats
+
+def encoded_text_cpu(text: str) -> np.ndarray:
+    return encoded_text_cpu_batch([text])
+
 def encoded_text_cpu_batch(texts: List[str]) -> np.ndarray:
-    """Encodes a batch of text strings efficiently."""
-    if _model is None or _tokenizer is None: data_load()
+    """Encodes a batch of text strings efficiently, only running CLIP for queries not seen before."""
     if not texts: return np.array([]).astype("float32")
-        
-    tokens = _tokenizer(texts).to(DEVICE)
-    with torch.no_grad():
-        feats = _model.encode_text(tokens)
-        feats /= feats.norm(dim=-1, keepdim=True)
-    return feats.cpu().numpy().astype("float32")
+
+    keys = [normalize_query(t) for t in texts]
+    vectors = {}
+    missing = []
+    for key in dict.fromkeys(keys):
+        vec = _text_cache.get(key)
+        if vec is None: missing.append(key)
+        else: vectors[key] = vec
+
+    if missing and _text_store is not None:
+        blobs = _text_store.get_many(_disk_key(key) for key in missing)
+        for key in missing:
+            blob = blobs.get(_disk_key(key))
+            if blob is not None:
+                vectors[key] = np.frombuffer(blob, dtype="float32")
+                _text_cache.set(key, vectors[key])
+        missing = [key for key in missing if key not in vectors]
+
+    if missing:
+        load_text_encoder()
+        feats = _encode_uncached(missing)
+        for key, vec in zip(missing, feats):
+            vectors[key] = vec
+            _text_cache.set(key, vec)
+        if _text_store is not None:
+            _text_store.set_many((_disk_key(key), vec.tobytes()) for key, vec in zip(missing, feats))
+
+    return np.stack([vectors[key] for key in keys])
 
 
 def apply_filters(df: pd.DataFrame, filters: Dict) -> pd.DataFrame:
@@ -126,7 +307,7 @@ def apply_filters(df: pd.DataFrame, filters: Dict) -> pd.DataFrame:
             
     return filtered_df[final_mask]
 
-def build_product_dict(row: pd.Series, query: str, filters: Dict, note: str) -> Dict:
+def build_product_dict(row: Dict, query: str, filters: Dict, note: str) -> Dict:
     return {
         "id": str(row["id"]), "name": str(row.get("productDisplayName") or ""),
         "masterCategory": str(row.get("masterCategory") or ""), "subCategory": str(row.get("subCategory") or ""),
@@ -138,74 +319,203 @@ def build_product_dict(row: pd.Series, query: str, filters: Dict, note: str) ->
         "rationale": {"query": query, "filters": filters, "note": note}
     }
 
+def filtered_search(
+    qvec: np.ndarray,
+    filters: Dict,
+    k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    prefetched: Optional[Tuple[np.ndarray, np.ndarray]] = None
+) -> List[Dict]:
+    """
+    True top-k among products matching `filters`, best first. The matching FAISS
+    positions are intersected up front from the catalog store and passed to FAISS as
+    an IDSelector; catalog rows are only materialised for the k returned positions.
+
+    prefetched = (scores, positions) of an unfiltered top-N search for the same vector (as
+    done by search_many). When at least k of those pass the filters they are exactly the
+    filtered top-k, so no further FAISS call is needed.
+    """
+    if prefetched is not None:
+        pre_scores, pre_idx = prefetched
+        keep = _store.mask(filters, np.where(pre_idx >= 0, pre_idx, 0)) & (pre_idx >= 0)
+        if keep.sum() >= k:
+            scores, idx = pre_scores[keep][None, :k], pre_idx[keep][None, :k]
+            return _hits(scores, idx)
+
+    positions = _store.select(filters)
+    if positions is not None and not len(positions):
+        return []
+    k = min(k, _index.ntotal if positions is None else len(positions))
+    if positions is not None and not accepts_selector(_index):
+        return _hits(*_search_then_filter(qvec, filters, k, search_params(_index, nprobe, ef_search)))
+    sel = _store.selector(positions) if positions is not None else None
+    scores, idx = _ann_search(qvec, k, search_params(_index, nprobe, ef_search, sel=sel))
+    return _hits(scores, idx)
+
+def _search_then_filter(qvec: np.ndarray, filters: Dict, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Filtered top-k for indexes without IDSelector support: unfiltered searches over a growing
+    candidate list, checked with the catalog store, until k candidates pass or the whole index was searched.
+    """
+    fetch = min(max(4 * k, settings.RERANK_K or 0), _index.ntotal)
+    while True:
+        scores, idx = _ann_search(qvec, fetch, params)
+        keep = _store.mask(filters, np.where(idx >= 0, idx, 0)) & (idx >= 0)
+        if keep.sum() >= k or fetch >= _index.ntotal:
+            return scores[keep][None, :k], idx[keep][None, :k]
+        fetch = min(4 * fetch, _index.ntotal)
+
+def _ann_search(qvecs: np.ndarray, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    _index.search; with Config.RERANK_K set, the top RERANK_K candidates are re-scored exactly
+    from the float32 vectors, so quantized indexes (SQ8, PQ, ...) rank like the exact one.
+    """
+    if _vectors is False or k <= 0:
+        return _index.search(qvecs, k, params=params)
+    scores, idx = _index.search(qvecs, max(k, settings.RERANK_K), params=params)
+    return rerank(_vectors, qvecs, idx, k)
+
+def _hits(scores: np.ndarray, idx: np.ndarray) -> List[Dict]:
+    hits, seen = [], set()
+    for pos, score in zip(idx[0], scores[0]):
+        if pos < 0: continue
+        row = _store.record(pos)
+        if row["id"] in seen: continue
+        seen.add(row["id"])
+        row["_score"] = float(score)
+        row["similarity"] = round(float(score) * 100.0, 2)
+        hits.append(row)
+    return hits
+
 def search_primary_and_recommendations(
     query_text: str,
     num_recommendations: int = 5,
-    parsed_intent:tuple=None
+    parsed_intent:tuple=None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None
 ) -> Tuple[Optional[Dict], List[Dict]]:
+    """
+    nprobe (IVF indexes) and ef_search (HNSW) trade recall for latency per call;
+    they default to Config.SEARCH_NPROBE / Config.SEARCH_EF and are ignored by Flat indexes.
+    """
     data_load()
-    _top_k_faiss_search = 100
-    
+    filters, normalized_query = _prepare(query_text, parsed_intent)
+
+    key = _result_key(filters, normalized_query, num_recommendations, nprobe, ef_search)
+    cached = _result_cache.get(key)
+    if cached is None:
+        cached = _search_uncached(query_text, normalized_query, filters, num_recommendations, nprobe, ef_search)
+        _result_cache.set(key, cached)
+    return _for_query(cached, query_text, filters)
 
+def _prepare(query_text: str, parsed_intent: tuple) -> Tuple[Dict, str]:
     parsed_intent, error = parsed_intent
     if error:
-        print(f"Warning: Gemini parser failed: '{error}'. Falling back to regex parser.")
-        parsed_intent = extract_filters_fallback(query_text, _filter_patterns)
-  
-
-    raw_filters = parsed_intent.get("filters", {})
+        print(f"Warning: Gemini parser failed: '{error}'. Falling back to the local parser.")
+        parsed_intent = parse_intent_locally(query_text, _catalog_stats)
     filters = {
         key: value.lower() if isinstance(value, str) else value
-        for key, value in raw_filters.items()
+        for key, value in parsed_intent.get("filters", {}).items()
     }
-    normalized_query = parsed_intent.get("normalized_query", query_text)
-
-    qvec = encoded_text_cpu(normalized_query)
-    scores, idx = _index.search(qvec, _top_k_faiss_search)
-    scores, idx = scores[0], idx[0]
-
-    valid_indices = idx >= 0
-    if not np.any(valid_indices): return None, []
-    ids = _idmap[idx[valid_indices]]
-    scores = scores[valid_indices]
-
-    hits = pd.DataFrame({"id": ids, "_score": scores})
-    hits = hits.merge(_catalog, on="id", how="inner")
-    if hits.empty: return None, []
-
-    hits = hits.sort_values("_score", ascending=False).drop_duplicates("id")
-    hits = hits.assign(similarity=(hits["_score"] * 100.0).round(2))
-
-   
-    strict_hits = apply_filters(hits, filters)
-    if not strict_hits.empty:
-        primary_row = strict_hits.iloc[0]
-        primary = build_product_dict(primary_row, query_text, filters, "primary from strict filter matches")
-        recos_df = strict_hits[strict_hits['id'] != primary['id']].head(num_recommendations)
-        recos = [build_product_dict(r, query_text, filters, "similar strict match") for _, r in recos_df.iterrows()]
+    return filters, parsed_intent.get("normalized_query", query_text)
+
+def search_many(requests: List[Dict]) -> List[Tuple[Optional[Dict], List[Dict]]]:
+    """
+    search_primary_and_recommendations for several queries at once. Each request is a dict of
+    that function's keyword arguments. Cache misses share one CLIP text encode and one
+    unfiltered FAISS search per (nprobe, ef_search); the filter cascade then runs on those
+    prefetched candidates and only falls back to its own FAISS call when too few pass.
+    """
+    data_load()
+    results: List[Optional[Tuple]] = [None] * len(requests)
+    misses = []
+    for n, req in enumerate(requests):
+        num_recommendations = req.get("num_recommendations", 5)
+        filters, normalized_query = _prepare(req["query_text"], req["parsed_intent"])
+        key = _result_key(filters, normalized_query, num_recommendations, req.get("nprobe"), req.get("ef_search"))
+        cached = _result_cache.get(key)
+        if cached is not None:
+            results[n] = _for_query(cached, req["query_text"], filters)
+        else:
+            misses.append((n, key, filters, normalized_query, num_recommendations))
+
+    if misses:
+        qvecs = encoded_text_cpu_batch([normalized_query for _, _, _, normalized_query, _ in misses])
+        groups: Dict[Tuple, List[int]] = {}
+        for m, (n, *_rest) in enumerate(misses):
+            groups.setdefault((requests[n].get("nprobe"), requests[n].get("ef_search")), []).append(m)
+        for (nprobe, ef_search), members in groups.items():
+            k = min(settings.SEARCH_PREFETCH_K, _index.ntotal)
+            scores, idx = _ann_search(qvecs[members], k, search_params(_index, nprobe, ef_search))
+            for row, m in enumerate(members):
+                n, key, filters, normalized_query, num_recommendations = misses[m]
+                computed = _search_uncached(requests[n]["query_text"], normalized_query, filters, num_recommendations,
+                                            nprobe, ef_search, qvec=qvecs[m:m + 1], prefetched=(scores[row], idx[row]))
+                _result_cache.set(key, computed)
+                results[n] = _for_query(computed, requests[n]["query_text"], filters)
+    return results
+
+def _search_uncached(
+    query_text: str,
+    normalized_query: str,
+    filters: Dict,
+    num_recommendations: int,
+    nprobe: Optional[int],
+    ef_search: Optional[int],
+    qvec: Optional[np.ndarray] = None,
+    prefetched: Optional[Tuple[np.ndarray, np.ndarray]] = None
+) -> Tuple[Optional[Dict], List[Dict]]:
+    """Strict -> price relaxed -> colour relaxed -> semantic cascade behind the result cache."""
+    if qvec is None:
+        qvec = encoded_text_cpu(normalized_query)
+
+    strict_hits = filtered_search(qvec, filters, num_recommendations + 1, nprobe, ef_search, prefetched)
+    if strict_hits:
+        primary = build_product_dict(strict_hits[0], query_text, filters, "primary from strict filter matches")
+        recos = [build_product_dict(r, query_text, filters, "similar strict match") for r in strict_hits[1:num_recommendations + 1]]
         return primary, recos
 
     
     filters_no_price = {k: v for k, v in filters.items() if k not in ["priceMin", "priceMax"]}
     if filters_no_price != filters:
-        price_relaxed_hits = apply_filters(hits, filters_no_price)
-        if not price_relaxed_hits.empty:
-            recos = [build_product_dict(r, query_text, filters, "fallback: price relaxed") for _, r in price_relaxed_hits.head(num_recommendations).iterrows()]
+        price_relaxed_hits = filtered_search(qvec, filters_no_price, num_recommendations, nprobe, ef_search, prefetched)
+        if price_relaxed_hits:
+            recos = [build_product_dict(r, query_text, filters, "fallback: price relaxed") for r in price_relaxed_hits]
             return None, recos
 
     
     filters_no_price_color = {k: v for k, v in filters_no_price.items() if k != "baseColour"}
     if filters_no_price_color != filters_no_price:
-        core_hits = apply_filters(hits, filters_no_price_color)
-        if not core_hits.empty:
-            recos = [build_product_dict(r, query_text, filters, "fallback: price and color relaxed") for _, r in core_hits.head(num_recommendations).iterrows()]
+        core_hits = filtered_search(qvec, filters_no_price_color, num_recommendations, nprobe, ef_search, prefetched)
+        if core_hits:
+            recos = [build_product_dict(r, query_text, filters, "fallback: price and color relaxed") for r in core_hits]
             return None, recos
         
     
-    recos = [build_product_dict(r, query_text, filters, "semantic fallback") for _, r in hits.head(num_recommendations).iterrows()]
+    hits = filtered_search(qvec, {}, num_recommendations, nprobe, ef_search, prefetched)
+    recos = [build_product_dict(r, query_text, filters, "semantic fallback") for r in hits]
     return None, recos
+def complete_the_look(product_id: str, k: int = 5) -> Optional[List[Dict]]:
+    """
+    Precomputed complements of a product (see build_complements.py), best first.
+    None when no up-to-date complement graph exists; [] when the product has no complements.
+    """
+    global _complements
+    data_load()
+    if _complements is None:
+        _complements = ComplementGraph.load(COMPLEMENTS_FILE, COMPLEMENTS_META_FILE, _idmap) or False
+    if _complements is False:
+        return None
+    pos = _store.position.get(str(product_id))
+    if pos is None:
+        return []
+    return [_store.record(p) for p in _complements.positions(pos, k)]
+
 def search_batch_and_find_primary(
-    parsed_intents: List[Dict]
+    parsed_intents: List[Dict],
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None
 ) -> List[Optional[Dict]]:
     """
     Performs a batch search for multiple queries at once for high efficiency.
@@ -225,38 +535,28 @@ def search_batch_and_find_primary(
     # 2. Perform a single, powerful FAISS search for all queries at once
     # k=100 means we get the top 100 candidates for EACH of the queries
     _top_k_faiss_search = 100
-    batch_scores, batch_idx = _index.search(embeddings, _top_k_faiss_search)
+    batch_scores, batch_idx = _ann_search(embeddings, _top_k_faiss_search, search_params(_index, nprobe, ef_search))
     
+    # 3. Filter every query's candidates at once on the (n_queries, k) matrices
+    filters_list = [
+        {key: value.lower() if isinstance(value, str) else value for key, value in (intent.get("filters") or {}).items()}
+        for intent in parsed_intents
+    ]
+    # candidates that exist in the catalog (ANN indexes pad short result lists with -1)
+    in_catalog = _store.mask_batch([{}] * len(filters_list), batch_idx)
+    keep = _store.mask_batch(filters_list, batch_idx)
+    # FAISS returns candidates best-first, so the best match is the first one passing the filters,
+    # falling back to the best unfiltered semantic hit if the filters yield no results
+    best = np.where(keep.any(axis=1), keep.argmax(axis=1), in_catalog.argmax(axis=1))
+    found = in_catalog.any(axis=1)
+
     results = []
-    # 3. Process the results for each query in the batch
     for i in range(len(query_texts)):
-        intent = parsed_intents[i]
-        filters = intent.get("filters", {})
-        
-        # Get the candidates for this specific query
-        ids = _idmap[batch_idx[i]]
-        scores = batch_scores[i]
-        
-        # Merge with catalog to get full product details
-        hits = pd.DataFrame({"id": ids, "_score": scores})
-        hits = hits.merge(_catalog, on="id", how="inner")
-        
-        if hits.empty:
-            results.append(None)
-            continue
-        
-        # Apply the specific filters for this query using the existing function
-        filtered_hits = apply_filters(hits, filters)
-        
-        # Fallback to unfiltered semantic hits if filters yield no results
-        final_hits = filtered_hits if not filtered_hits.empty else hits
-        
-        if final_hits.empty:
+        if not found[i]:
             results.append(None) # No match found for this query
             continue
-            
-        # Get the single best match after sorting and removing duplicates
-        best_hit = final_hits.sort_values("_score", ascending=False).drop_duplicates("id").iloc[0]
-        results.append(best_hit.to_dict())
+        best_hit = _store.record(batch_idx[i, best[i]])
+        best_hit["_score"] = float(batch_scores[i, best[i]])
+        results.append(best_hit)
         
-    return results
\ No newline at end of file
+    return results
@@ -0,0 +1,134 @@
+"""
+In-process micro-batching front end for search_engine.
+
+Concurrent callers (one per Streamlit session) submit queries; a single worker thread
+collects whatever arrives within SEARCH_BATCH_WINDOW_MS (or until SEARCH_MAX_BATCH
+queries are waiting) and answers the whole group with one search_engine.search_many
+call, i.e. one CLIP text forward pass and one FAISS search.
+
+    python train_model/search_service.py --clients 32 --queries 256
+"""
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+from train_model import search_engine
+
+
+class SearchService:
+    def __init__(self, window_ms: float = None, max_batch: int = None):
+        self.window = (settings.SEARCH_BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000.0
+        self.max_batch = max_batch or settings.SEARCH_MAX_BATCH
+        self._queue: "queue.Queue[Tuple[Dict, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="search-batcher", daemon=True)
+        self._thread.start()
+        self.batches = 0
+        self.queries = 0
+
+    def submit(self, query_text: str, num_recommendations: int = 5, parsed_intent: tuple = None,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Future:
+        """Queue a search_primary_and_recommendations call; the Future resolves to its (primary, recos)."""
+        future: Future = Future()
+        request = {"query_text": query_text, "num_recommendations": num_recommendations,
+                   "parsed_intent": parsed_intent, "nprobe": nprobe, "ef_search": ef_search}
+        self._queue.put((request, future))
+        return future
+
+    def search_primary_and_recommendations(self, query_text: str, num_recommendations: int = 5, parsed_intent: tuple = None,
+                                           nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Drop-in, blocking replacement for search_engine.search_primary_and_recommendations."""
+        return self.submit(query_text, num_recommendations, parsed_intent, nprobe, ef_search).result()
+
+    def _collect(self) -> List[Tuple[Dict, Future]]:
+        batch = [self._queue.get()]
+        closes_at = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            live = [(req, fut) for req, fut in batch if fut.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                results = search_engine.search_many([req for req, _ in live])
+            except Exception as e:
+                print(f"[SearchService] batch of {len(live)} failed ({e}); retrying its queries one at a time")
+                self._run_each(live)
+                continue
+            self.batches += 1
+            self.queries += len(live)
+            for (_, fut), result in zip(live, results):
+                fut.set_result(result)
+
+    def _run_each(self, live: List[Tuple[Dict, Future]]) -> None:
+        """Answer a failed batch request by request, so only the callers whose own query fails see the error."""
+        for req, fut in live:
+            try:
+                result = search_engine.search_many([req])[0]
+            except Exception as e:
+                fut.set_exception(e)
+            else:
+                fut.set_result(result)
+            self.batches += 1
+            self.queries += 1
+
+    def stats(self) -> Dict:
+        return {"batches": self.batches, "queries": self.queries,
+                "avg_batch": round(self.queries / self.batches, 2) if self.batches else 0.0}
+
+
+_service: Optional[SearchService] = None
+_service_lock = threading.Lock()
+
+def get_service() -> SearchService:
+    """The process-wide service, started on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = SearchService()
+    return _service
+
+
+def run_benchmark(clients: int = 32, n_queries: int = 256):
+    """Queries/sec with `clients` concurrent callers: direct calls vs. the micro-batching service."""
+    catalog = search_engine.load_catalog_frame()
+    texts = (catalog["baseColour"] + " " + catalog["articleType"] + " for " + catalog["gender"]).sample(
+        n=n_queries, replace=True, random_state=0).tolist()
+    intents = [({"filters": {}, "normalized_query": f"{t} #{i}"}, None) for i, t in enumerate(texts)]
+    search_engine.data_load()
+    service = SearchService()
+
+    for name, call in (("direct", search_engine.search_primary_and_recommendations),
+                       ("micro-batched", service.search_primary_and_recommendations)):
+        search_engine._result_cache.clear()
+        search_engine._text_cache.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(lambda qi: call(qi[0], parsed_intent=qi[1]), zip(texts, intents)))
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<14}{n_queries / elapsed:>8.1f} queries/s")
+    print(f"  service batches: {service.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=256)
+    args = parser.parse_args()
+    run_benchmark(args.clients, args.queries)
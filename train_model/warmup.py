@@ -0,0 +1,159 @@
+"""
+Background warmup of the search stack.
+
+start() loads everything the first search needs in a daemon thread: the heavy imports
+(torch, open_clip, the Gemini SDK), the CLIP text tower, the FAISS index, the catalog and the
+Gemini clients. The UI renders in the meantime and can show status(); a search issued
+before warmup has finished waits only for the stage it needs.
+
+    python train_model/warmup.py --query "red t-shirt for men"
+
+measures cold time-to-first-search in fresh processes, loading CLIP from the pretrained
+checkpoint and from the TorchScript text encoder (Config.TEXT_ENCODER_CACHE).
+"""
+import argparse
+import json
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+
+# imported by the UI before anything heavy, so close enough to process start
+_started = time.monotonic()
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_done = threading.Event()
+_stage: Optional[str] = None
+_timings: Dict[str, float] = {}
+_errors: Dict[str, str] = {}
+_first_search_s: Optional[float] = None
+
+
+def _imports() -> None:
+    import torch, open_clip  # noqa: F401
+    from train_model import search_engine, search_service  # noqa: F401
+    from genAI import query_intent, llm_gateway  # noqa: F401
+
+def _text_encoder() -> None:
+    from train_model import search_engine
+    search_engine.load_text_encoder()
+
+def _index() -> None:
+    from train_model import search_engine
+    search_engine.load_index()
+
+def _catalog() -> None:
+    from train_model import search_engine
+    search_engine.load_catalog()
+
+def _gemini() -> None:
+    from genAI import llm_gateway
+    llm_gateway.get_gateway().warmup()
+
+STAGES: List[Tuple[str, Callable[[], None]]] = [
+    ("imports", _imports),
+    ("text encoder", _text_encoder),
+    ("index", _index),
+    ("catalog", _catalog),
+    ("gemini clients", _gemini),
+]
+
+
+def _run() -> None:
+    global _stage
+    for name, load in STAGES:
+        _stage = name
+        started = time.perf_counter()
+        try:
+            load()
+        except Exception as e:
+            # later stages may still work (e.g. Gemini without an index); searches report the error themselves
+            _errors[name] = str(e)
+            print(f"[Warmup] {name} failed: {e}")
+        _timings[name] = round(time.perf_counter() - started, 3)
+    _stage = None
+    _done.set()
+    print(f"[Warmup] finished {time.monotonic() - _started:.1f}s after start: {_timings}")
+
+def start() -> None:
+    """Start the warmup thread; later calls (e.g. every Streamlit rerun) do nothing."""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="warmup", daemon=True)
+            _thread.start()
+
+def wait(timeout: Optional[float] = None) -> bool:
+    return _done.wait(timeout)
+
+def mark_search() -> None:
+    """Record time-to-first-search the first time a search completes in this process."""
+    global _first_search_s
+    if _first_search_s is None:
+        _first_search_s = round(time.monotonic() - _started, 3)
+        print(f"[Warmup] first search answered {_first_search_s:.1f}s after start")
+
+def status() -> Dict:
+    if _thread is None:
+        state = "idle"
+    elif not _done.is_set():
+        state = "warming"
+    else:
+        state = "failed" if _errors else "ready"
+    return {
+        "state": state,
+        "stage": _stage,
+        "elapsed_s": round(time.monotonic() - _started, 3),
+        "timings": dict(_timings),
+        "errors": dict(_errors),
+        "first_search_s": _first_search_s,
+    }
+
+
+def _probe(query: str) -> Dict[str, float]:
+    """Cold start in this process: every stage in order, then one search."""
+    timings = {}
+    for name, load in STAGES:
+        started = time.perf_counter()
+        load()
+        timings[name] = time.perf_counter() - started
+    from train_model import search_engine
+    started = time.perf_counter()
+    search_engine.search_primary_and_recommendations(query, parsed_intent=({"filters": {}, "normalized_query": query}, None))
+    timings["first search"] = time.perf_counter() - started
+    timings["total"] = sum(timings.values())
+    return timings
+
+def _cold_start(query: str, text_encoder_cache: bool) -> Dict[str, float]:
+    env = dict(os.environ, TEXT_ENCODER_CACHE="true" if text_encoder_cache else "false", EMBED_CACHE_PATH="")
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--probe", "--query", query],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def run_benchmark(query: str, repeats: int = 3):
+    from train_model.search_engine import TEXT_ENCODER_FILE
+    if not TEXT_ENCODER_FILE.exists():
+        _cold_start(query, True)  # writes the TorchScript encoder
+    runs = {name: [_cold_start(query, cache) for _ in range(repeats)]
+            for name, cache in (("checkpoint", False), ("torchscript", True))}
+    columns = [name for name, _ in STAGES] + ["first search", "total"]
+    print(f"cold time-to-first-search, median of {repeats} fresh processes (seconds)")
+    print(f"  {'':<13}" + "".join(f"{c:>16}" for c in columns))
+    for name, timings in runs.items():
+        medians = [sorted(t[c] for t in timings)[len(timings) // 2] for c in columns]
+        print(f"  {name:<13}" + "".join(f"{m:>16.2f}" for m in medians))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--query", default="red t-shirt for men")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        print(json.dumps(_probe(args.query)))
+    else:
+        run_benchmark(args.query, args.repeats)
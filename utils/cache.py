@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU mapping with hit/miss counters.
+    With ttl (seconds) set, entries also expire that long after they were stored;
+    set() accepts a per-entry ttl override; a ttl of 0 or None never expires.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] is not None and entry[0] <= time.monotonic():
+                del self._data[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            return entry is not _MISSING and (entry[0] is None or entry[0] > time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SQLiteStore:
+    """
+    Persistent key -> bytes store in a single SQLite table, safe to share between threads.
+    Used as the on-disk layer behind an LRUCache. Entries may carry a ttl (seconds,
+    wall clock) after which they are no longer returned and get purged on write.
+    """
+
+    def __init__(self, path: str, table: str = "cache"):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)")
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if "expires_at" not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN expires_at REAL")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        found: Dict[str, bytes] = {}
+        now = time.time()
+        with self._lock:
+            # stay below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({','.join('?' * len(chunk))})"
+                    " AND (expires_at IS NULL OR expires_at > ?)", chunk + [now]
+                ).fetchall()
+                found.update(rows)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self.set_many([(key, value)], ttl=ttl)
+
+    def set_many(self, items: Iterable[Tuple[str, bytes]], ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires = now + ttl if ttl else None
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, value, expires) for key, value in items],
+            )
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "path": self.path}
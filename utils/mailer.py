@@ -1,4 +1,9 @@
 import smtplib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
@@ -8,42 +13,281 @@ import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
 from config import settings
+from utils.outbox import PermanentError
 
 # from dotenv import load_dotenv
 
 # load_dotenv()
 
-def send_order_email(order, to_email, content):
-    try:
-        sender_email = settings.SMTP_USER
-        sender_display_name = settings.SMTP_FROM
-        sender_password = settings.SMTP_PASS
-        smtp_server = settings.SMTP_HOST
-        smtp_port = settings.SMTP_PORT
-
-        # print(f'from: {sender_email}, to: {to_email}, smpt: {smtp_server}, port: {smtp_port}')
-
-        if not sender_email or not sender_password:
-            print("Email Configuration not found. Please set SENDER_USER and SMTP_PASS environment variables.")
-            return False, "console"
-
-        message = MIMEMultipart("alternative")
-        message["Subject"] = content["subject"]
-        message["From"] = formataddr((sender_display_name, sender_email))
-        message["To"] = to_email
-        message.attach(MIMEText(content["text"], "plain"))
-        message.attach(MIMEText(content["html"], "html"))
-
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.ehlo()
-            server.starttls()
+class MailNotConfigured(PermanentError):
+    pass
+
+# the connection is gone or the server asks to try later: worth another attempt on a fresh session
+_RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class SMTPPool:
+    """
+    A few authenticated SMTP sessions kept open between messages, so a burst of orders pays
+    for the connect / EHLO / STARTTLS / AUTH handshake once per session instead of per email.
+    Sessions idle for longer than idle_timeout are replaced rather than reused (servers drop
+    them), and a session is recycled after max_messages so no server-side limit is hit.
+    """
+
+    def __init__(self, host, port=None, user=None, password=None, size=2, idle_timeout=60.0,
+                 max_messages=100, starttls=True, timeout=30.0):
+        self.host = host
+        self.port = int(port) if port else 0   # 0: smtplib's default port
+        self.user = user
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.starttls = starttls
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        # (session, last used at, messages sent on it)
+        self._idle = deque()
+        self.connections = 0
+        self.messages = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
             server.ehlo()
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, to_email, message.as_string())
+            if self.starttls:
+                server.starttls()
+                server.ehlo()
+            if self.user:
+                server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.connections += 1
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @contextmanager
+    def session(self):
+        """A pooled session as [server, messages sent]; the caller may swap in a fresh server."""
+        with self._slots:
+            entry = None
+            with self._lock:
+                while self._idle and entry is None:
+                    server, last_used, sent = self._idle.pop()
+                    if time.monotonic() - last_used > self.idle_timeout:
+                        self._close(server)
+                    else:
+                        entry = [server, sent]
+            if entry is None:
+                entry = [self._connect(), 0]
+            try:
+                yield entry
+            except BaseException:
+                if entry[0] is not None:
+                    self._close(entry[0])
+                raise
+            if entry[0] is None:
+                return
+            if entry[1] >= self.max_messages:
+                self._close(entry[0])
+            else:
+                with self._lock:
+                    self._idle.append((entry[0], time.monotonic(), entry[1]))
+
+    def send_many(self, messages):
+        """
+        Send [(from, to, message str)] over one session, in order. Returns one entry per
+        message: None when it was accepted, else the exception (PermanentError for 5xx replies).
+        A dropped connection is reopened once per message before giving up on it; after any
+        other error the session is discarded and the rest go over a fresh one.
+        """
+        results = []
+        with self.session() as entry:
+            for sender, to, message in messages:
+                for attempt in (1, 2):
+                    if entry[0] is None or entry[1] >= self.max_messages:
+                        if entry[0] is not None:
+                            self._close(entry[0])
+                        entry[:] = [None, 0]
+                        try:
+                            entry[:] = [self._connect(), 0]
+                        except Exception as connect_error:
+                            # nothing more can go over this session
+                            results.extend([connect_error] * (len(messages) - len(results)))
+                            return results
+                    try:
+                        entry[0].sendmail(sender, to, message)
+                        entry[1] += 1
+                        self.messages += 1
+                        results.append(None)
+                        break
+                    except _RECONNECT_ERRORS as e:
+                        self._close(entry[0])
+                        entry[:] = [None, 0]
+                        if attempt == 2:
+                            results.append(e)
+                            break
+                    except smtplib.SMTPRecipientsRefused as e:
+                        results.append(PermanentError(f"recipient refused: {e.recipients}"))
+                        break
+                    except smtplib.SMTPResponseException as e:
+                        results.append(PermanentError(f"{e.smtp_code} {e.smtp_error!r}") if e.smtp_code >= 500 else e)
+                        break
+                    except Exception as e:
+                        # e.g. ssl.SSLEOFError on a kept-alive TLS session: its state is unknown
+                        self._close(entry[0])
+                        entry[:] = [None, 0]
+                        results.append(e)
+                        break
+        return results
+
+    def send(self, sender, to, message):
+        error = self.send_many([(sender, to, message)])[0]
+        if error is not None:
+            raise error
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+
+    def stats(self):
+        return {"connections": self.connections, "messages": self.messages, "idle": len(self._idle)}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """The process-wide pool for Config.SMTP_*; raises MailNotConfigured without credentials."""
+    global _pool
+    if not settings.SMTP_USER or not settings.SMTP_PASS:
+        raise MailNotConfigured("Email Configuration not found. Please set SENDER_USER and SMTP_PASS environment variables.")
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPPool(settings.SMTP_HOST, settings.SMTP_PORT, settings.SMTP_USER, settings.SMTP_PASS,
+                             size=settings.SMTP_POOL_SIZE, idle_timeout=settings.SMTP_IDLE_TIMEOUT,
+                             max_messages=settings.SMTP_MAX_MESSAGES, starttls=settings.SMTP_STARTTLS)
+        return _pool
 
+def _build_message(to_email, content):
+    message = MIMEMultipart("alternative")
+    message["Subject"] = content["subject"]
+    message["From"] = formataddr((settings.SMTP_FROM, settings.SMTP_USER))
+    message["To"] = to_email
+    message.attach(MIMEText(content["text"], "plain"))
+    message.attach(MIMEText(content["html"], "html"))
+    return message
+
+def deliver_order_email(to_email, content):
+    """Send one email over a pooled SMTP session; raises on any failure (MailNotConfigured without credentials)."""
+    pool = get_pool()
+    pool.send(settings.SMTP_USER, to_email, _build_message(to_email, content).as_string())
+
+def send_order_email(order, to_email, content):
+    try:
+        deliver_order_email(to_email, content)
         print(f"Email sent successfully to {to_email}")
         return True, "smtp"
-
+    except MailNotConfigured as e:
+        print(e)
+        return False, "console"
     except Exception as e:
         print(f"Error sending email: {e}")
-        return False, "console"
\ No newline at end of file
+        return False, "console"
+
+def _ensure_content(payload, state):
+    # generated content is kept in state, so a retry after an SMTP failure does not ask Gemini again
+    if "content" not in state:
+        from genAI import mail_generation
+        content, err = mail_generation.generate_order_email_content(payload["order"], payload["returning"])
+        if err:
+            # generate_order_email_content already fell back to the template text
+            state["generation_error"] = str(err)
+        state["content"] = content
+
+def order_email_job(payload, state):
+    """Outbox handler for one "order_email" job ({"order", "to", "returning"})."""
+    _ensure_content(payload, state)
+    deliver_order_email(payload["to"], state["content"])
+    print(f"Email sent successfully to {payload['to']}")
+
+def order_email_batch(jobs):
+    """
+    Outbox batch handler for "order_email": writes the missing contents concurrently, then
+    sends every email over one pooled SMTP session. Returns one error (or None) per job.
+    """
+    pool = get_pool()
+    errors = [None] * len(jobs)
+
+    def prepare(i):
+        try:
+            _ensure_content(jobs[i]["payload"], jobs[i]["state"])
+        except Exception as e:
+            errors[i] = e
+    with ThreadPoolExecutor(max_workers=min(8, len(jobs))) as executor:
+        list(executor.map(prepare, range(len(jobs))))
+
+    ready = [i for i in range(len(jobs)) if errors[i] is None]
+    messages = [(settings.SMTP_USER, jobs[i]["payload"]["to"],
+                 _build_message(jobs[i]["payload"]["to"], jobs[i]["state"]["content"]).as_string()) for i in ready]
+    for i, error in zip(ready, pool.send_many(messages)):
+        errors[i] = error
+    sent = sum(error is None for error in errors)
+    print(f"Sent {sent}/{len(jobs)} order emails over one SMTP session")
+    return errors
+
+
+def run_benchmark(messages=500, pool_size=2, batch=50):
+    """
+    messages/sec against a local aiosmtpd server (no TLS or AUTH, so real servers gain more):
+    a new connection per email, as before, vs. pooled sessions sending batches.
+    """
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.handlers import Sink
+
+    import socket
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        host, port = probe.getsockname()
+    controller = Controller(Sink(), hostname=host, port=port)
+    controller.start()
+    content = {"subject": "Order confirmation", "text": "Thank you for your order!\n" * 20, "html": "<p>Thank you!</p>" * 20}
+    message = _build_message("customer@example.com", content).as_string()
+    try:
+        started = time.perf_counter()
+        for _ in range(messages):
+            with smtplib.SMTP(host, port) as server:
+                server.ehlo()
+                server.sendmail("shop@example.com", "customer@example.com", message)
+        per_email = messages / (time.perf_counter() - started)
+
+        pool = SMTPPool(host, port, size=pool_size, starttls=False)
+        chunks = [[("shop@example.com", "customer@example.com", message)] * batch for _ in range(messages // batch)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            failed = sum(e is not None for errors in executor.map(pool.send_many, chunks) for e in errors)
+        pooled = batch * len(chunks) / (time.perf_counter() - started)
+        pool.close()
+    finally:
+        controller.stop()
+    print(f"{messages} emails to a local SMTP server")
+    print(f"  connection per email   {per_email:>8.0f} messages/s")
+    print(f"  pooled, batches of {batch:<4}{pooled:>8.0f} messages/s  ({pool.connections} connections, {failed} failed)")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="SMTP throughput: per-email connections vs. the pooled transport (needs aiosmtpd).")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--batch", type=int, default=50)
+    args = parser.parse_args()
+    run_benchmark(args.messages, args.pool_size, args.batch)
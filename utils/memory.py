@@ -0,0 +1,31 @@
+from typing import Dict
+
+# FILE: memory.py
+# Resident memory of the current process, read from /proc (Linux). "anon" is private heap,
+# "file" is memory-mapped files that other processes can share, and "pss" charges each shared
+# page to the processes mapping it in equal parts, so summing pss over workers gives their
+# real footprint.
+
+_STATUS_FIELDS = {"VmRSS": "rss", "RssAnon": "anon", "RssFile": "file"}
+
+
+def _read_kb(path: str, fields: Dict[str, str]) -> Dict[str, float]:
+    values = {}
+    with open(path, encoding="ascii") as fh:
+        for line in fh:
+            name, _, rest = line.partition(":")
+            if name in fields:
+                values[fields[name]] = round(int(rest.split()[0]) / 1024.0, 1)
+    return values
+
+def process_memory() -> Dict[str, float]:
+    """rss / anon / file / pss of this process in MiB; empty where /proc is unavailable."""
+    try:
+        memory = _read_kb("/proc/self/status", _STATUS_FIELDS)
+    except OSError:
+        return {}
+    try:
+        memory.update(_read_kb("/proc/self/smaps_rollup", {"Pss": "pss"}))
+    except OSError:
+        pass
+    return memory
@@ -0,0 +1,114 @@
+"""
+Order reports computed inside SQLite, so they run in constant memory whatever the size of
+the order history: only the aggregated rows come back to Python.
+
+    python utils/order_analytics.py --days 1                      # yesterday (UTC), e.g. from a nightly cron
+    python utils/order_analytics.py --since 2025-09-01 --until 2025-10-01 --format csv --report skus
+"""
+import argparse
+import csv
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.order_store import OrderStore, to_timestamp
+
+
+def _where(since: Any, until: Any, alias: str = "") -> Tuple[str, List[str]]:
+    clauses, params = [], []
+    if since is not None:
+        clauses.append(f"{alias}created_at >= ?"); params.append(to_timestamp(since))
+    if until is not None:
+        clauses.append(f"{alias}created_at < ?"); params.append(to_timestamp(until))
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+def _rows(store: OrderStore, columns: List[str], sql: str, params: List) -> List[Dict[str, Any]]:
+    return [dict(zip(columns, row)) for row in store.select(sql, params)]
+
+
+def revenue_by_day(store: OrderStore, since: Any = None, until: Any = None) -> List[Dict[str, Any]]:
+    """Per UTC day: orders, subtotal, discount and total revenue."""
+    where, params = _where(since, until)
+    return _rows(store, ["day", "orders", "subtotal", "discount", "revenue"],
+                 "SELECT substr(created_at, 1, 10) AS day, count(*), round(sum(subtotal), 2),"
+                 f" round(sum(discount_amount), 2), round(sum(total), 2) FROM orders{where}"
+                 " GROUP BY day ORDER BY day", params)
+
+def discount_totals_by_rule(store: OrderStore, since: Any = None, until: Any = None) -> List[Dict[str, Any]]:
+    """Per discount rule name in discount_breakdown: how many orders got it and the amount given."""
+    where, params = _where(since, until, "o.")
+    return _rows(store, ["rule", "orders", "amount"],
+                 "SELECT json_extract(d.value, '$.name') AS rule, count(*), round(sum(json_extract(d.value, '$.amount')), 2)"
+                 f" FROM orders o, json_each(o.discount_breakdown) d{where}"
+                 " GROUP BY rule ORDER BY 3 DESC", params)
+
+def top_skus(store: OrderStore, since: Any = None, until: Any = None, limit: int = 10) -> List[Dict[str, Any]]:
+    """Best-selling products by units, from the order lines."""
+    where, params = _where(since, until, "o.")
+    return _rows(store, ["product_id", "title", "units", "orders", "revenue"],
+                 "SELECT i.product_id, max(i.title), sum(i.qty), count(DISTINCT i.order_id), round(sum(i.qty * i.price), 2)"
+                 f" FROM order_items i JOIN orders o ON o.order_id = i.order_id{where}"
+                 " GROUP BY i.product_id ORDER BY 3 DESC, 5 DESC LIMIT ?", params + [limit])
+
+REPORTS = {
+    "revenue": revenue_by_day,
+    "discounts": discount_totals_by_rule,
+    "skus": top_skus,
+}
+
+
+def _print_table(name: str, rows: List[Dict[str, Any]]) -> None:
+    print(f"== {name} ==")
+    if not rows:
+        print("  (no orders)")
+        return
+    columns = list(rows[0])
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in columns]
+    print("  " + "  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in rows:
+        print("  " + "  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+def run_reports(store: OrderStore, reports: List[str], since: Any = None, until: Any = None,
+                top: int = 10, fmt: str = "text") -> Dict[str, List[Dict[str, Any]]]:
+    results = {}
+    for name in reports:
+        kwargs = {"limit": top} if name == "skus" else {}
+        results[name] = REPORTS[name](store, since=since, until=until, **kwargs)
+    if fmt == "json":
+        print(json.dumps({"since": to_timestamp(since) if since else None,
+                          "until": to_timestamp(until) if until else None, **results}, indent=2))
+    elif fmt == "csv":
+        writer = csv.writer(sys.stdout)
+        for name, rows in results.items():
+            if rows:
+                writer.writerow(["report"] + list(rows[0]))
+                writer.writerows([name] + list(r.values()) for r in rows)
+    else:
+        for name, rows in results.items():
+            _print_table(name, rows)
+    return results
+
+
+if __name__ == "__main__":
+    from config import settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=settings.ORDER_DB_PATH)
+    parser.add_argument("--since", help="ISO date or timestamp (inclusive)")
+    parser.add_argument("--until", help="ISO date or timestamp (exclusive)")
+    parser.add_argument("--days", type=int, help="the last N full UTC days; overrides --since/--until")
+    parser.add_argument("--report", choices=list(REPORTS) + ["all"], default="all")
+    parser.add_argument("--top", type=int, default=10, help="rows in the skus report")
+    parser.add_argument("--format", choices=["text", "csv", "json"], default="text")
+    args = parser.parse_args()
+
+    since: Optional[Any] = args.since
+    until: Optional[Any] = args.until
+    if args.days:
+        until = datetime.now(timezone.utc).date()
+        since = until - timedelta(days=args.days)
+    store = OrderStore(args.db)
+    run_reports(store, list(REPORTS) if args.report == "all" else [args.report], since, until, args.top, args.format)
+    store.close()
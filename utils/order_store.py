@@ -0,0 +1,405 @@
+"""
+Order repository: SQLite in WAL mode, one row per order in `orders` and one per cart line
+in `order_items`, indexed by customer email, date and product.
+
+Concurrent checkouts (one per Streamlit session) hand their order to a single writer thread,
+which commits everything that is waiting in one transaction, so N simultaneous orders cost
+one commit instead of N contending ones. Readers never block on the writer (WAL).
+
+    python utils/order_store.py migrate                  # import output/orders.csv (also done on first open)
+    python utils/order_store.py bench --threads 16       # checkout write latency under concurrency
+"""
+import argparse
+import ast
+import csv
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+ORDER_FIELDS = ["order_id", "created_at", "customer_name", "email", "address",
+                "subtotal", "discount_amount", "discount_breakdown", "total", "items"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    customer_name TEXT,
+    email TEXT,
+    email_key TEXT NOT NULL,
+    address TEXT,
+    subtotal REAL NOT NULL DEFAULT 0,
+    discount_amount REAL NOT NULL DEFAULT 0,
+    discount_breakdown TEXT NOT NULL DEFAULT '[]',
+    total REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS orders_email_key ON orders (email_key);
+CREATE INDEX IF NOT EXISTS orders_created_at ON orders (created_at);
+CREATE TABLE IF NOT EXISTS order_items (
+    order_id TEXT NOT NULL REFERENCES orders (order_id) ON DELETE CASCADE,
+    line INTEGER NOT NULL,
+    product_id TEXT,
+    title TEXT,
+    size TEXT,
+    qty INTEGER NOT NULL DEFAULT 1,
+    price REAL NOT NULL DEFAULT 0,
+    master_category TEXT,
+    item TEXT NOT NULL,
+    PRIMARY KEY (order_id, line)
+);
+CREATE INDEX IF NOT EXISTS order_items_product_id ON order_items (product_id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def normalize_email(email: Any) -> str:
+    return str(email or "").strip().casefold()
+
+def _float(value: Any) -> float:
+    try:
+        return float(value or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def to_timestamp(value: Any) -> str:
+    """A date, datetime or ISO string as the created_at format, for range comparisons."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # with WAL, NORMAL only syncs at checkpoints: a commit survives an app crash, not a power cut
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+def _item_row(order_id: str, line: int, item: Dict[str, Any]) -> tuple:
+    price = item.get("price")
+    if price is None:
+        price = item.get("price_inr") or item.get("priceInr")
+    try:
+        qty = int(item.get("qty") or item.get("quantity") or 1)
+    except (TypeError, ValueError):
+        qty = 1
+    return (order_id, line, str(item.get("id", "")), item.get("title") or item.get("name"), item.get("size"),
+            qty, _float(price), item.get("masterCategory"), json.dumps(item, default=str))
+
+def _order_rows(order: Dict[str, Any]) -> Tuple[tuple, List[tuple]]:
+    head = (order["order_id"], order["created_at"], order.get("customer_name", ""), order.get("email", ""),
+            normalize_email(order.get("email")), order.get("address", ""), _float(order.get("subtotal")),
+            _float(order.get("discount_amount")), json.dumps(order.get("discount_breakdown") or []),
+            _float(order.get("total")))
+    items = [_item_row(order["order_id"], line, item) for line, item in enumerate(order.get("items") or [])]
+    return head, items
+
+
+class OrderStore:
+    def __init__(self, path: str, max_batch: int = 64):
+        self.path = path
+        self.max_batch = max_batch
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._read_lock = threading.Lock()
+        self._reader = _connect(path)
+        with self._reader:
+            self._reader.executescript(_SCHEMA)
+        self._queue: "queue.Queue[Optional[Tuple[Dict, Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+        self._thread.start()
+        self.batches = 0
+        self.orders_written = 0
+
+    # ---------- writes ----------
+    def submit(self, order: Dict[str, Any]) -> Future:
+        """Queue an order (with order_id and created_at set); the Future resolves once it is committed."""
+        future: Future = Future()
+        self._queue.put((order, future))
+        return future
+
+    def save(self, order: Dict[str, Any]) -> Dict[str, Any]:
+        self.submit(order).result()
+        return order
+
+    def _run(self) -> None:
+        writer = _connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            # no waiting window: whatever queued up during the previous commit goes in this one
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [entry for entry in batch if entry is not None and entry[1].set_running_or_notify_cancel()]
+            if batch:
+                self._write(writer, batch)
+            if stop:
+                writer.close()
+                return
+
+    def _write(self, writer: sqlite3.Connection, batch: List[Tuple[Dict, Future]]) -> None:
+        try:
+            with writer:
+                self._insert(writer, [order for order, _ in batch])
+        except Exception:
+            # one bad order must not fail the others: retry them one transaction each
+            for order, future in batch:
+                try:
+                    with writer:
+                        self._insert(writer, [order])
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(order)
+            return
+        self.batches += 1
+        self.orders_written += len(batch)
+        for order, future in batch:
+            future.set_result(order)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, orders: List[Dict[str, Any]], skip_existing: bool = False) -> int:
+        verb = "INSERT OR IGNORE" if skip_existing else "INSERT"
+        written = 0
+        for order in orders:
+            head, items = _order_rows(order)
+            cursor = conn.execute(f"{verb} INTO orders VALUES ({','.join('?' * len(head))})", head)
+            if cursor.rowcount:
+                conn.executemany(f"INSERT INTO order_items VALUES ({','.join('?' * 9)})", items)
+                written += 1
+        return written
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        with self._read_lock:
+            self._reader.close()
+
+    # ---------- reads ----------
+    def has_customer(self, email: str) -> bool:
+        key = normalize_email(email)
+        if not key:
+            return False
+        with self._read_lock:
+            return self._reader.execute("SELECT 1 FROM orders WHERE email_key = ? LIMIT 1", (key,)).fetchone() is not None
+
+    def _assemble(self, rows: List[tuple]) -> List[Dict[str, Any]]:
+        """orders rows (ORDER_FIELDS minus items, in table order) -> order dicts with their items."""
+        orders = []
+        for row in rows:
+            order = dict(zip(["order_id", "created_at", "customer_name", "email", "address",
+                              "subtotal", "discount_amount", "discount_breakdown", "total"], row))
+            order["discount_breakdown"] = json.loads(order["discount_breakdown"] or "[]")
+            order["items"] = []
+            orders.append(order)
+        if orders:
+            by_id = {order["order_id"]: order for order in orders}
+            ids = list(by_id)
+            with self._read_lock:
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    for order_id, item in self._reader.execute(
+                            f"SELECT order_id, item FROM order_items WHERE order_id IN ({','.join('?' * len(chunk))})"
+                            " ORDER BY order_id, line", chunk):
+                        by_id[order_id]["items"].append(json.loads(item))
+        return orders
+
+    _ORDER_COLUMNS = "order_id, created_at, customer_name, email, address, subtotal, discount_amount, discount_breakdown, total"
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        with self._read_lock:
+            rows = self._reader.execute(f"SELECT {self._ORDER_COLUMNS} FROM orders WHERE order_id = ?", (order_id,)).fetchall()
+        orders = self._assemble(rows)
+        return orders[0] if orders else None
+
+    def iter_orders(self, since: Any = None, until: Any = None, email: Optional[str] = None,
+                    chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        Orders with since <= created_at < until (dates, datetimes or ISO strings), optionally of
+        one customer, oldest first. Read chunk_size orders at a time, so memory stays bounded
+        however long the history is; the read lock is not held between chunks.
+        """
+        where, params = [], []
+        if since is not None:
+            where.append("created_at >= ?"); params.append(to_timestamp(since))
+        if until is not None:
+            where.append("created_at < ?"); params.append(to_timestamp(until))
+        if email is not None:
+            where.append("email_key = ?"); params.append(normalize_email(email))
+        after: Tuple = ()
+        while True:
+            # keyset pagination: resume after the last (created_at, order_id) seen
+            page = where + (["(created_at, order_id) > (?, ?)"] if after else [])
+            sql = (f"SELECT {self._ORDER_COLUMNS} FROM orders" + (" WHERE " + " AND ".join(page) if page else "")
+                   + " ORDER BY created_at, order_id LIMIT ?")
+            with self._read_lock:
+                rows = self._reader.execute(sql, params + list(after) + [chunk_size]).fetchall()
+            yield from self._assemble(rows)
+            if len(rows) < chunk_size:
+                return
+            after = (rows[-1][1], rows[-1][0])
+
+    def all_orders(self) -> List[Dict[str, Any]]:
+        return list(self.iter_orders())
+
+    def select(self, sql: str, params: Sequence = ()) -> List[tuple]:
+        """Run a read-only query (e.g. an aggregate) on the reader connection."""
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def __len__(self) -> int:
+        with self._read_lock:
+            return self._reader.execute("SELECT count(*) FROM orders").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"batches": self.batches, "orders": self.orders_written,
+                "avg_batch": round(self.orders_written / self.batches, 2) if self.batches else 0.0}
+
+    # ---------- legacy CSV ----------
+    def meta(self, key: str) -> Optional[str]:
+        with self._read_lock:
+            row = self._reader.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def migrate_csv(self, csv_path: str) -> Tuple[int, int]:
+        """
+        Import a legacy orders.csv; returns (imported, skipped). Orders already in the store are
+        left alone, so running it twice is harmless.
+        """
+        orders, skipped = read_legacy_csv(csv_path)
+        with self._read_lock, self._reader:
+            imported = self._insert(self._reader, orders, skip_existing=True)
+            self._reader.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)", (csv_path,))
+        return imported, skipped
+
+
+def _parse_blob(text: str) -> Any:
+    """JSON, or the Python repr older builds wrote for items."""
+    if not text:
+        return []
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return None
+
+def read_legacy_csv(csv_path: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Orders from a legacy CSV. The header of older files lacks discount_breakdown while newer
+    rows were appended with it, so each record is mapped by its own field count.
+    """
+    orders: List[Dict[str, Any]] = []
+    skipped = 0
+    if not os.path.exists(csv_path):
+        return orders, skipped
+    with open(csv_path, "r", newline="", encoding="utf-8") as fh:
+        reader = csv.reader(fh)
+        header = next(reader, None) or []
+        for record in reader:
+            if len(record) == len(header):
+                row = dict(zip(header, record))
+            elif len(record) == len(ORDER_FIELDS):
+                row = dict(zip(ORDER_FIELDS, record))
+            else:
+                skipped += 1
+                continue
+            items = _parse_blob(row.get("items", ""))
+            breakdown = _parse_blob(row.get("discount_breakdown", ""))
+            if not row.get("order_id") or not isinstance(items, list) or not items:
+                skipped += 1
+                continue
+            orders.append({
+                "order_id": row["order_id"],
+                "created_at": row.get("created_at", ""),
+                "customer_name": row.get("customer_name", ""),
+                "email": (row.get("email") or "").strip(),
+                "address": row.get("address", ""),
+                "subtotal": _float(row.get("subtotal")),
+                "discount_amount": _float(row.get("discount_amount")),
+                "discount_breakdown": breakdown if isinstance(breakdown, list) else [],
+                "total": _float(row.get("total")),
+                "items": items,
+            })
+    return orders, skipped
+
+
+def open_store(path: str, legacy_csv: Optional[str] = None, max_batch: int = 64) -> OrderStore:
+    """An OrderStore; the first time a database is opened it imports legacy_csv, if one exists."""
+    store = OrderStore(path, max_batch=max_batch)
+    if legacy_csv and store.meta("migrated_from") is None:
+        imported, skipped = store.migrate_csv(legacy_csv)
+        if imported or skipped:
+            print(f"[OK] Migrated {imported} orders from {legacy_csv} ({skipped} unreadable rows skipped)")
+    return store
+
+
+def run_benchmark(path: str, threads: int = 16, n_orders: int = 2000):
+    """Checkout write latency with `threads` concurrent sessions, each saving its own orders."""
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    store = OrderStore(path)
+    item = {"id": "12053", "title": "Spykar Men Printed White T-Shirts", "masterCategory": "Apparel",
+            "price": 1158.0, "size": "M", "qty": 1, "image": "data/images/12053.jpg"}
+
+    def checkout(i: int) -> float:
+        order = {"order_id": str(uuid.uuid4()), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                 "customer_name": "bench", "email": f"user{i % 500}@example.com", "address": "-",
+                 "subtotal": 1158.0, "discount_amount": 0.0, "discount_breakdown": [], "total": 1158.0,
+                 "items": [item, dict(item, id="41990", qty=2)]}
+        started = time.perf_counter()
+        store.save(order)
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = sorted(pool.map(checkout, range(n_orders)))
+    elapsed = time.perf_counter() - started
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    print(f"{threads} threads, {n_orders} orders: {n_orders / elapsed:.0f} orders/s, "
+          f"latency p50 {pct(0.5):.2f} ms, p99 {pct(0.99):.2f} ms, max {latencies[-1]:.2f} ms")
+    print(f"  writer: {store.stats()}")
+    store.close()
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    from config import settings
+    from utils.orders import ORDERS_FILE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="import a legacy orders CSV")
+    migrate.add_argument("--csv", default=ORDERS_FILE)
+    migrate.add_argument("--db", default=settings.ORDER_DB_PATH)
+    bench = sub.add_parser("bench", help="concurrent checkout write latency (uses a scratch database)")
+    bench.add_argument("--db", default=os.path.join("output", "orders_bench.sqlite"))
+    bench.add_argument("--threads", type=int, default=16)
+    bench.add_argument("--orders", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        store = OrderStore(args.db)
+        imported, skipped = store.migrate_csv(args.csv)
+        print(f"[OK] {imported} orders imported from {args.csv}, {skipped} skipped; {len(store)} in {args.db}")
+        store.close()
+    else:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+        run_benchmark(args.db, args.threads, args.orders)
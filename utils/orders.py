@@ -1,19 +1,19 @@
 import os
-import csv
 import json
+import sqlite3
+import sys
 import uuid
+import threading
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Iterator, Tuple, Optional
 
-# reportlab imports (you already had these)
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import mm
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+from utils.order_store import OrderStore, open_store
 
 # ---------- config ----------
 OUTPUT_DIR: str = "output"
+# legacy append-only CSV; imported into the order store the first time it is opened
 ORDERS_FILE: str = os.path.join(OUTPUT_DIR, "orders.csv")
 ENCODING: str = "utf-8"
 
@@ -38,61 +38,29 @@ DEFAULT_RULES = {
 # ensure output dir
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+_store: Optional[OrderStore] = None
+_store_lock = threading.Lock()
+
 # ---------- helpers ----------
-def _ensure_orders_csv():
-    """Create orders CSV if missing (with header)."""
-    if not os.path.exists(ORDERS_FILE):
-        os.makedirs(os.path.dirname(ORDERS_FILE), exist_ok=True)
-        with open(ORDERS_FILE, "w", newline="", encoding=ENCODING) as fh:
-            writer = csv.DictWriter(
-                fh,
-                fieldnames=[
-                    "order_id",
-                    "created_at",
-                    "customer_name",
-                    "email",
-                    "address",
-                    "subtotal",
-                    "discount_amount",
-                    "discount_breakdown",
-                    "total",
-                    "items",
-                ],
-            )
-            writer.writeheader()
+def _order_store() -> OrderStore:
+    """The process-wide order store; on first use it imports the legacy ORDERS_FILE CSV, if any."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = open_store(settings.ORDER_DB_PATH, legacy_csv=ORDERS_FILE, max_batch=settings.ORDER_WRITE_BATCH)
+        return _store
+
+def iter_orders(since: Any = None, until: Any = None, email: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Saved orders, oldest first, with since <= created_at < until (dates, datetimes or ISO strings)
+    and optionally only those of one email. Streams from the store in chunks; items and
+    discount_breakdown are lists.
+    """
+    return _order_store().iter_orders(since=since, until=until, email=email)
 
 def _load_orders() -> List[Dict[str, Any]]:
-    """Load saved orders and parse JSON columns."""
-    if not os.path.exists(ORDERS_FILE):
-        return []
-    orders: List[Dict[str, Any]] = []
-    with open(ORDERS_FILE, "r", encoding=ENCODING) as fh:
-        reader = csv.DictReader(fh)
-        for row in reader:
-            # parse JSON columns
-            try:
-                row["discount_breakdown"] = json.loads(row.get("discount_breakdown") or "[]")
-            except Exception:
-                row["discount_breakdown"] = []
-            try:
-                row["items"] = json.loads(row.get("items") or "[]")
-            except Exception:
-                row["items"] = []
-            # Convert numeric fields if needed
-            try:
-                row["subtotal"] = float(row.get("subtotal") or 0.0)
-            except Exception:
-                row["subtotal"] = 0.0
-            try:
-                row["discount_amount"] = float(row.get("discount_amount") or 0.0)
-            except Exception:
-                row["discount_amount"] = 0.0
-            try:
-                row["total"] = float(row.get("total") or 0.0)
-            except Exception:
-                row["total"] = 0.0
-            orders.append(row)
-    return orders
+    """All saved orders as a list; prefer iter_orders for anything but small histories."""
+    return list(iter_orders())
 
 # ---------- returning customer ----------
 def is_returning_customer(email: str) -> bool:
@@ -101,9 +69,7 @@ def is_returning_customer(email: str) -> bool:
     """
     if not email:
         return False
-    orders = _load_orders()
-    emails = {o.get("email", "").strip().casefold() for o in orders}
-    return str(email).strip().casefold() in emails
+    return _order_store().has_customer(email)
 
 # ---------- subtotal helper ----------
 def _sum_subtotal(cart: List[Dict[str, Any]]) -> float:
@@ -246,12 +212,9 @@ def compute_totals(cart: List[Dict[str, Any]], returning: bool) -> Dict[str, Any
 # ---------- save order ----------
 def save_order(order: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Persist an order to ORDERS_FILE (CSV). Adds order_id and created_at if missing.
-    Serializes JSON fields (items, discount_breakdown).
-    Returns the enriched order dict.
+    Persist an order to the order store (Config.ORDER_DB_PATH). Adds order_id and created_at if missing.
+    Returns the enriched order dict once it is committed.
     """
-    _ensure_orders_csv()
-
     # enrich the order
     if not order.get("order_id"):
         order["order_id"] = str(uuid.uuid4())
@@ -271,26 +234,11 @@ def save_order(order: Dict[str, Any]) -> Dict[str, Any]:
         # do not save empty orders
         raise ValueError("Order has no items; refusing to save.")
 
-    row: Dict[str, Any] = {
-        "order_id": order["order_id"],
-        "created_at": order["created_at"],
-        "customer_name": order.get("customer_name", ""),
-        "email": order.get("email", ""),
-        "address": order.get("address", ""),
-        "subtotal": float(order.get("subtotal") or 0.0),
-        "discount_amount": float(order.get("discount_amount") or 0.0),
-        "discount_breakdown": json.dumps(order.get("discount_breakdown") or []),
-        "total": float(order.get("total") or 0.0),
-        "items": json.dumps(items),
-    }
+    order["items"] = items
 
     try:
-        with open(ORDERS_FILE, mode="a", newline="", encoding=ENCODING) as fh:
-            writer = csv.DictWriter(fh, fieldnames=list(row.keys()))
-            # header already created by _ensure_orders_csv
-            writer.writerow(row)
-        return order
-    except (OSError, csv.Error, TypeError) as error:
+        return _order_store().save(order)
+    except (sqlite3.Error, TypeError, ValueError) as error:
         raise RuntimeError("failed to save order") from error
 
 # ---------- invoice generation ----------
@@ -298,6 +246,13 @@ def generate_invoice(order: Dict[str, Any], output_file: str) -> str:
     """
     Generate a PDF invoice using reportlab. Returns path to file.
     """
+    # reportlab is only needed here, so importing orders (e.g. at app start) stays cheap
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     filepath = os.path.join(OUTPUT_DIR, output_file)
 
@@ -0,0 +1,276 @@
+"""
+Durable local outbox for work that must not hold up a request, e.g. the order confirmation
+email (Gemini text + SMTP delivery) after checkout.
+
+enqueue() stores a job in SQLite and returns at once; a background worker picks due jobs
+up, runs the handler registered for their kind and retries failures with exponential
+backoff, up to Config.OUTBOX_MAX_ATTEMPTS. Jobs survive restarts: a job claimed by a
+worker that died is picked up again once its lease runs out.
+
+    python utils/outbox.py                  # counts per status and the failed jobs
+    python utils/outbox.py --retry-failed   # queue failed jobs again
+    python utils/outbox.py --run            # process jobs in the foreground
+"""
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+import sys, os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+
+
+class PermanentError(Exception):
+    """Raised by a handler when retrying cannot help (e.g. no SMTP credentials): the job fails at once."""
+
+
+# handler(payload, state): state is a dict the handler may fill in (e.g. generated email
+# content); it is saved even when the handler raises, so a retry can pick up where it left off
+Handler = Callable[[Dict[str, Any], Dict[str, Any]], None]
+# batch_handler(jobs) handles several jobs of one kind together (e.g. emails over one SMTP
+# session) and returns one exception, or None for success, per job
+BatchHandler = Callable[[List[Dict[str, Any]]], List[Optional[Exception]]]
+
+def _json_default(value):
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+class Outbox:
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        # autocommit mode, so claim() can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL,"
+                " key TEXT, payload TEXT NOT NULL, state TEXT NOT NULL DEFAULT '{}',"
+                " status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt_at REAL NOT NULL, locked_until REAL NOT NULL DEFAULT 0, last_error TEXT,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL, UNIQUE (kind, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        self._wakeup = threading.Event()
+
+    def enqueue(self, kind: str, key: Optional[str], payload: Dict[str, Any]) -> Optional[int]:
+        """Store a job; a second job with the same (kind, key) is ignored. Returns the job id."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (kind, key, payload, next_attempt_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", (kind, key, json.dumps(payload, default=_json_default), now, now, now))
+        self._wakeup.set()
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, limit: int, lease: float) -> List[Dict[str, Any]]:
+        """Due pending jobs, locked for `lease` seconds so no other worker takes them meanwhile."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, kind, key, payload, state, attempts FROM outbox WHERE status = 'pending'"
+                    " AND next_attempt_at <= ? AND locked_until <= ? ORDER BY next_attempt_at LIMIT ?",
+                    (now, now, limit)).fetchall()
+                self._conn.executemany("UPDATE outbox SET locked_until = ? WHERE id = ?", [(now + lease, row[0]) for row in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [{"id": r[0], "kind": r[1], "key": r[2], "payload": json.loads(r[3]), "state": json.loads(r[4]),
+                 "attempts": r[5]} for r in rows]
+
+    def _update(self, job_id: int, **fields) -> None:
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE outbox SET {columns} WHERE id = ?", list(fields.values()) + [job_id])
+
+    def complete(self, job: Dict[str, Any]) -> None:
+        self._update(job["id"], status="sent", attempts=job["attempts"] + 1, locked_until=0, last_error=None,
+                     state=json.dumps(job["state"], default=_json_default))
+
+    def fail(self, job: Dict[str, Any], error: str, retry_in: Optional[float]) -> None:
+        """Record a failed attempt; the job is retried after retry_in seconds, or marked failed when None."""
+        self._update(job["id"], status="pending" if retry_in is not None else "failed", attempts=job["attempts"] + 1,
+                     next_attempt_at=time.time() + (retry_in or 0), locked_until=0, last_error=error,
+                     state=json.dumps(job["state"], default=_json_default))
+
+    def retry_failed(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?"
+                                        " WHERE status = 'failed'", (time.time(),))
+        self._wakeup.set()
+        return cursor.rowcount
+
+    def jobs(self, status: str, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, kind, key, attempts, last_error, updated_at FROM outbox"
+                                      " WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)).fetchall()
+        return [dict(zip(("id", "kind", "key", "attempts", "last_error", "updated_at"), row)) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, count(*) FROM outbox GROUP BY status").fetchall())
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxWorker:
+    """
+    Background thread that runs due jobs on a small thread pool, with exponential backoff between
+    attempts. Kinds with a batch handler are run batch_size jobs at a time.
+    """
+
+    def __init__(self, outbox: Outbox, handlers: Dict[str, Handler], batch_handlers: Optional[Dict[str, BatchHandler]] = None,
+                 workers: int = None, batch_size: int = None, max_attempts: int = None,
+                 backoff: float = None, max_backoff: float = None, poll: float = None, lease: float = 300.0):
+        self.outbox = outbox
+        self.handlers = handlers
+        self.batch_handlers = batch_handlers or {}
+        self.workers = workers or settings.OUTBOX_WORKERS
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+        self.backoff = settings.OUTBOX_BACKOFF_S if backoff is None else backoff
+        self.max_backoff = settings.OUTBOX_MAX_BACKOFF_S if max_backoff is None else max_backoff
+        self.poll = settings.OUTBOX_POLL_S if poll is None else poll
+        self.lease = lease
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbox")
+        self._thread: Optional[threading.Thread] = None
+
+    def retry_delay(self, attempts: int) -> float:
+        """Seconds before attempt number attempts + 1: backoff * 2^(attempts - 1), capped, with jitter."""
+        return min(self.backoff * 2 ** (attempts - 1), self.max_backoff) * random.uniform(0.8, 1.2)
+
+    def _record(self, job: Dict[str, Any], error: Optional[BaseException]) -> None:
+        if error is None:
+            self.outbox.complete(job)
+        elif isinstance(error, PermanentError):
+            print(f"[Outbox] {job['kind']} {job['key']} failed permanently: {error}")
+            self.outbox.fail(job, str(error), None)
+        else:
+            attempts = job["attempts"] + 1
+            retry_in = self.retry_delay(attempts) if attempts < self.max_attempts else None
+            print(f"[Outbox] {job['kind']} {job['key']} attempt {attempts} failed: {error}"
+                  + (f"; retrying in {retry_in:.0f}s" if retry_in is not None else "; giving up"))
+            self.outbox.fail(job, f"{type(error).__name__}: {error}", retry_in)
+
+    def run_job(self, job: Dict[str, Any]) -> None:
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise PermanentError(f"no handler for job kind {job['kind']!r}")
+            handler(job["payload"], job["state"])
+        except Exception as e:
+            self._record(job, e)
+        else:
+            self._record(job, None)
+
+    def run_batch(self, jobs: List[Dict[str, Any]]) -> None:
+        try:
+            errors = self.batch_handlers[jobs[0]["kind"]](jobs)
+            if len(errors) != len(jobs):
+                raise RuntimeError(f"{jobs[0]['kind']} batch handler returned {len(errors)} results for {len(jobs)} jobs")
+        except Exception as e:
+            errors = [e] * len(jobs)
+        for job, error in zip(jobs, errors):
+            self._record(job, error)
+
+    def run_once(self) -> int:
+        """Run every job that is due now (up to one claim); returns how many were run."""
+        jobs = self.outbox.claim(self.workers * self.batch_size, self.lease)
+        by_kind: Dict[str, List[Dict[str, Any]]] = {}
+        for job in jobs:
+            if job["kind"] in self.batch_handlers:
+                by_kind.setdefault(job["kind"], []).append(job)
+        futures = [self._pool.submit(self.run_job, job) for job in jobs if job["kind"] not in self.batch_handlers]
+        futures += [self._pool.submit(self.run_batch, group[i:i + self.batch_size])
+                    for group in by_kind.values() for i in range(0, len(group), self.batch_size)]
+        for future in futures:
+            future.result()
+        return len(jobs)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            # cleared before looking for jobs, so an enqueue() while run_once() runs still cuts the wait short
+            self.outbox._wakeup.clear()
+            try:
+                ran = self.run_once()
+            except sqlite3.Error as e:
+                print(f"[Outbox] claiming jobs failed: {e}")
+                ran = 0
+            if not ran:
+                # woken early by enqueue(); otherwise look again for retries that became due
+                self.outbox._wakeup.wait(self.poll)
+
+    def start(self) -> "OutboxWorker":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self.outbox._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._pool.shutdown(wait=True)
+
+
+_outbox: Optional[Outbox] = None
+_worker: Optional[OutboxWorker] = None
+_outbox_lock = threading.Lock()
+
+def get_outbox() -> Outbox:
+    """The process-wide outbox at Config.OUTBOX_PATH."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(settings.OUTBOX_PATH)
+        return _outbox
+
+def start_worker(handlers: Optional[Dict[str, Handler]] = None,
+                 batch_handlers: Optional[Dict[str, BatchHandler]] = None) -> OutboxWorker:
+    """Start the process-wide worker; later calls (e.g. every Streamlit rerun) return the running one."""
+    global _worker
+    outbox = get_outbox()
+    with _outbox_lock:
+        if _worker is None:
+            if handlers is None:
+                from utils import mailer
+                handlers = {"order_email": mailer.order_email_job}
+                batch_handlers = {"order_email": mailer.order_email_batch}
+            _worker = OutboxWorker(outbox, handlers, batch_handlers).start()
+        return _worker
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--retry-failed", action="store_true")
+    parser.add_argument("--run", action="store_true", help="process jobs until interrupted")
+    args = parser.parse_args()
+    outbox = get_outbox()
+    if args.retry_failed:
+        print(f"[OK] {outbox.retry_failed()} failed jobs queued again")
+    if args.run:
+        worker = start_worker()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            worker.stop()
+    print(f"{settings.OUTBOX_PATH}: {outbox.stats()}")
+    for job in outbox.jobs("failed"):
+        print(f"  failed #{job['id']} {job['kind']} {job['key']} after {job['attempts']} attempts: {job['last_error']}")
@@ -0,0 +1,57 @@
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
+from config import settings
+
+# FILE: search_client.py
+# Thin HTTP client for the search API (api.py). Standard library only, so the UI process
+# needs neither the CLIP model nor the index when Config.SEARCH_API_URL is set.
+
+
+class SearchClient:
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _call(self, method: str, path: str, payload: Optional[Dict] = None) -> Dict[str, Any]:
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(f"{self.base_url}{path}", data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"search API {method} {path} failed with {e.code}: {e.read().decode('utf-8', 'replace')}") from e
+        except urllib.error.URLError as e:
+            raise RuntimeError(f"search API at {self.base_url} is unreachable: {e.reason}") from e
+
+    def search(self, query: str, num_recommendations: int = 5) -> Tuple[Optional[Dict], List[Dict]]:
+        """(primary, recommendations), like search_engine.search_primary_and_recommendations."""
+        result = self._call("POST", "/search", {"query": query, "num_recommendations": num_recommendations})
+        return result["primary"], result["recommendations"]
+
+    def search_batch(self, queries: List[str]) -> List[Optional[Dict]]:
+        return self._call("POST", "/search/batch", {"queries": queries})["results"]
+
+    def stylist(self, product_id: str) -> List[Dict]:
+        """The complete-the-look outfit for a product."""
+        return self._call("GET", f"/stylist/{urllib.parse.quote(str(product_id))}")["items"]
+
+    def health(self) -> Dict[str, Any]:
+        return self._call("GET", "/health")
+
+
+_client: Optional[SearchClient] = None
+
+def get_client() -> SearchClient:
+    global _client
+    if _client is None:
+        _client = SearchClient(settings.SEARCH_API_URL, settings.SEARCH_API_TIMEOUT)
+    return _client